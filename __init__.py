@@ -1,24 +1,302 @@
+import json
+import asyncio
+
 from aiohttp import web
 from server import PromptServer
 
-from .src.defn import collect_defns
-from .src.make_json import create_schema_for_api
+from .src.defn import NodeFilter
+from .src.make_json import create_schema_for_api, create_options_for_api
 from .src.gen_stub import generate_stub
+from .src.validate import validate_prompt, prompt_class_types
+from .src.response_cache import ResponseCache, CachedResponse, CollectedDefns, etag_matches
+from .src.profiling import Timings, ProfileStats, phase, profile_enabled
+from .src.warmup import WarmUp, warmup_enabled
+
+
+_responses = ResponseCache()
+_collected = CollectedDefns()
+_stats = ProfileStats()
+
+
+def _timings(request: web.Request) -> Timings | None:
+    if profile_enabled() or request.query.get("profile") == "1":
+        return Timings()
+    return None
+
+
+def _node_filter(request: web.Request) -> NodeFilter | None:
+    """
+    node selection from the query parameters
+
+        ?nodes=KSampler,VAEDecode&category=loaders&pack=ComfyUI-Impact-Pack
+
+    each parameter may be repeated or comma-separated.
+    """
+
+    def values(key: str) -> list[str]:
+        return [v.strip() for item in request.query.getall(key, []) for v in item.split(",") if v.strip() != ""]
+
+    node_filter = NodeFilter(
+        names=frozenset(values("nodes")),
+        categories=tuple(values("category")),
+        packs=tuple(values("pack")),
+    )
+    return None if node_filter.is_empty() else node_filter
+
+
+def _max_options(request: web.Request) -> int | None:
+    """`max_options` query parameter: selections with more options are typed as plain strings"""
+
+    value = request.query.get("max_options")
+    if value is None:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        raise web.HTTPBadRequest(text="max_options must be an integer")
+
+
+def _endpoint(name: str, node_filter: NodeFilter | None, max_options: int | None = None) -> str:
+    key = name if node_filter is None else f"{name}?{node_filter.key()}"
+    return key if max_options is None else f"{key};max_options={max_options}"
+
+
+async def _respond(request: web.Request, entry: CachedResponse, timings: Timings | None = None) -> web.Response:
+    coding = entry.negotiate(request.headers.get("Accept-Encoding"))
+    headers = {
+        "ETag": entry.etag_for(coding),
+        "Vary": "Accept-Encoding",
+    }
+
+    if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+        return web.Response(status=304, headers=headers)
+
+    if not entry.is_encoded(coding):
+        # compressing a large stub takes a while; keep the event loop serving
+        with phase(timings, "encode"):
+            await asyncio.get_running_loop().run_in_executor(None, entry.encoded, coding)
+    body = entry.body if coding is None else entry.encoded(coding)
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+
+    if timings is not None:
+        headers["Server-Timing"] = timings.server_timing()
+
+    return web.Response(
+        body=body,
+        headers=headers,
+        content_type=entry.content_type,
+        charset=entry.charset,
+    )
+
+
+def _cached(
+    endpoint: str,
+    defns: list,
+    node_filter: NodeFilter | None,
+    render,
+    content_type: str,
+    timings: Timings | None,
+) -> CachedResponse:
+    with phase(timings, "fingerprint"):
+        key = _collected.fingerprint(defns, node_filter)
+
+    rendered = False
+
+    def render_and_encode() -> bytes:
+        nonlocal rendered
+        rendered = True
+        data = render()
+        with phase(timings, "encode"):
+            return data.encode("utf-8")
+
+    entry = _responses.get(endpoint, key, render_and_encode, content_type=content_type)
+    if timings is not None:
+        timings.cache = "miss" if rendered else "hit"
+    return entry
+
+
+def _schema_entry(
+    defns: list,
+    node_filter: NodeFilter | None,
+    max_options: int | None,
+    timings: Timings | None,
+) -> CachedResponse:
+    def render() -> str:
+        with phase(timings, "render_schema"):
+            schema = create_schema_for_api(defns, max_options=max_options)
+        with phase(timings, "encode"):
+            return json.dumps(schema)
+
+    return _cached(_endpoint("schema", node_filter, max_options), defns, node_filter, render, "application/json", timings)
+
+
+def _stub_entry(
+    defns: list,
+    node_filter: NodeFilter | None,
+    max_options: int | None,
+    timings: Timings | None,
+) -> CachedResponse:
+    def render() -> str:
+        return generate_stub(defns, timings, max_options=max_options)
+
+    return _cached(_endpoint("stub", node_filter, max_options), defns, node_filter, render, "text/plain", timings)
+
+
+def _options_entry(defns: list, node_filter: NodeFilter | None, timings: Timings | None) -> CachedResponse:
+    def render() -> str:
+        return json.dumps(create_options_for_api(defns))
+
+    return _cached(_endpoint("options", node_filter), defns, node_filter, render, "application/json", timings)
+
+
+def _precompute(timings: Timings):
+    """renders the unfiltered responses into the cache"""
+
+    with phase(timings, "collect"):
+        defns = _collected.get(timings)
+    entries = [
+        _stub_entry(defns, None, None, timings),
+        _schema_entry(defns, None, None, timings),
+        _options_entry(defns, None, timings),
+    ]
+    with phase(timings, "encode"):
+        for entry in entries:
+            # the encoding preferred for clients accepting both
+            entry.select("gzip, br")
+
+
+_warmup = WarmUp(_precompute, warmup_enabled())
+
+
+async def _start_warmup(app: web.Application):
+    # all custom nodes are loaded before the server starts
+    _warmup.start()
+
+
+PromptServer.instance.app.on_startup.append(_start_warmup)
 
 
 @PromptServer.instance.routes.get("/node-api-schema")
 async def get_node_schema(request):
-    defns = list(collect_defns().values())
-    schema = create_schema_for_api(defns)
-    return web.json_response(schema)
+    await _warmup.wait()
+
+    timings = _timings(request)
+    node_filter = _node_filter(request)
+    max_options = _max_options(request)
+
+    with phase(timings, "collect"):
+        defns = _collected.get(timings, node_filter)
+
+    entry = _schema_entry(defns, node_filter, max_options, timings)
+    response = await _respond(request, entry, timings)
+
+    if timings is not None:
+        _stats.record("schema", timings)
+    return response
 
 
 @PromptServer.instance.routes.get("/node-api-stub")
 async def get_node_stubs(request):
-    defns = list(collect_defns().values())
-    stub = generate_stub(defns)
-    return web.Response(
-        text=stub,
-        content_type="text/plain",
-        charset="utf-8",
-    )
+    await _warmup.wait()
+
+    timings = _timings(request)
+    node_filter = _node_filter(request)
+    max_options = _max_options(request)
+
+    with phase(timings, "collect"):
+        defns = _collected.get(timings, node_filter)
+
+    entry = _stub_entry(defns, node_filter, max_options, timings)
+    response = await _respond(request, entry, timings)
+
+    if timings is not None:
+        _stats.record("stub", timings)
+    return response
+
+
+@PromptServer.instance.routes.post("/node-api-stub")
+async def post_node_stubs(request):
+    """returns a stub containing only the nodes used by the posted workflow(s)"""
+
+    await _warmup.wait()
+
+    timings = _timings(request)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.json_response({"error": "invalid json"}, status=400)
+
+    try:
+        node_filter = NodeFilter.from_workflows(data if isinstance(data, list) else [data])
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    if node_filter.is_empty():
+        return web.json_response({"error": "no nodes in workflows"}, status=400)
+
+    with phase(timings, "collect"):
+        defns = _collected.get(timings, node_filter)
+
+    unknown = sorted(node_filter.names - {defn.name for defn in defns})
+    if len(unknown) != 0:
+        return web.json_response({"error": "unknown class_type", "class_types": unknown}, status=400)
+
+    entry = _stub_entry(defns, node_filter, _max_options(request), timings)
+    response = await _respond(request, entry, timings)
+
+    if timings is not None:
+        _stats.record("stub", timings)
+    return response
+
+
+@PromptServer.instance.routes.get("/node-api-options")
+async def get_node_options(request):
+    """returns the raw option lists of selection inputs, which may be left out of the stub"""
+
+    await _warmup.wait()
+
+    timings = _timings(request)
+    node_filter = _node_filter(request)
+
+    with phase(timings, "collect"):
+        defns = _collected.get(timings, node_filter)
+
+    entry = _options_entry(defns, node_filter, timings)
+    response = await _respond(request, entry, timings)
+
+    if timings is not None:
+        _stats.record("options", timings)
+    return response
+
+
+@PromptServer.instance.routes.post("/node-api-validate")
+async def post_node_validate(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.json_response({"error": "invalid json"}, status=400)
+
+    # accepts both {"prompt": {...}} (the body of /prompt) and a bare prompt
+    if isinstance(data, dict) and isinstance(data.get("prompt"), dict):
+        data = data["prompt"]
+
+    # only the definitions the prompt uses (an empty filter would select all nodes)
+    names = prompt_class_types(data)
+    defns = _collected.get(node_filter=NodeFilter(names=names)) if len(names) != 0 else []
+    errors = validate_prompt(data, {defn.name: defn for defn in defns})
+    return web.json_response({"valid": len(errors) == 0, "errors": errors})
+
+
+@PromptServer.instance.routes.get("/node-api-ready")
+async def get_node_ready(request):
+    """readiness probe: 503 until the warm-up (COMFYUI_STUB_WARMUP=1) has finished, or if it failed"""
+
+    return web.json_response(_warmup.to_dict(), status=200 if _warmup.ready else 503)
+
+
+@PromptServer.instance.routes.get("/node-api-stats")
+async def get_node_stats(request):
+    if request.query.get("clear") == "1":
+        _stats.clear()
+    return web.json_response(_stats.to_dict())
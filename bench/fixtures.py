@@ -0,0 +1,215 @@
+"""
+synthetic NODE_CLASS_MAPPINGS for benchmarks
+
+`install()` must be called before importing `src.defn`, which imports
+`NODE_CLASS_MAPPINGS` from ComfyUI's `nodes` module.
+"""
+
+import sys
+import copy
+import types
+import random
+
+
+def install() -> dict:
+    """registers a fake `nodes` module and returns its (empty) NODE_CLASS_MAPPINGS"""
+
+    mod = sys.modules.get("nodes")
+    if mod is None:
+        mod = types.ModuleType("nodes")
+        mod.NODE_CLASS_MAPPINGS = {}
+        sys.modules["nodes"] = mod
+    return mod.NODE_CLASS_MAPPINGS
+
+
+def _node_class(name: str, inputs: dict, return_types: tuple, category: str, **attrs) -> type:
+    def INPUT_TYPES(cls):
+        return inputs
+
+    ns = {
+        "INPUT_TYPES": classmethod(INPUT_TYPES),
+        "RETURN_TYPES": return_types,
+        "FUNCTION": "run",
+        "CATEGORY": category,
+        **attrs,
+    }
+    return type(name, (object,), ns)
+
+
+def core_nodes(n_checkpoints: int = 200, n_loras: int = 1000) -> dict[str, type]:
+    """the subset of ComfyUI core nodes used to build benchmark workflows"""
+
+    ckpts = [f"SDXL/model_{i:05d}.safetensors" for i in range(n_checkpoints)]
+    loras = [f"lora/lora_{i:05d}.safetensors" for i in range(n_loras)]
+    samplers = ["euler", "euler_ancestral", "heun", "dpm_2", "dpmpp_2m", "dpmpp_sde", "ddim", "uni_pc"]
+    schedulers = ["normal", "karras", "exponential", "sgm_uniform", "simple", "ddim_uniform"]
+
+    return {
+        "CheckpointLoaderSimple": _node_class(
+            "CheckpointLoaderSimple",
+            {"required": {"ckpt_name": (ckpts,)}},
+            ("MODEL", "CLIP", "VAE"),
+            "loaders",
+        ),
+        "LoraLoader": _node_class(
+            "LoraLoader",
+            {
+                "required": {
+                    "model": ("MODEL",),
+                    "clip": ("CLIP",),
+                    "lora_name": (loras,),
+                    "strength_model": ("FLOAT", {"default": 1.0, "min": -100.0, "max": 100.0, "step": 0.01}),
+                    "strength_clip": ("FLOAT", {"default": 1.0, "min": -100.0, "max": 100.0, "step": 0.01}),
+                }
+            },
+            ("MODEL", "CLIP"),
+            "loaders",
+        ),
+        "CLIPTextEncode": _node_class(
+            "CLIPTextEncode",
+            {"required": {"text": ("STRING", {"multiline": True, "dynamicPrompts": True}), "clip": ("CLIP",)}},
+            ("CONDITIONING",),
+            "conditioning",
+        ),
+        "EmptyLatentImage": _node_class(
+            "EmptyLatentImage",
+            {
+                "required": {
+                    "width": ("INT", {"default": 512, "min": 16, "max": 16384, "step": 8}),
+                    "height": ("INT", {"default": 512, "min": 16, "max": 16384, "step": 8}),
+                    "batch_size": ("INT", {"default": 1, "min": 1, "max": 4096}),
+                }
+            },
+            ("LATENT",),
+            "latent",
+        ),
+        "KSampler": _node_class(
+            "KSampler",
+            {
+                "required": {
+                    "model": ("MODEL",),
+                    "seed": ("INT", {"default": 0, "min": 0, "max": 0xFFFFFFFFFFFFFFFF}),
+                    "steps": ("INT", {"default": 20, "min": 1, "max": 10000}),
+                    "cfg": ("FLOAT", {"default": 8.0, "min": 0.0, "max": 100.0, "step": 0.1, "round": 0.01}),
+                    "sampler_name": (samplers,),
+                    "scheduler": (schedulers,),
+                    "positive": ("CONDITIONING",),
+                    "negative": ("CONDITIONING",),
+                    "latent_image": ("LATENT",),
+                    "denoise": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.01}),
+                }
+            },
+            ("LATENT",),
+            "sampling",
+        ),
+        "VAEDecode": _node_class(
+            "VAEDecode",
+            {"required": {"samples": ("LATENT",), "vae": ("VAE",)}},
+            ("IMAGE",),
+            "latent",
+        ),
+        "SaveImage": _node_class(
+            "SaveImage",
+            {
+                "required": {
+                    "images": ("IMAGE",),
+                    "filename_prefix": ("STRING", {"default": "ComfyUI"}),
+                },
+                "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO"},
+            },
+            (),
+            "image",
+            OUTPUT_NODE=True,
+        ),
+    }
+
+
+def fresh_inputs(nodes: dict[str, type]) -> dict[str, type]:
+    """
+    returns subclasses of `nodes` whose INPUT_TYPES builds new lists and dicts on every call
+
+    as ComfyUI's loaders do (`folder_paths.get_filename_list` returns a copy), which
+    is what the memory of collected definitions should be measured against.
+    """
+
+    def fresh(klass: type) -> type:
+        inputs = klass.INPUT_TYPES()
+
+        def INPUT_TYPES(cls):
+            return copy.deepcopy(inputs)
+
+        return type(klass.__name__, (klass,), {"INPUT_TYPES": classmethod(INPUT_TYPES)})
+
+    return {name: fresh(klass) for name, klass in nodes.items()}
+
+
+_EXTENSION_TYPES = ["MODEL", "CLIP", "VAE", "CONDITIONING", "LATENT", "IMAGE", "MASK", "CONTROL_NET", "UPSCALE_MODEL"]
+_PACKS = ["impact", "essentials", "kjnodes", "was", "rgthree", "efficiency", "controlnet_aux", "animatediff"]
+
+
+def synthetic_nodes(count: int, seed: int = 0) -> dict[str, type]:
+    """
+    returns `count` nodes including `core_nodes()`
+
+    the rest are generated with a mix of input shapes seen in custom node packs:
+    linked extension types, numbers with ranges, strings, booleans, selections
+    of various sizes, optional inputs, RETURN_NAMES and nested categories.
+    """
+
+    rng = random.Random(seed)
+
+    result = dict(core_nodes())
+    custom_types = [f"CUSTOM_TYPE_{i}" for i in range(max(1, count // 50))]
+
+    i = 0
+    while len(result) < count:
+        pack = _PACKS[i % len(_PACKS)]
+        name = f"{pack.capitalize()}Node{i:05d}"
+        i += 1
+
+        required = {}
+        optional = {}
+        n_inputs = rng.randint(1, 12)
+        for k in range(n_inputs):
+            kind = rng.random()
+            if kind < 0.3:
+                typ = rng.choice(_EXTENSION_TYPES + custom_types)
+                value = (typ,)
+            elif kind < 0.5:
+                lo = rng.randint(-10, 0)
+                value = ("INT", {"default": 0, "min": lo, "max": rng.randint(1, 10000), "step": 1})
+            elif kind < 0.65:
+                value = ("FLOAT", {"default": 1.0, "min": 0.0, "max": 10.0, "step": 0.01})
+            elif kind < 0.75:
+                value = ("STRING", {"default": "", "multiline": rng.random() < 0.5})
+            elif kind < 0.8:
+                value = ("BOOLEAN", {"default": False})
+            else:
+                # mostly small enums, sometimes file lists
+                size = rng.choice([2, 3, 4, 8, 16, 64, 300])
+                value = ([f"option_{j}" for j in range(size)],)
+
+            key = f"input_{k}"
+            if rng.random() < 0.2:
+                optional[key] = value
+            else:
+                required[key] = value
+
+        inputs = {"required": required}
+        if len(optional) != 0:
+            inputs["optional"] = optional
+
+        n_outputs = rng.choice([0, 1, 1, 1, 2, 3])
+        return_types = tuple(rng.choice(_EXTENSION_TYPES + custom_types) for _ in range(n_outputs))
+        attrs = {"RELATIVE_PYTHON_MODULE": f"custom_nodes.{pack}"}
+        if n_outputs != 0 and rng.random() < 0.3:
+            attrs["RETURN_NAMES"] = tuple(f"out_{k}" for k in range(n_outputs))
+        if n_outputs == 0:
+            attrs["OUTPUT_NODE"] = True
+
+        depth = rng.randint(1, 3)
+        category = "/".join([pack] + [f"group{rng.randint(0, 5)}" for _ in range(depth - 1)])
+
+        result[name] = _node_class(name, inputs, return_types, category, **attrs)
+
+    return result
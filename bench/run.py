@@ -0,0 +1,244 @@
+"""
+benchmarks for stub / schema generation and workflow building
+
+usage:
+    python -m bench.run [--nodes 100 1000 5000] [--graph 100 1000] [--repeat 3] [--output FILE]
+
+results are written as JSON:
+    {
+        "meta": {"python": ..., "platform": ..., "time": ...},
+        "results": [
+            {"benchmark": "generate_stub", "size": 1000, "best": 0.12, "mean": 0.13, "runs": [...]},
+            {"benchmark": "defns_memory", "size": 1000, "bytes": 1234567},
+            ...
+        ]
+    }
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+from typing import Callable
+
+from . import fixtures
+
+NODE_CLASS_MAPPINGS = fixtures.install()
+
+from src.defn import collect_defns, DefnStore, NodeFilter  # noqa: E402
+from src import gen_stub  # noqa: E402
+from src.gen_stub import generate_stub  # noqa: E402
+from src import make_json  # noqa: E402
+from src.make_json import create_schema_for_api  # noqa: E402
+from src.response_cache import defns_fingerprint  # noqa: E402
+
+
+SUBSET_SIZE = 30
+
+
+def _measure(fn: Callable[[], object], repeat: int, setup: Callable[[], object] | None = None) -> list[float]:
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return runs
+
+
+def _record(results: list, benchmark: str, size: int, runs: list[float]):
+    result = {
+        "benchmark": benchmark,
+        "size": size,
+        "best": min(runs),
+        "mean": sum(runs) / len(runs),
+        "runs": runs,
+    }
+    results.append(result)
+    print(f"{benchmark:>28} {size:>6}: {result['best'] * 1000:10.2f} ms", file=sys.stderr)
+
+
+def _record_memory(results: list, benchmark: str, size: int, nbytes: int):
+    results.append({"benchmark": benchmark, "size": size, "bytes": nbytes})
+    print(f"{benchmark:>28} {size:>6}: {nbytes / 1024:10.1f} KiB", file=sys.stderr)
+
+
+def _retained_memory(fn: Callable[[], object]) -> int:
+    """returns the bytes allocated by `fn` and still held by its result"""
+
+    tracemalloc.start()
+    try:
+        result = fn()  # noqa: F841
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def _set_nodes(nodes: dict[str, type]):
+    NODE_CLASS_MAPPINGS.clear()
+    NODE_CLASS_MAPPINGS.update(nodes)
+
+
+_module_counter = 0
+
+
+def _import_stub(path: str):
+    global _module_counter
+    _module_counter += 1
+    name = f"_bench_stub_{_module_counter}"
+    spec = importlib.util.spec_from_file_location(name, path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        del sys.modules[name]
+    return module
+
+
+def _clear_stub_caches():
+    gen_stub._CLASS_DEF_CACHE.clear()
+    gen_stub._SELECTION_DECL_CACHE.clear()
+
+
+def bench_generation(results: list, sizes: list[int], repeat: int, workdir: str):
+    for size in sizes:
+        _set_nodes(fixtures.synthetic_nodes(size))
+
+        _record(results, "collect_defns", size, _measure(collect_defns, repeat))
+
+        # a service using a few dozen node types
+        subset = NodeFilter(names=frozenset(list(NODE_CLASS_MAPPINGS)[:SUBSET_SIZE]))
+        _record(results, "collect_defns_subset", size, _measure(lambda: collect_defns(node_filter=subset), repeat))
+        subset_defns = list(collect_defns(node_filter=subset).values())
+        _record(results, "generate_stub_subset", size, _measure(lambda: generate_stub(subset_defns), repeat))
+
+        defns = list(collect_defns().values())
+        _record(results, "defns_fingerprint", size, _measure(lambda: defns_fingerprint(defns), repeat))
+        stub = lambda: generate_stub(defns)
+        _record(results, "generate_stub", size, _measure(stub, repeat, _clear_stub_caches))
+        # e.g. after a model is added: node classes are reused, only option lists are rendered
+        _record(results, "generate_stub_cached", size, _measure(stub, repeat))
+        schema = lambda: create_schema_for_api(defns)
+        _record(results, "create_schema_for_api", size, _measure(schema, repeat, make_json._NODE_TYPE_CACHE.clear))
+        _record(results, "create_schema_for_api_cached", size, _measure(schema, repeat))
+
+        # definitions held by the server, from INPUT_TYPES returning new objects on each call
+        _set_nodes(fixtures.fresh_inputs(fixtures.synthetic_nodes(size)))
+        _record_memory(results, "defns_memory", size, _retained_memory(lambda: collect_defns(store=DefnStore())))
+        _set_nodes(fixtures.synthetic_nodes(size))
+
+        stub_path = os.path.join(workdir, f"stub_{size}.py")
+        with open(stub_path, "w", encoding="utf-8") as f:
+            f.write(generate_stub(defns))
+        _record(results, "import_stub", size, _measure(lambda: _import_stub(stub_path), repeat))
+
+
+def _build_workflow(stub, size: int):
+    """builds `size` nodes of txt2img pipelines with Workflow.add / Workflow.link"""
+
+    wf = stub.Workflow()
+    i = 0
+    while len(wf._nodes) < size:
+        ckpt = wf.add(stub.loaders.CheckpointLoaderSimple("SDXL/model_00000.safetensors"))
+        prompt = wf.add(stub.conditioning.CLIPTextEncode(f"prompt {i}"))
+        negative = wf.add(stub.conditioning.CLIPTextEncode("bad quality"))
+        latent = wf.add(stub.latent.EmptyLatentImage(1024, 1024, 1))
+        sampler = wf.add(stub.sampling.KSampler(seed=i, sampler_name="euler", scheduler="normal"))
+        decode = wf.add(stub.latent.VAEDecode())
+        save = wf.add(stub.image.SaveImage(filename_prefix=f"bench_{i}"))
+
+        wf.link(ckpt.output("CLIP"), prompt.input("clip"))
+        wf.link(ckpt.output("CLIP"), negative.input("clip"))
+        wf.link(ckpt.output("MODEL"), sampler.input("model"))
+        wf.link(prompt.output(0), sampler.input("positive"))
+        wf.link(negative.output(0), sampler.input("negative"))
+        wf.link(latent.output(0), sampler.input("latent_image"))
+        wf.link(sampler.output(0), decode.input("samples"))
+        wf.link(ckpt.output("VAE"), decode.input("vae"))
+        wf.link(decode.output(0), save.input("images"))
+        i += 1
+    return wf
+
+
+def _columns(prompt: dict) -> tuple:
+    """converts an API-format prompt (with ids "0", "1", ...) to the arguments of bulk_prompt"""
+
+    class_types, inputs = [], []
+    src, src_index, dst, dst_index = [], [], [], []
+    for i, node in enumerate(prompt.values()):
+        class_types.append(node["class_type"])
+        literals = {}
+        for name, value in node["inputs"].items():
+            if isinstance(value, list):
+                src.append(int(value[0]))
+                src_index.append(value[1])
+                dst.append(i)
+                dst_index.append(name)
+            else:
+                literals[name] = value
+        inputs.append(literals)
+    return class_types, inputs, src, src_index, dst, dst_index
+
+
+def bench_workflow(results: list, sizes: list[int], repeat: int, workdir: str):
+    _set_nodes(fixtures.core_nodes())
+    defns = list(collect_defns().values())
+
+    stub_path = os.path.join(workdir, "stub_core.py")
+    with open(stub_path, "w", encoding="utf-8") as f:
+        f.write(generate_stub(defns))
+    stub = _import_stub(stub_path)
+
+    for size in sizes:
+        _record(results, "workflow_add_link", size, _measure(lambda: _build_workflow(stub, size), repeat))
+
+        wf = _build_workflow(stub, size)
+        _record(results, "workflow_check", size, _measure(wf.check, repeat))
+        _record(results, "workflow_to_dict", size, _measure(wf.to_dict, repeat))
+
+        columns = _columns(wf.to_dict())
+        _record(results, "workflow_bulk_prompt", size, _measure(lambda: stub.bulk_prompt(*columns), repeat))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="*", default=[100, 1000, 5000], help="node catalogue sizes")
+    parser.add_argument("--graph", type=int, nargs="*", default=[100, 1000], help="workflow sizes (nodes)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None, help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_generation(results, args.nodes, args.repeat, workdir)
+        bench_workflow(results, args.graph, args.repeat, workdir)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,25 @@
 node definition
 """
 
-from dataclasses import dataclass
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+from dataclasses import dataclass, replace
 from abc import ABC
 
 # ComfyUI imports
 from nodes import NODE_CLASS_MAPPINGS
 
+try:
+    import folder_paths  # type: ignore
+except ImportError:
+    folder_paths = None
+
+from .profiling import Timings
+
 
 COMFYUI_TYPENAME_TO_JSON_TYPENAME = {
     "INT": "integer",
@@ -17,37 +30,133 @@ COMFYUI_TYPENAME_TO_JSON_TYPENAME = {
 }
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class NodeParam:
     name: str
-    type: str | list
+    type: str | tuple
     required: bool
     desc: dict
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class NodeOutput:
     name: str | None
     type: str
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class NodeDefn:
     name: str
     """node name"""
 
     class_name: str
 
-    input_types: list[NodeParam]
+    input_types: tuple[NodeParam, ...]
     """input names and types
     
-    if type is list, it means that this input is a selection.
+    if type is tuple, it means that this input is a selection.
     """
 
-    output_types: list[NodeOutput]
+    output_types: tuple[NodeOutput, ...]
     """output names and types"""
 
-    category: list[str]
+    category: tuple[str, ...]
+
+    output_node: bool
+    """True if this node is an output (sink) node such as SaveImage"""
+
+    pack: str
+    """custom node pack the node comes from ("comfy" for core nodes)"""
+
+
+_EMPTY_DESC: dict = {}
+
+
+class DefnStore:
+    """
+    interning table shared by definitions
+
+    names are interned with `sys.intern`, and equal option lists and `desc` dicts
+    are stored once, so that thousands of definitions listing the same files or
+    declaring the same ranges refer to a single object. the shared objects must
+    not be modified.
+
+    the table holds at most `max_entries` entries per generation; when it is full,
+    a new generation is started as by `begin()`, so that filtered collections,
+    which do not call `begin()`, cannot grow it without bound.
+    """
+
+    def __init__(self, max_entries: int = 65536):
+        self.max_entries = max_entries
+        self._options: dict[tuple, tuple] = {}
+        self._descs: dict[tuple, dict] = {}
+        self._previous_options: dict[tuple, tuple] = {}
+        self._previous_descs: dict[tuple, dict] = {}
+
+    name = staticmethod(sys.intern)
+
+    def options(self, options: list | tuple) -> tuple:
+        key = tuple(options)
+        if not all(type(x) is str for x in key):
+            # True, 1 and 1.0 are equal; keep them apart
+            key = tuple(_typed(x) for x in key)
+        try:
+            value = self._options.get(key)
+        except TypeError:
+            # unhashable values (lists etc.)
+            return tuple(options)
+        if value is None:
+            value = self._previous_options.get(key)
+            if value is None:
+                value = tuple(self.name(x) if type(x) is str else x for x in options)
+            self._options[key] = value
+            self._check_size()
+        return value
+
+    def desc(self, desc: dict) -> dict:
+        if len(desc) == 0:
+            return _EMPTY_DESC
+        try:
+            key = tuple((k, _typed(v)) for k, v in desc.items())
+            hash(key)
+        except TypeError:
+            # unhashable values (lists etc.)
+            return desc
+        value = self._descs.get(key)
+        if value is None:
+            value = self._previous_descs.get(key, desc)
+            self._descs[key] = value
+            self._check_size()
+        return value
+
+    def _check_size(self):
+        if len(self._options) + len(self._descs) > self.max_entries:
+            self.begin()
+
+    def begin(self):
+        """
+        starts collecting all definitions again
+
+        entries not used until the next `begin()` are dropped, so that old file
+        lists do not accumulate.
+        """
+
+        self._previous_options, self._options = self._options, {}
+        self._previous_descs, self._descs = self._descs, {}
+
+    def __len__(self) -> int:
+        return len(self._options) + len(self._descs)
+
+
+def _typed(value) -> tuple:
+    """returns an interning key of `value` that tells `True`, `1` and `1.0` apart"""
+
+    if type(value) is tuple:
+        return (tuple, tuple(_typed(x) for x in value))
+    return (type(value), value)
+
+
+_STORE = DefnStore()
 
 
 class _NodeType(ABC):
@@ -60,8 +169,10 @@ class _NodeType(ABC):
 
     RETURN_NAMES: tuple[str, ...]  # 存在しないかも
 
+    OUTPUT_NODE: bool  # 存在しないかも
+
 
-def _get_input_params(klass: type[_NodeType]) -> list[NodeParam]:
+def _get_input_params(klass: type[_NodeType], store: DefnStore) -> tuple[NodeParam, ...]:
     input_types = klass.INPUT_TYPES()
     input_types_required: dict = input_types.get("required", {})
     input_types_optional: dict = input_types.get("optional", {})
@@ -76,7 +187,7 @@ def _get_input_params(klass: type[_NodeType]) -> list[NodeParam]:
             # LoadLatent
             assert len(value) == 1, (key, value, klass)
             assert isinstance(value[0], list), (key, value, klass)
-            param = NodeParam(key, value[0], required, {})
+            param = NodeParam(store.name(key), store.options(value[0]), required, store.desc({}))
             return param
 
         assert len(value) in (1, 2)
@@ -90,10 +201,12 @@ def _get_input_params(klass: type[_NodeType]) -> list[NodeParam]:
 
         assert isinstance(typ, (str, list, tuple)), (typ, value, klass)
 
-        if isinstance(typ, tuple):
-            typ = list(typ)
+        if isinstance(typ, str):
+            typ = store.name(typ)
+        else:
+            typ = store.options(typ)
 
-        param = NodeParam(key, typ, required, desc)
+        param = NodeParam(store.name(key), typ, required, store.desc(desc))
         return param
 
     for key, value in input_types_required.items():
@@ -104,10 +217,10 @@ def _get_input_params(klass: type[_NodeType]) -> list[NodeParam]:
         param = get_param(key, value, False)
         result.append(param)
 
-    return result
+    return tuple(result)
 
 
-def _get_outputs(klass: type[_NodeType]) -> list[NodeOutput]:
+def _get_outputs(klass: type[_NodeType], store: DefnStore) -> tuple[NodeOutput, ...]:
     return_types = klass.RETURN_TYPES
     return_names = getattr(klass, "RETURN_NAMES", None)
 
@@ -116,12 +229,16 @@ def _get_outputs(klass: type[_NodeType]) -> list[NodeOutput]:
     result = []
     for i, typ in enumerate(return_types):
         if return_names is not None:
-            name = return_names[i]
+            name = store.name(return_names[i])
         else:
             name = None
+        if isinstance(typ, str):
+            typ = store.name(typ)
+        elif isinstance(typ, (list, tuple)):
+            typ = store.options(typ)
         result.append(NodeOutput(name, typ))
 
-    return result
+    return tuple(result)
 
 
 """
@@ -146,23 +263,295 @@ class Node:
 """
 
 
-def _create_defn(name: str, klass: type[_NodeType]) -> NodeDefn:
-    input_params = _get_input_params(klass)
-    outputs = _get_outputs(klass)
-    category = getattr(klass, "CATEGORY", "").split("/")
+def _create_defn(name: str, klass: type[_NodeType], store: DefnStore) -> NodeDefn:
+    input_params = _get_input_params(klass, store)
+    outputs = _get_outputs(klass, store)
+    category = tuple(store.name(c) for c in getattr(klass, "CATEGORY", "").split("/"))
 
     return NodeDefn(
-        name=name,
-        class_name=klass.__name__,
+        name=store.name(name),
+        class_name=store.name(klass.__name__),
         input_types=input_params,
         output_types=outputs,
         category=category,
+        output_node=bool(getattr(klass, "OUTPUT_NODE", False)),
+        pack=store.name(node_pack(klass)),
+    )
+
+
+def node_pack(klass: type) -> str:
+    """returns the custom node pack (directory name under custom_nodes) of a node class"""
+
+    # set by ComfyUI when loading custom nodes, e.g. "custom_nodes.ComfyUI-Impact-Pack"
+    module = getattr(klass, "RELATIVE_PYTHON_MODULE", None)
+    if isinstance(module, str) and module.startswith("custom_nodes."):
+        return module.split(".", 1)[1]
+
+    # custom nodes are imported with their path as the module name
+    parts = re.split(r"[\\/]", getattr(klass, "__module__", "") or "")
+    if "custom_nodes" in parts:
+        i = parts.index("custom_nodes")
+        if i + 1 < len(parts):
+            return parts[i + 1].split(".")[0]
+
+    return "comfy"
+
+
+_UI_ONLY_NODES = ("Note", "MarkdownNote", "Reroute", "PrimitiveNode")
+"""frontend-only nodes, which do not exist in NODE_CLASS_MAPPINGS"""
+
+
+@dataclass(frozen=True)
+class NodeFilter:
+    """
+    selects a subset of nodes
+
+    a node is selected if it matches any of the given criteria; an empty filter selects all nodes.
+    """
+
+    names: frozenset[str] = frozenset()
+    """node names"""
+
+    categories: tuple[str, ...] = ()
+    """category prefixes, e.g. "loaders" matches "loaders" and "loaders/video_models" """
+
+    packs: tuple[str, ...] = ()
+    """custom node packs (case-insensitive), "comfy" for core nodes"""
+
+    def is_empty(self) -> bool:
+        return len(self.names) == 0 and len(self.categories) == 0 and len(self.packs) == 0
+
+    def matches(self, name: str, category: str, pack: str) -> bool:
+        if self.is_empty():
+            return True
+        if name in self.names:
+            return True
+        for prefix in self.categories:
+            prefix = prefix.strip("/")
+            if category == prefix or category.startswith(prefix + "/"):
+                return True
+        pack = pack.lower()
+        return any(p.lower() == pack for p in self.packs)
+
+    def matches_defn(self, defn: NodeDefn) -> bool:
+        return self.matches(defn.name, "/".join(defn.category), defn.pack)
+
+    @classmethod
+    def from_workflows(cls, workflows: list[dict]) -> "NodeFilter":
+        """
+        selects the nodes referenced by workflows
+
+        each workflow may be an API-format prompt, a /prompt request body ({"prompt": ...})
+        or a UI-format workflow ({"nodes": [...]}).
+        """
+
+        names = set()
+        for workflow in workflows:
+            if not isinstance(workflow, dict):
+                raise ValueError("workflow must be an object")
+            if isinstance(workflow.get("prompt"), dict):
+                workflow = workflow["prompt"]
+
+            if isinstance(workflow.get("nodes"), list):
+                for node in workflow["nodes"]:
+                    if not isinstance(node, dict) or not isinstance(node.get("type"), str):
+                        raise ValueError("node must be an object with type")
+                    if node["type"] not in _UI_ONLY_NODES:
+                        names.add(node["type"])
+                continue
+
+            for node_id, node in workflow.items():
+                if not isinstance(node, dict) or not isinstance(node.get("class_type"), str):
+                    raise ValueError(f"node {node_id}: class_type is missing")
+                names.add(node["class_type"])
+
+        return cls(names=frozenset(names))
+
+    def key(self) -> str:
+        """canonical representation, for cache keys"""
+        names = ",".join(sorted(self.names))
+        categories = ",".join(sorted(p.strip("/") for p in self.categories))
+        packs = ",".join(sorted(p.lower() for p in self.packs))
+        return f"names={names};categories={categories};packs={packs}"
+
+
+def filter_defns(defns: list[NodeDefn], node_filter: NodeFilter | None) -> list[NodeDefn]:
+    if node_filter is None or node_filter.is_empty():
+        return defns
+    return [defn for defn in defns if node_filter.matches_defn(defn)]
+
+
+SELECTION_ALIAS_MIN = 8
+"""selections with at least this many options are declared once and referenced by name"""
+
+
+def selection_id(options: list) -> str:
+    """returns a name for a list of selection options, derived from its content"""
+
+    data = json.dumps(options, ensure_ascii=False, default=repr)
+    return "selection_" + hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+def _hash_defn(defn: NodeDefn, input_types: list) -> str:
+    # flat tuples instead of asdict(), which deep-copies every option list
+    data = json.dumps(
+        [
+            defn.name,
+            defn.class_name,
+            [(p.name, p.type, p.required, p.desc) for p in input_types],
+            [(p.name, p.type) for p in defn.output_types],
+            defn.category,
+            defn.output_node,
+            defn.pack,
+        ],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=repr,
     )
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def defn_hash(defn: NodeDefn) -> str:
+    """returns a digest of the whole definition, including option values"""
+
+    return _hash_defn(defn, defn.input_types)
+
 
+# shape and option values
+#
+# large selections are mostly file lists of loaders, which change whenever a model
+# is added. they are kept apart from the "shape" of a definition (inputs, types,
+# ranges, small selections), so that what is rendered from the shape survives
+# such changes and only the option lists are rendered again.
+
+
+def is_option_list(typ: str | tuple) -> bool:
+    """True if `typ` is a selection whose options are option values rather than part of the shape"""
+
+    return isinstance(typ, (list, tuple)) and len(typ) >= SELECTION_ALIAS_MIN
+
+
+def options_id(node: str, input: str) -> str:
+    """returns a name for the option values of an input, which does not depend on the values"""
+
+    data = json.dumps([node, input], ensure_ascii=False)
+    return "options_" + hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+def defn_options(defn: NodeDefn) -> dict[str, tuple]:
+    """returns input name -> option values"""
+
+    return {p.name: p.type for p in defn.input_types if is_option_list(p.type)}
+
+
+def defn_shape_hash(defn: NodeDefn) -> str:
+    """
+    returns a digest of the definition without its option values
+
+    definitions with the same shape hash render to the same stub / schema fragments.
+    """
+
+    # None stands for "option values", which is never a valid type
+    input_types = [replace(p, type=None) if is_option_list(p.type) else p for p in defn.input_types]
+    return _hash_defn(defn, input_types)
+
+
+def _folder_mtimes() -> list[tuple[str, int]] | None:
+    """
+    returns (directory, mtime) of the model and input directories, or None without ComfyUI
+
+    subdirectories are taken from ComfyUI's filename list cache, which is
+    invalidated by the same mtimes.
+    """
+
+    if folder_paths is None:
+        return None
+
+    dirs = set()
+    for paths, *_ in getattr(folder_paths, "folder_names_and_paths", {}).values():
+        dirs.update(paths)
+    for _, cached_dirs, *_ in getattr(folder_paths, "filename_list_cache", {}).values():
+        dirs.update(cached_dirs)
+    get_input_directory = getattr(folder_paths, "get_input_directory", None)
+    if get_input_directory is not None:
+        dirs.add(get_input_directory())
+
+    result = []
+    for path in sorted(dirs):
+        try:
+            result.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            result.append((path, -1))
+    return result
+
+
+def registry_token() -> tuple | None:
+    """
+    returns a cheap token of what `collect_defns()` depends on, or None without ComfyUI
+
+    the token covers the registered node classes and the mtimes of the model and input
+    directories, i.e. the changes `options_fingerprint` tracks, without evaluating
+    INPUT_TYPES.
+    """
+
+    mtimes = _folder_mtimes()
+    if mtimes is None:
+        return None
+    return tuple((name, id(klass)) for name, klass in NODE_CLASS_MAPPINGS.items()), tuple(mtimes)
+
+
+def options_fingerprint(defns: list[NodeDefn]) -> str:
+    """
+    returns a digest that changes whenever the option values of the definitions change
+
+    under ComfyUI, file lists are tracked through directory mtimes (as ComfyUI's own
+    filename list cache does) and the number of options, without hashing the lists
+    themselves. otherwise the option values are hashed.
+    """
+
+    h = hashlib.sha1()
+    mtimes = _folder_mtimes()
+    if mtimes is not None:
+        h.update(json.dumps(mtimes, ensure_ascii=False).encode("utf-8"))
+
+    for defn in defns:
+        for name, options in defn_options(defn).items():
+            h.update(f"{defn.name}\0{name}\0{len(options)}\0".encode("utf-8"))
+            if mtimes is None:
+                h.update(json.dumps(options, ensure_ascii=False, default=repr).encode("utf-8"))
+    return h.hexdigest()
+
+
+def collect_defns(
+    timings: Timings | None = None,
+    node_filter: NodeFilter | None = None,
+    store: DefnStore | None = None,
+) -> dict[str, NodeDefn]:
+    """
+    returns definitions of the registered nodes
+
+    with `node_filter`, nodes are selected before their INPUT_TYPES are evaluated.
+    names, option lists and `desc` dicts are shared through `store` (by default, the
+    process-wide one).
+    """
+
+    if node_filter is not None and node_filter.is_empty():
+        node_filter = None
+
+    if store is None:
+        store = _STORE
+    if node_filter is None:
+        store.begin()
 
-def collect_defns() -> dict[str, NodeDefn]:
     result = {}
     for name, klass in NODE_CLASS_MAPPINGS.items():
-        defn = _create_defn(name, klass)
+        if node_filter is not None and not node_filter.matches(name, getattr(klass, "CATEGORY", ""), node_pack(klass)):
+            continue
+        if timings is None:
+            defn = _create_defn(name, klass, store)
+        else:
+            t0 = time.perf_counter()
+            defn = _create_defn(name, klass, store)
+            timings.provider(name, time.perf_counter() - t0)
         result[name] = defn
     return result
@@ -1,80 +1,43 @@
 import os
 import re
 import json
-from dataclasses import dataclass
-import uuid
+from collections import OrderedDict
 from typing import Iterator
 
-from .defn import NodeDefn as NodeDefn
+from .defn import (
+    NodeDefn as NodeDefn,
+    NodeFilter,
+    defn_options,
+    defn_shape_hash,
+    filter_defns,
+    is_option_list,
+    options_id,
+    selection_id,
+)
 from . import stub_base
+from .profiling import Timings, phase
 
 
-@dataclass(frozen=True)
-class NodeDefn1(NodeDefn):
-    id: str
-
-
-def generate_stub(defns: list[NodeDefn]) -> str:
-    """generate python source file"""
+def generate_stub(
+    defns: list[NodeDefn],
+    timings: Timings | None = None,
+    node_filter: NodeFilter | None = None,
+    max_options: int | None = None,
+) -> str:
+    """
+    generate python source file
 
-    defns1 = [NodeDefn1(**vars(defn), id=uuid.uuid4().hex) for defn in defns]
+    with `node_filter`, only the selected nodes and the types they use are emitted.
+    selections with more than `max_options` options are typed as plain strings.
+    """
 
-    stub_path = os.path.join(
-        os.path.dirname(__file__),
-        "stub_base.py",
-    )
-    with open(stub_path, "r") as f:
-        stub = f.read()
+    defns = filter_defns(defns, node_filter)
 
     # 1. add types
 
-    default_types = stub_base.ComfyTypes
-    extra_types = {}
-    type_decls = []
-
-    for defn in defns1:
-        types = []
-        for p in defn.input_types:
-            name, typ, req = p.name, p.type, p.required
-            types.append(typ)
-        for p in defn.output_types:
-            name, typ = p.name, p.type
-            types.append(typ)
-
-        for typ in types:
-            if isinstance(typ, (list, tuple)):
-                # selection
-                continue
-
-            assert isinstance(typ, str), (typ, defn)
-
-            if typ == "*":
-                # reroute
-                continue
-
-            if hasattr(default_types, typ):
-                continue
-
-            if typ in extra_types:
-                continue
-
-            extra_types[typ] = typ
-
-            decl = f'{typ} = type("{typ}", (object,), {{}})'
-            type_decls.append(decl)
-
-    ### markmarkmark ###
-    # ^ ここに追加する
-
-    mark = re.compile(r"([ \t]*)### markmarkmark ###")
-    m = mark.search(stub)
-    assert m is not None, "mark not found"
-
-    indent = m.group(1)
-
-    type_decls_str = indent + f"\n{indent}".join(type_decls)
-
-    stub = mark.sub(type_decls_str, stub)
+    with phase(timings, "render_types"):
+        stub = _render_types(defns)
+        class_names = _class_names(defns)
 
     # 2. add node classes
 
@@ -137,22 +100,173 @@ def generate_stub(defns: list[NodeDefn]) -> str:
     check 時に _WILL_BE_LINKED が残っていたらエラーとする
     """
 
-    node_classes = []
-    for defn in defns1:
-        node_class = _create_class_def(defn)
-        node_classes.append(node_class)
+    with phase(timings, "render_options"):
+        options = _create_options_def(defns, max_options)
+        if len(options) != 0:
+            stub += "\n\n" + options
+
+    with phase(timings, "render_classes"):
+        node_classes = [_cached_class_def(defn, class_names[defn.name], max_options) for defn in defns]
 
-    namespace = _create_namespace_def(defns1)
+    with phase(timings, "namespace"):
+        namespace = _create_namespace_def(defns, class_names)
+        registry = _create_registry_def(defns, class_names)
 
     fmt = "# fmt: off"
 
-    return fmt + "\n\n" + stub + "\n\n" + "\n\n\n".join(node_classes) + "\n\n" + namespace
+    return fmt + "\n\n" + stub + "\n\n" + "\n\n\n".join(node_classes) + "\n\n" + namespace + "\n\n" + registry + "\n"
 
 
-def _create_class_def(defn: NodeDefn1) -> str:
+def _class_names(defns: list[NodeDefn]) -> dict[str, str]:
+    """returns node name -> generated class name"""
+
+    # the id is derived from the shape, so that rendered classes can be reused
+    return {defn.name: f"{defn.class_name}_{defn_shape_hash(defn)[:32]}" for defn in defns}
+
+
+def _render_types(defns: list[NodeDefn]) -> str:
+    """returns stub_base with extra types declared"""
+
+    stub_path = os.path.join(
+        os.path.dirname(__file__),
+        "stub_base.py",
+    )
+    with open(stub_path, "r") as f:
+        stub = f.read()
+
+    default_types = stub_base.ComfyTypes
+    extra_types = {}
+    type_decls = []
+
+    for defn in defns:
+        types = []
+        for p in defn.input_types:
+            name, typ, req = p.name, p.type, p.required
+            types.append(typ)
+        for p in defn.output_types:
+            name, typ = p.name, p.type
+            types.append(typ)
+
+        for typ in types:
+            if isinstance(typ, (list, tuple)):
+                # selection
+                continue
+
+            assert isinstance(typ, str), (typ, defn)
+
+            if typ == "*":
+                # reroute
+                continue
+
+            if hasattr(default_types, typ):
+                continue
+
+            if typ in extra_types:
+                continue
+
+            extra_types[typ] = typ
+
+            decl = f'{typ} = type("{typ}", (object,), {{}})'
+            type_decls.append(decl)
+
+    ### markmarkmark ###
+    # ^ ここに追加する
+
+    mark = re.compile(r"([ \t]*)### markmarkmark ###")
+    m = mark.search(stub)
+    assert m is not None, "mark not found"
+
+    indent = m.group(1)
+
+    type_decls_str = indent + f"\n{indent}".join(type_decls)
+
+    stub = mark.sub(type_decls_str, stub)
+
+    return stub
+
+
+def _tuple_type(types: list[str]) -> str:
+    if len(types) == 0:
+        # `tuple[]` is a syntax error
+        return "tuple[()]"
+    return f"tuple[{', '.join(types)}]"
+
+
+def _selection_type(options: list | tuple, max_options: int | None) -> str:
+    if len(options) == 0:
+        return "Any"
+    if max_options is not None and len(options) > max_options:
+        return "ComfyTypes.STRING"
+    xs = [(json.dumps(t) if isinstance(t, str) else str(t)) for t in options]
+    return f"ComfyTypes.SELECTION[{', '.join(xs)}]"
+
+
+def _create_options_def(defns: list[NodeDefn], max_options: int | None) -> str:
+    """
+    declares the option values of large selections (file lists of loaders)
+
+        _selection_fedcba9876543210: TypeAlias = ComfyTypes.SELECTION["a.safetensors", ...]
+        _options_0123456789abcdef: TypeAlias = _selection_fedcba9876543210
+
+    node classes refer to the `_options_*` alias of each input, named independently of
+    the values, so they are not rendered again when only the values change. each
+    option list is declared once, however many inputs use it.
+    """
+
+    selections: dict[str, str] = {}
+    aliases = []
+    for defn in defns:
+        for name, options in defn_options(defn).items():
+            if max_options is not None and len(options) > max_options:
+                ty = "ComfyTypes.STRING"
+            else:
+                ty = "_" + selection_id(options)
+                if ty not in selections:
+                    selections[ty] = _cached_selection_decl(ty, options)
+            aliases.append(f"_{options_id(defn.name, name)}: TypeAlias = {ty}")
+
+    return "\n".join([*selections.values(), *aliases])
+
+
+_SELECTION_DECL_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_SELECTION_DECL_CACHE_SIZE = 1024
+
+
+def _cached_selection_decl(name: str, options: tuple) -> str:
+    decl = _SELECTION_DECL_CACHE.get(name)
+    if decl is None:
+        decl = f"{name}: TypeAlias = {_selection_type(options, None)}"
+        _SELECTION_DECL_CACHE[name] = decl
+        if len(_SELECTION_DECL_CACHE) > _SELECTION_DECL_CACHE_SIZE:
+            _SELECTION_DECL_CACHE.popitem(last=False)
+    else:
+        _SELECTION_DECL_CACHE.move_to_end(name)
+    return decl
+
+
+_CLASS_DEF_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_CLASS_DEF_CACHE_SIZE = 8192
+
+
+def _cached_class_def(defn: NodeDefn, class_name: str, max_options: int | None) -> str:
+    """`_create_class_def`, cached by class name (which contains the shape hash)"""
+
+    key = f"{class_name}:{max_options}"
+    class_def = _CLASS_DEF_CACHE.get(key)
+    if class_def is None:
+        class_def = _create_class_def(defn, class_name, max_options)
+        _CLASS_DEF_CACHE[key] = class_def
+        if len(_CLASS_DEF_CACHE) > _CLASS_DEF_CACHE_SIZE:
+            _CLASS_DEF_CACHE.popitem(last=False)
+    else:
+        _CLASS_DEF_CACHE.move_to_end(key)
+    return class_def
+
+
+def _create_class_def(defn: NodeDefn, class_name: str, max_options: int | None = None) -> str:
     # class header
 
-    header = f"class {defn.class_name}_{defn.id}(_Node):"
+    header = f"class {class_name}(_Node):"
 
     # class body
 
@@ -184,16 +298,15 @@ def _create_class_def(defn: NodeDefn1) -> str:
     input_types = []
     for i, p in enumerate(defn.input_types):
         name, typ, req, desc = p.name, p.type, p.required, p.desc
-        name = non_alnum.sub("_", name)
+        # python parameter name; the input itself keeps the original name
+        param = non_alnum.sub("_", name)
 
-        if isinstance(typ, (list, tuple)):
+        if is_option_list(typ):
+            # option values (see _create_options_def)
+            ty = "_" + options_id(defn.name, name)
+        elif isinstance(typ, (list, tuple)):
             # selection
-            if len(typ) == 0:
-                ty = "Any"
-            else:
-                xs = [(json.dumps(t) if isinstance(t, str) else str(t)) for t in typ]
-                literals = ", ".join(xs)
-                ty = f"ComfyTypes.SELECTION[{literals}]"
+            ty = _selection_type(typ, max_options)
         else:
             if typ == "*":
                 typ = "Any"
@@ -218,10 +331,10 @@ def _create_class_def(defn: NodeDefn1) -> str:
                     default = json.dumps(default)
             else:
                 default = "_NOT_GIVEN"
-        ctor_params_list.append(f"{name}: {ty1} = {default}")
+        ctor_params_list.append(f"{param}: {ty1} = {default}")
 
         # self._inputs.append(ComfyInput(self, 0, "param1", ComfyTypes.INT, param1))
-        ctor_inputs_list.append(f"self._add_input(ComfyInput(self, {i}, {json.dumps(name)}, {ty}, {name}))")
+        ctor_inputs_list.append(f"self._add_input(ComfyInput(self, {i}, {json.dumps(name)}, {ty}, {param}))")
 
         # @overload
         # def input(self, index: Literal[0, "param1"]) -> ComfyInput[ComfyTypes.INT]: ...
@@ -237,7 +350,7 @@ def _create_class_def(defn: NodeDefn1) -> str:
     methods_list.append(method)
 
     method = f"""
-    def inputs(self) -> tuple[{", ".join([f"ComfyInput[{ty}]" for ty in input_types])}]: return super().inputs()
+    def inputs(self) -> {_tuple_type([f"ComfyInput[{ty}]" for ty in input_types])}: return super().inputs()
         """.rstrip()
     methods_list.append(method)
 
@@ -251,12 +364,7 @@ def _create_class_def(defn: NodeDefn1) -> str:
         allowed_typename = None
         if isinstance(typ, (list, tuple)):
             # selection
-            if len(typ) == 0:
-                ty = "Any"
-            else:
-                xs = [(json.dumps(t) if isinstance(t, str) else str(t)) for t in typ]
-                literals = ", ".join(xs)
-                ty = f"ComfyTypes.SELECTION[{literals}]"
+            ty = _selection_type(typ, max_options)
         else:
             if typ == "*":
                 typ = "Any"
@@ -290,7 +398,7 @@ def _create_class_def(defn: NodeDefn1) -> str:
     methods_list.append(method)
 
     method = f"""
-    def outputs(self) -> tuple[{", ".join([f"ComfyOutput[{ty}]" for ty in output_types])}]: return super().outputs()
+    def outputs(self) -> {_tuple_type([f"ComfyOutput[{ty}]" for ty in output_types])}: return super().outputs()
         """.rstrip()
     methods_list.append(method)
 
@@ -312,11 +420,14 @@ def _create_class_def(defn: NodeDefn1) -> str:
 
     methods = "".join(methods_list)  # @overload の前に改行が入っている
 
+    if defn.output_node:
+        header += "\n    OUTPUT_NODE = True\n"
+
     class_def = header + ctor + methods
     return class_def
 
 
-def _create_namespace_def(defns: list[NodeDefn1]) -> str:
+def _create_namespace_def(defns: list[NodeDefn], class_names: dict[str, str]) -> str:
     namespace = {}
 
     non_alnum = re.compile(r"[^a-zA-Z0-9_]")
@@ -347,18 +458,28 @@ def _create_namespace_def(defns: list[NodeDefn1]) -> str:
         name = non_alnum.sub("_", name)
 
         assert name not in ns, (defn, ns)
-        ns[name] = defn
+        ns[name] = class_names[defn.name]
 
     def ns_to_s(ns: dict, level: int = 0) -> Iterator[str]:
         indent = " " * 4 * level
-        for name, defn_or_ns in ns.items():
-            if isinstance(defn_or_ns, dict):
+        for name, class_name_or_ns in ns.items():
+            if isinstance(class_name_or_ns, dict):
                 # ns
                 yield f"{indent}class {name}:"
-                yield from ns_to_s(defn_or_ns, level + 1)
+                yield from ns_to_s(class_name_or_ns, level + 1)
             else:
-                # defn
-                assert isinstance(defn_or_ns, NodeDefn1)
-                yield f"{indent}{name} = {defn_or_ns.class_name}_{defn_or_ns.id}"
+                # class name
+                assert isinstance(class_name_or_ns, str)
+                yield f"{indent}{name} = {class_name_or_ns}"
 
     return "\n".join(ns_to_s(namespace))
+
+
+def _create_registry_def(defns: list[NodeDefn], class_names: dict[str, str]) -> str:
+    """registers node classes by node name (see stub_base.node_class)"""
+
+    lines = ["_NODE_CLASSES.update({"]
+    for defn in defns:
+        lines.append(f"    {json.dumps(defn.name)}: {class_names[defn.name]},")
+    lines.append("})")
+    return "\n".join(lines)
@@ -1,7 +1,19 @@
 import os
 import json
-
-from .defn import NodeDefn, COMFYUI_TYPENAME_TO_JSON_TYPENAME
+import copy
+from collections import OrderedDict
+
+from .defn import (
+    NodeDefn,
+    NodeFilter,
+    COMFYUI_TYPENAME_TO_JSON_TYPENAME,
+    defn_options,
+    defn_shape_hash,
+    filter_defns,
+    is_option_list,
+    options_id,
+    selection_id,
+)
 
 
 SCHEMA_DIR = os.path.join(
@@ -10,6 +22,32 @@ SCHEMA_DIR = os.path.join(
 )
 
 
+_SCHEMA_CACHE: dict[str, dict] = {}
+
+
+def _load_schema(filename: str, major_version, minor_version) -> dict:
+    """
+    return the parsed schema file, cached per process
+
+    the returned dict is shared. do not modify it.
+    """
+
+    schema = _SCHEMA_CACHE.get(filename)
+    if schema is not None:
+        return schema
+
+    base_schema_path = os.path.join(SCHEMA_DIR, filename)
+
+    if not os.path.exists(base_schema_path):
+        raise ValueError(f"Unsupported version: {major_version}.{minor_version} (reading: {base_schema_path})")
+
+    with open(base_schema_path, "r") as f:
+        schema = json.load(f)
+
+    _SCHEMA_CACHE[filename] = schema
+    return schema
+
+
 def load_base_schema(major_version: int = 1, minor_version: int = 0) -> dict:
     """
     return ComfyUI Workflow schema
@@ -19,18 +57,14 @@ def load_base_schema(major_version: int = 1, minor_version: int = 0) -> dict:
     - 1.0 (default)
     """
 
-    base_schema_path = os.path.join(
-        SCHEMA_DIR,
-        "workflow_v1.0.json",
-    )
+    filename = f"workflow_v{major_version}.{minor_version}.json"
+    return copy.deepcopy(_load_schema(filename, major_version, minor_version))
 
-    if not os.path.exists(base_schema_path):
-        raise ValueError(f"Unsupported version: {major_version}.{minor_version} (reading: {base_schema_path})")
-
-    with open(base_schema_path, "r") as f:
-        base_schema = json.load(f)
 
-    return base_schema
+def _api_schema_filename(major_version: int | None, minor_version: int | None) -> str:
+    if major_version is None and minor_version is None:
+        return "workflow_api_unofficial.json"
+    raise ValueError(f"Unsupported version: {major_version}.{minor_version}")
 
 
 def load_base_api_schema(major_version: int | None = None, minor_version: int | None = None) -> dict:
@@ -41,24 +75,15 @@ def load_base_api_schema(major_version: int | None = None, minor_version: int |
     - (None, None) (default): unofficial (undocumented) version
     """
 
-    if major_version is None and minor_version is None:
-        base_schema_path = os.path.join(
-            SCHEMA_DIR,
-            "workflow_api_unofficial.json",
-        )
-    else:
-        raise ValueError(f"Unsupported version: {major_version}.{minor_version}")
+    filename = _api_schema_filename(major_version, minor_version)
+    return copy.deepcopy(_load_schema(filename, major_version, minor_version))
 
-    if not os.path.exists(base_schema_path):
-        raise ValueError(f"Unsupported version: {major_version}.{minor_version} (reading: {base_schema_path})")
 
-    with open(base_schema_path, "r") as f:
-        base_schema = json.load(f)
+_NODE_TYPE_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+_NODE_TYPE_CACHE_SIZE = 8192
 
-    return base_schema
 
-
-def create_node_types_for_api(defns: list[NodeDefn]) -> dict:
+def create_node_types_for_api(defns: list[NodeDefn], max_options: int | None = None) -> dict:
     """
     returns custom node definitions such as:
     {
@@ -89,81 +114,168 @@ def create_node_types_for_api(defns: list[NodeDefn]) -> dict:
         },
         "required": ["class_type", "_meta", "inputs"],
     }
+
+    large selections refer to their option values in shared definitions
+    (see `create_selection_defs_for_api`), and smaller selections with more than
+    `max_options` options are plain strings.
+
+    fragments are cached by shape hash, so they survive changes of option values,
+    and are shared between calls. do not modify them.
     """
 
     result = {}
 
     for defn in defns:
-        inputs = {}
-        required = []
-        for p in defn.input_types:
-            name, typ, req = p.name, p.type, p.required
-            desc = p.desc
-
-            if isinstance(typ, (list, tuple)):
-                # selection
-                if len(typ) == 0:
-                    # とりあえず ^^;
-                    typ = [""]
-                inputs[name] = {"enum": list(typ)}
-            elif typ in COMFYUI_TYPENAME_TO_JSON_TYPENAME:
-                # comfyui builtin type
-                json_type = COMFYUI_TYPENAME_TO_JSON_TYPENAME[typ]
-                inputs[name] = {"type": json_type}
-                if json_type in ("integer", "number"):
-                    if "min" in desc:
-                        inputs[name]["minimum"] = desc["min"]
-                    if "max" in desc:
-                        inputs[name]["maximum"] = desc["max"]
-                    # - step は json schema で表現できないので無視する
-                    #   （min が 0 のときのみ multipleOf で表現できる）
-                    # - round は json schema で表現できないので無視する
-                    # - default は無視する
+        key = f"{defn_shape_hash(defn)}:{max_options}"
+        node_type = _NODE_TYPE_CACHE.get(key)
+        if node_type is None:
+            node_type = _create_node_type_for_api(defn, max_options)
+            _NODE_TYPE_CACHE[key] = node_type
+            if len(_NODE_TYPE_CACHE) > _NODE_TYPE_CACHE_SIZE:
+                _NODE_TYPE_CACHE.popitem(last=False)
+        else:
+            _NODE_TYPE_CACHE.move_to_end(key)
+        result[defn.name] = node_type
+
+    return result
+
+
+_SELECTION_DEFS: "OrderedDict[str, dict]" = OrderedDict()
+_SELECTION_DEFS_SIZE = 1024
+
+
+def create_selection_defs_for_api(defns: list[NodeDefn], max_options: int | None = None) -> dict:
+    """
+    returns shared definitions of option values, referenced by node fragments:
+    {
+        "options_0123456789abcdef": {"$ref": "#/definitions/selection_fedcba9876543210"},
+        "options_00112233445566ff": {"$ref": "#/definitions/selection_fedcba9876543210"},
+        "selection_fedcba9876543210": {"enum": ["a.safetensors", "b.safetensors", ...]},
+        ...
+    }
+
+    each input has its own `options_*` entry, named independently of the values,
+    and each option list is emitted once, however many inputs use it. inputs with
+    more than `max_options` options are plain strings.
+    """
+
+    result = {}
+    for defn in defns:
+        for name, options in defn_options(defn).items():
+            if max_options is not None and len(options) > max_options:
+                result[options_id(defn.name, name)] = {"type": "string"}
+                continue
+
+            selection_name = selection_id(options)
+            result[options_id(defn.name, name)] = {"$ref": f"#/definitions/{selection_name}"}
+            if selection_name in result:
+                continue
+            selection = _SELECTION_DEFS.get(selection_name)
+            if selection is None:
+                selection = {"enum": list(options)}
+                _SELECTION_DEFS[selection_name] = selection
+                if len(_SELECTION_DEFS) > _SELECTION_DEFS_SIZE:
+                    _SELECTION_DEFS.popitem(last=False)
+            result[selection_name] = selection
+    return result
+
+
+def _create_node_type_for_api(defn: NodeDefn, max_options: int | None = None) -> dict:
+    inputs = {}
+    required = []
+    for p in defn.input_types:
+        name, typ, req = p.name, p.type, p.required
+        desc = p.desc
+
+        if isinstance(typ, (list, tuple)):
+            # selection
+            if len(typ) == 0:
+                # とりあえず ^^;
+                typ = [""]
+            if is_option_list(typ):
+                inputs[name] = {"$ref": f"#/definitions/{options_id(defn.name, name)}"}
+            elif max_options is not None and len(typ) > max_options:
+                inputs[name] = {"type": "string"}
             else:
-                # extension type
-                # i beleave it must be linked with another node
-                inputs[name] = {"$ref": "#/definitions/link"}
-
-            if req:
-                required.append(name)
-
-        result[defn.name] = {
-            "type": "object",
-            "properties": {
-                "class_type": {
-                    "type": "string",
-                    "const": defn.name,
-                },
-                "_meta": {
-                    "type": "object",
-                    "properties": {
-                        "title": {
-                            "type": "string",
-                        },
+                inputs[name] = {"enum": list(typ)}
+        elif typ in COMFYUI_TYPENAME_TO_JSON_TYPENAME:
+            # comfyui builtin type
+            json_type = COMFYUI_TYPENAME_TO_JSON_TYPENAME[typ]
+            inputs[name] = {"type": json_type}
+            if json_type in ("integer", "number"):
+                if "min" in desc:
+                    inputs[name]["minimum"] = desc["min"]
+                if "max" in desc:
+                    inputs[name]["maximum"] = desc["max"]
+                # - step は json schema で表現できないので無視する
+                #   （min が 0 のときのみ multipleOf で表現できる）
+                # - round は json schema で表現できないので無視する
+                # - default は無視する
+        else:
+            # extension type
+            # i beleave it must be linked with another node
+            inputs[name] = {"$ref": "#/definitions/link"}
+
+        if req:
+            required.append(name)
+
+    return {
+        "type": "object",
+        "properties": {
+            "class_type": {
+                "type": "string",
+                "const": defn.name,
+            },
+            "_meta": {
+                "type": "object",
+                "properties": {
+                    "title": {
+                        "type": "string",
                     },
-                    "required": ["title"],
-                },
-                "inputs": {
-                    "type": "object",
-                    "properties": inputs,
-                    "required": required,
                 },
+                "required": ["title"],
             },
-            "required": ["class_type", "_meta", "inputs"],
-        }
-
-    return result
+            "inputs": {
+                "type": "object",
+                "properties": inputs,
+                "required": required,
+            },
+        },
+        "required": ["class_type", "_meta", "inputs"],
+    }
 
 
 def create_schema_for_api(
     defns: list[NodeDefn],
     base_major_version: int | None = None,
     base_minor_version: int | None = None,
+    node_filter: NodeFilter | None = None,
+    max_options: int | None = None,
 ) -> dict:
-    schema = load_base_api_schema(base_major_version, base_minor_version)
-    json_defns: dict = schema.setdefault("definitions", {})
+    """
+    return JSON Schema for API-format prompts
+
+    the result is assembled from cached parts (the base schema and per-node
+    fragments) without copying them. do not modify it.
+
+    with `node_filter`, only the selected nodes are included. selections with
+    more than `max_options` options are plain strings.
+    """
+
+    defns = filter_defns(defns, node_filter)
+
+    filename = _api_schema_filename(base_major_version, base_minor_version)
+    base = _load_schema(filename, base_major_version, base_minor_version)
+
+    # copy only the containers on the path to the modified elements
+    schema = dict(base)
+    json_defns: dict = dict(base.get("definitions", {}))
+    schema["definitions"] = json_defns
 
-    node_types: list = json_defns.setdefault("nodeType", {}).setdefault("oneOf", [])
+    node_type: dict = dict(json_defns.get("nodeType", {}))
+    node_types: list = list(node_type.get("oneOf", []))
+    node_type["oneOf"] = node_types
+    json_defns["nodeType"] = node_type
     # {
     #     "definitions": {
     #         "nodeType": {
@@ -174,17 +286,32 @@ def create_schema_for_api(
     #     }
     # }
 
-    for name, defn in create_node_types_for_api(defns).items():
-        node_types.append(defn)
+    node_types.extend(create_node_types_for_api(defns, max_options).values())
+    json_defns.update(create_selection_defs_for_api(defns, max_options))
 
     root: str = schema["$ref"].split("/")[-1]
     root_elem = json_defns[root]
+    node_type_ref = {"$ref": "#/definitions/nodeType"}
     if "oneOf" not in root_elem:
-        oneof = [root_elem]
+        json_defns[root] = {"oneOf": [root_elem, node_type_ref]}
     else:
-        oneof = root_elem["oneOf"]
-
-    oneof.append({"$ref": "#/definitions/nodeType"})
-    json_defns[root]["oneOf"] = oneof
+        json_defns[root] = {**root_elem, "oneOf": [*root_elem["oneOf"], node_type_ref]}
 
     return schema
+
+
+def create_options_for_api(defns: list[NodeDefn]) -> dict:
+    """
+    returns the raw option lists of selection inputs:
+    {
+        "CheckpointLoaderSimple": {"ckpt_name": ["a.safetensors", ...]},
+        ...
+    }
+    """
+
+    result = {}
+    for defn in defns:
+        options = {p.name: p.type for p in defn.input_types if isinstance(p.type, (list, tuple))}
+        if len(options) != 0:
+            result[defn.name] = options
+    return result
@@ -0,0 +1,115 @@
+"""
+opt-in timing instrumentation for the stub / schema endpoints
+
+enabled by setting the environment variable COMFYUI_STUB_PROFILE=1, or per
+request with the `profile=1` query parameter.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Iterator
+
+
+PROFILE_ENV = "COMFYUI_STUB_PROFILE"
+
+SLOWEST_PROVIDERS = 20
+"""number of the slowest INPUT_TYPES providers kept in the stats"""
+
+
+def profile_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "") not in ("", "0", "false", "False")
+
+
+class Timings:
+    """per-phase timings of one request"""
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+        """phase name -> seconds (accumulated if a phase is entered twice)"""
+
+        self.providers: dict[str, float] = {}
+        """node name -> seconds spent in INPUT_TYPES"""
+
+        self.cache: str | None = None
+        """"hit" or "miss" when the response cache was consulted"""
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - t0
+
+    def provider(self, name: str, seconds: float):
+        self.providers[name] = seconds
+
+    def server_timing(self) -> str:
+        """returns the value of Server-Timing header"""
+
+        items = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases.items()]
+        if self.cache is not None:
+            items.append(f'cache;desc="{self.cache}"')
+        return ", ".join(items)
+
+
+def phase(timings: Timings | None, name: str) -> ContextManager:
+    """`timings.phase(name)`, or a no-op when profiling is disabled"""
+
+    if timings is None:
+        return nullcontext()
+    return timings.phase(name)
+
+
+class ProfileStats:
+    """aggregated timings, exposed through the stats endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: dict[str, dict] = {}
+        self._providers: dict[str, float] = {}
+
+    def record(self, endpoint: str, timings: Timings):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {"count": 0, "cache_hits": 0, "total": {}, "last": {}})
+            stats["count"] += 1
+            if timings.cache == "hit":
+                stats["cache_hits"] += 1
+            stats["last"] = dict(timings.phases)
+            for name, seconds in timings.phases.items():
+                stats["total"][name] = stats["total"].get(name, 0.0) + seconds
+
+            for name, seconds in timings.providers.items():
+                if seconds > self._providers.get(name, 0.0):
+                    self._providers[name] = seconds
+
+    def to_dict(self) -> dict:
+        """returns the stats in milliseconds"""
+
+        def ms(phases: dict[str, float]) -> dict[str, float]:
+            return {name: seconds * 1000 for name, seconds in phases.items()}
+
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    "count": stats["count"],
+                    "cache_hits": stats["cache_hits"],
+                    "last_ms": ms(stats["last"]),
+                    "total_ms": ms(stats["total"]),
+                }
+                for endpoint, stats in self._endpoints.items()
+            }
+            providers = sorted(self._providers.items(), key=lambda x: x[1], reverse=True)[:SLOWEST_PROVIDERS]
+
+        return {
+            "enabled": profile_enabled(),
+            "endpoints": endpoints,
+            "slowest_input_types": [{"name": name, "ms": seconds * 1000} for name, seconds in providers],
+        }
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._providers.clear()
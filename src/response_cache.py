@@ -0,0 +1,257 @@
+"""
+encoded (and compressed) response cache for the stub / schema endpoints
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from .defn import NodeDefn, NodeFilter, collect_defns, defn_shape_hash, filter_defns, options_fingerprint, registry_token
+from .profiling import Timings
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+
+# responses are compressed once per cache entry, but on a cache miss the client waits
+# for it; higher levels cost several times the time for a few percent of size
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def shapes_fingerprint(defns: list[NodeDefn]) -> str:
+    """returns a digest that changes whenever the shape of any of the definitions changes"""
+
+    h = hashlib.sha1()
+    for defn in defns:
+        h.update(defn.name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(defn_shape_hash(defn).encode("ascii"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def defns_fingerprint(defns: list[NodeDefn]) -> str:
+    """
+    returns a digest that changes whenever any of the definitions changes
+
+    the digest is "{shapes}.{options}"; when only option values change, the first half stays.
+    """
+
+    return f"{shapes_fingerprint(defns)}.{options_fingerprint(defns)}"
+
+
+class CollectedDefns:
+    """
+    the last unfiltered `collect_defns()` result, with its subsets and their fingerprints
+
+    ComfyUI loads all nodes before the server starts, and afterwards the option values
+    change mostly with the model and input directories. the table is therefore reused
+    while `registry_token()` is unchanged, instead of evaluating every INPUT_TYPES and
+    hashing every definition per request. a stale table is rebuilt by the next
+    unfiltered request; filtered requests then collect just their nodes. without
+    ComfyUI there is no token and every request collects.
+    """
+
+    def __init__(self, max_subsets: int = 64):
+        self.max_subsets = max_subsets
+        self._lock = threading.Lock()
+        self._token: tuple | None = None
+        self._subsets: dict[str, list[NodeDefn]] = {}
+        self._fingerprints: dict[str, str] = {}
+
+    def get(self, timings: Timings | None = None, node_filter: NodeFilter | None = None) -> list[NodeDefn]:
+        """returns the definitions selected by `node_filter`"""
+
+        key = _subset_key(node_filter)
+        token = registry_token()
+        with self._lock:
+            if token is not None and token == self._token:
+                defns = self._subsets.get(key)
+                if defns is None:
+                    if len(self._subsets) > self.max_subsets:
+                        self._subsets = {"": self._subsets[""]}
+                        self._fingerprints = {k: v for k, v in self._fingerprints.items() if k == ""}
+                    defns = self._subsets[key] = filter_defns(self._subsets[""], node_filter)
+                return defns
+
+        if key != "":
+            return list(collect_defns(timings, node_filter).values())
+
+        defns = list(collect_defns(timings).values())
+
+        # collecting fills ComfyUI's filename list cache, which adds its subdirectories to
+        # the token. keep the token as of after collecting, unless a directory it already
+        # covered changed meanwhile (then the next request collects again)
+        after = registry_token()
+        if token is not None and after is not None and token[0] == after[0] and set(token[1]) <= set(after[1]):
+            token = after
+
+        with self._lock:
+            self._token = token
+            self._subsets = {"": defns}
+            self._fingerprints = {}
+        return defns
+
+    def fingerprint(self, defns: list[NodeDefn], node_filter: NodeFilter | None = None) -> str:
+        """returns `defns_fingerprint(defns)`, computed once per subset returned by `get`"""
+
+        key = _subset_key(node_filter)
+        with self._lock:
+            cached = self._subsets.get(key) is defns
+            if cached and key in self._fingerprints:
+                return self._fingerprints[key]
+
+        fingerprint = defns_fingerprint(defns)
+        if cached:
+            with self._lock:
+                if self._subsets.get(key) is defns:
+                    self._fingerprints[key] = fingerprint
+        return fingerprint
+
+
+def _subset_key(node_filter: NodeFilter | None) -> str:
+    return "" if node_filter is None or node_filter.is_empty() else node_filter.key()
+
+
+def _parse_accept_encoding(header: str) -> dict[str, float]:
+    result = {}
+    for item in header.split(","):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+        coding, *params = item.split(";")
+        q = 1.0
+        for param in params:
+            k, _, v = param.strip().partition("=")
+            if k == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        result[coding.strip().lower()] = q
+    return result
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """True if the If-None-Match header lists `etag` (a quoted entity tag), compared weakly"""
+
+    if if_none_match is None:
+        return False
+    for item in if_none_match.split(","):
+        item = item.strip()
+        if item == "*" or item.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class CachedResponse:
+    def __init__(self, key: str, body: bytes, content_type: str, charset: str | None, endpoint: str = ""):
+        self.key = key
+        self.body = body
+        self.content_type = content_type
+        self.charset = charset
+        # the same definitions render different bodies per endpoint (and its filter / options)
+        self.etag = hashlib.sha1(f"{endpoint}\n{key}".encode("utf-8")).hexdigest()
+        self._encoded: dict[str, bytes] = {}
+
+    def etag_for(self, coding: str | None) -> str:
+        """returns the quoted ETag of the body sent with `coding`; each content-encoding has its own"""
+
+        return f'"{self.etag}"' if coding is None else f'"{self.etag}-{coding}"'
+
+    def encoded(self, coding: str) -> bytes:
+        """returns body compressed with `coding` ("gzip" or "br"), cached"""
+
+        data = self._encoded.get(coding)
+        if data is not None:
+            return data
+
+        if coding == "gzip":
+            data = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+        elif coding == "br":
+            if brotli is None:
+                raise ValueError("brotli is not available")
+            data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+        else:
+            raise ValueError(f"unsupported coding: {coding}")
+
+        self._encoded[coding] = data
+        return data
+
+    def is_encoded(self, coding: str | None) -> bool:
+        """True if the body for `coding` is available without compressing"""
+
+        return coding is None or coding in self._encoded
+
+    def negotiate(self, accept_encoding: str | None) -> str | None:
+        """
+        returns the content-encoding for the given Accept-Encoding header, None for identity
+
+        the coding with the highest q-value wins; on ties br is preferred to gzip, and
+        both to identity. identity is used when no coding is acceptable.
+        """
+
+        accepted = _parse_accept_encoding(accept_encoding or "")
+        default = accepted.get("*", 0.0)
+
+        best, best_q = None, accepted.get("identity", 0.0)
+        candidates = ["gzip", "br"] if brotli is not None else ["gzip"]
+        for coding in candidates:
+            q = accepted.get(coding, default)
+            if q > 0 and q >= best_q:
+                best, best_q = coding, q
+        return best
+
+    def select(self, accept_encoding: str | None) -> tuple[bytes, str | None]:
+        """
+        returns (body, content-encoding) for the given Accept-Encoding header
+
+        content-encoding is None for the identity encoding.
+        """
+
+        coding = self.negotiate(accept_encoding)
+        if coding is None:
+            return self.body, None
+        return self.encoded(coding), coding
+
+
+class ResponseCache:
+    """
+    keeps the latest encoded response per endpoint
+
+    an entry is rebuilt when its key changes, i.e. when the definitions
+    it was rendered from change. endpoints include the node filter, so at most
+    `max_entries` of them are kept, least recently used first out.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+
+    def get(
+        self,
+        endpoint: str,
+        key: str,
+        render: Callable[[], bytes],
+        content_type: str,
+        charset: str | None = "utf-8",
+    ) -> CachedResponse:
+        entry = self._entries.get(endpoint)
+        if entry is not None and entry.key == key:
+            self._entries.move_to_end(endpoint)
+            return entry
+
+        entry = CachedResponse(key, render(), content_type, charset, endpoint)
+        self._entries[endpoint] = entry
+        self._entries.move_to_end(endpoint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
@@ -1,8 +1,17 @@
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from collections import OrderedDict, deque
+import os
 import json
+import struct
 import time
-from urllib import request
-from typing import Any, Generic, TypeVar, TypeAlias, Literal, overload
+import heapq
+import hashlib
+import inspect
+import threading
+from urllib import request, error, parse
+from multiprocessing import shared_memory
+from typing import Any, AsyncIterable, AsyncIterator, BinaryIO, Callable, Generic, Iterable, TypeVar, TypeAlias, Literal, Sequence, overload, get_args, get_origin
 
 #
 # Node Input / Output Types
@@ -79,9 +88,9 @@ class ComfyOutput(Generic[_T]):
             raise RuntimeError("not same workflow context")
 
         # add nodes and create link self -> other
-        if not any(self.node is n.node for n in wf._nodes):
+        if self.node not in wf._ids:
             wf.add(self.node)
-        if not any(other.node is n.node for n in wf._nodes):
+        if other.node not in wf._ids:
             wf.add(other.node)
 
         return wf.link(self, other)
@@ -95,6 +104,9 @@ class ComfyOutput(Generic[_T]):
 class _Node:
     _context: "Workflow | None" = None
 
+    OUTPUT_NODE: bool = False
+    """True if this node is an output (sink) node such as SaveImage"""
+
     def __init__(self, name: str):
         self.name = name
         self._inputs: list[ComfyInput] = []
@@ -151,6 +163,389 @@ class _Node:
     __rtruediv__ = input  # n / self == self.input(n)
 
 
+#
+# Result Cache
+#
+
+
+def _is_link(value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+        and not isinstance(value[1], bool)
+    )
+
+
+def _node_hashes(prompt: dict) -> dict[str, str]:
+    """
+    returns {node id: hash of the node and all of its ancestors}
+
+    the hash does not depend on node ids, the order of inputs, or titles (`_meta`).
+    """
+
+    memo: dict[str, str] = {}
+
+    for root in prompt:
+        # iterative post-order DFS; workflows can be deeper than the recursion limit
+        stack = [(root, False)]
+        visiting = set()
+        while len(stack) != 0:
+            nid, expanded = stack.pop()
+            if nid in memo:
+                continue
+
+            node = prompt[nid]
+            inputs: dict = node.get("inputs", {})
+            links = [v[0] for v in inputs.values() if _is_link(v) and v[0] in prompt]
+
+            if not expanded:
+                if nid in visiting:
+                    raise ValueError(f"cycle detected at node {nid}")
+                visiting.add(nid)
+                stack.append((nid, True))
+                stack.extend((src, False) for src in links if src not in memo)
+                continue
+
+            canonical = {}
+            for name, value in inputs.items():
+                if _is_link(value) and value[0] in prompt:
+                    canonical[name] = ["$link", memo[value[0]], value[1]]
+                else:
+                    canonical[name] = value
+
+            data = json.dumps([node.get("class_type"), canonical], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+            memo[nid] = hashlib.sha256(data.encode("utf-8")).hexdigest()
+            visiting.discard(nid)
+
+    return memo
+
+
+def workflow_hash(prompt: dict) -> str:
+    """
+    returns a canonical hash of an API-format prompt
+
+    the hash does not depend on node ids, the order of nodes or inputs, or titles
+    (`_meta`), so the same graph built in a different order gets the same hash.
+    """
+
+    return _workflow_hash(_node_hashes(prompt))
+
+
+def _workflow_hash(hashes: dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    for h in sorted(hashes.values()):
+        digest.update(h.encode("ascii"))
+    return digest.hexdigest()
+
+
+def topological_prompt(prompt: dict) -> dict:
+    """
+    returns an API-format prompt with nodes in topological order and ids renumbered from 0
+
+    independent nodes are ordered by their content (see `workflow_hash`), so the same
+    graph gets the same ids however it was built. only nodes with identical content
+    and ancestors keep their relative order.
+    """
+
+    hashes = _node_hashes(prompt)
+    order = {nid: i for i, nid in enumerate(prompt)}
+
+    indegree = {nid: 0 for nid in prompt}
+    succs: dict[str, list[str]] = {nid: [] for nid in prompt}
+    for nid, node in prompt.items():
+        for value in node.get("inputs", {}).values():
+            if _is_link(value) and value[0] in prompt:
+                succs[value[0]].append(nid)
+                indegree[nid] += 1
+
+    ready = [(hashes[nid], order[nid], nid) for nid, d in indegree.items() if d == 0]
+    heapq.heapify(ready)
+    new_ids: dict[str, str] = {}
+    while len(ready) != 0:
+        _, _, nid = heapq.heappop(ready)
+        new_ids[nid] = str(len(new_ids))
+        for dst in succs[nid]:
+            indegree[dst] -= 1
+            if indegree[dst] == 0:
+                heapq.heappush(ready, (hashes[dst], order[dst], dst))
+
+    result = {}
+    for nid, new_id in new_ids.items():
+        node = prompt[nid]
+        inputs = {}
+        for name, value in node.get("inputs", {}).items():
+            if _is_link(value) and value[0] in new_ids:
+                value = [new_ids[value[0]], value[1]]
+            inputs[name] = value
+        result[new_id] = {**node, "inputs": inputs}
+
+    return result
+
+
+class ResultCache(ABC):
+    """
+    cache of Workflow.call / acall results keyed by `workflow_hash` and the server URL
+
+    pass an instance as `cache=` to call / acall. values are JSON-serializable dicts
+    holding the history and the node hashes it was stored with, so that a hit for
+    the same graph built with other node ids is returned with the caller's ids.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> dict | None: ...
+
+    @abstractmethod
+    def put(self, key: str, value: dict): ...
+
+
+class MemoryResultCache(ResultCache):
+    """
+    in-memory LRU cache with optional TTL (seconds)
+
+    values are kept as JSON text, so every `get` returns a fresh copy that the caller
+    may modify without affecting the cache.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            t, value = entry
+            if self.ttl is not None and time.monotonic() - t > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(value)
+
+    def put(self, key: str, value: dict):
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class DiskResultCache(ResultCache):
+    """on-disk cache (one JSON file per entry) with optional TTL (seconds)"""
+
+    def __init__(self, directory: str, ttl: float | None = None):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, value: dict):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+def _result_cache_key(hashes: dict[str, str], url: str) -> str:
+    digest = hashlib.sha256(url.rstrip("/").encode("utf-8"))
+    digest.update(_workflow_hash(hashes).encode("ascii"))
+    return digest.hexdigest()
+
+
+def _cache_get(cache: ResultCache, prompt: dict, url: str) -> tuple[str, dict[str, str], dict | None]:
+    """returns (key, node hashes of `prompt`, cached history with the ids of `prompt` or None)"""
+
+    hashes = _node_hashes(prompt)
+    key = _result_cache_key(hashes, url)
+    entry = cache.get(key)
+    if entry is None or "history" not in entry or "node_hashes" not in entry:
+        return key, hashes, None
+    return key, hashes, _remap_history(entry["history"], entry["node_hashes"], hashes, prompt)
+
+
+def _cache_put(cache: ResultCache, key: str, hashes: dict[str, str], history: dict):
+    cache.put(key, {"node_hashes": hashes, "history": history})
+
+
+def _remap_history(history: dict, old_hashes: dict[str, str], new_hashes: dict[str, str], prompt: dict) -> dict:
+    """
+    returns `history` with node ids of the cached prompt replaced by those of `prompt`
+
+    nodes are matched by their hash; nodes with the same hash (identical content and
+    ancestors) are matched in order.
+    """
+
+    new_ids: dict[str, list[str]] = {}
+    for nid, h in new_hashes.items():
+        new_ids.setdefault(h, []).append(nid)
+    used: dict[str, int] = {}
+    ids: dict[str, str] = {}
+    for nid, h in old_hashes.items():
+        candidates = new_ids.get(h, ())
+        i = used.get(h, 0)
+        if i < len(candidates):
+            ids[nid] = candidates[i]
+            used[h] = i + 1
+
+    if all(old == new for old, new in ids.items()):
+        return history
+
+    def map_id(nid):
+        return ids.get(nid, nid) if isinstance(nid, str) else nid
+
+    result = dict(history)
+    if isinstance(history.get("outputs"), dict):
+        result["outputs"] = {map_id(nid): v for nid, v in history["outputs"].items()}
+    if isinstance(history.get("meta"), dict):
+        meta = {}
+        for nid, v in history["meta"].items():
+            if isinstance(v, dict):
+                v = dict(v)
+                for k in ("node_id", "display_node"):
+                    if k in v:
+                        v[k] = map_id(v[k])
+            meta[map_id(nid)] = v
+        result["meta"] = meta
+    if isinstance(history.get("prompt"), list) and len(history["prompt"]) >= 3:
+        # [number, prompt_id, prompt, extra_data, outputs_to_execute]
+        entry = list(history["prompt"])
+        entry[2] = prompt
+        if len(entry) >= 5 and isinstance(entry[4], list):
+            entry[4] = [map_id(nid) for nid in entry[4]]
+        result["prompt"] = entry
+    status = history.get("status")
+    if isinstance(status, dict) and isinstance(status.get("messages"), list):
+        messages = []
+        for message in status["messages"]:
+            if isinstance(message, list) and len(message) == 2 and isinstance(message[1], dict):
+                data = dict(message[1])
+                if "node" in data:
+                    data["node"] = map_id(data["node"])
+                if "node_id" in data:
+                    data["node_id"] = map_id(data["node_id"])
+                if isinstance(data.get("nodes"), list):
+                    data["nodes"] = [map_id(nid) for nid in data["nodes"]]
+                message = [message[0], data]
+            messages.append(message)
+        result["status"] = {**status, "messages": messages}
+    return result
+
+
+_NODE_CLASSES: dict[str, type[_Node]] = {}
+"""node name -> generated class (filled at the end of the generated stub)"""
+
+
+def node_class(class_type: str) -> type[_Node]:
+    """returns the generated class of the node named `class_type`"""
+
+    klass = _NODE_CLASSES.get(class_type)
+    if klass is None:
+        raise ValueError(f"unknown class_type: {class_type}")
+    return klass
+
+
+@dataclass(frozen=True)
+class _NodeSpec:
+    class_type: str
+    klass: type[_Node]
+    inputs: tuple[ComfyInput, ...]
+    """inputs of an instance built with default arguments"""
+    input_index: dict[str, int]
+    outputs: tuple[ComfyOutput, ...]
+    output_types: tuple[Any, ...]
+    output_node: bool
+    optional: frozenset[int]
+    """indices of the optional inputs"""
+
+
+_NODE_SPECS: dict[str, _NodeSpec] = {}
+
+
+def _node_spec(class_type: str) -> _NodeSpec:
+    spec = _NODE_SPECS.get(class_type)
+    if spec is not None:
+        return spec
+
+    klass = node_class(class_type)
+
+    # build a detached instance to read the inputs and defaults
+    context = _Node._context
+    _Node._context = None
+    try:
+        node = klass()
+    finally:
+        _Node._context = context
+
+    # optional inputs are annotated `T | None` in the constructor, in the order of the inputs
+    params = list(inspect.signature(klass.__init__).parameters.values())[1:]
+    optional = frozenset(i for i, p in enumerate(params) if type(None) in get_args(p.annotation))
+
+    spec = _NodeSpec(
+        class_type,
+        klass,
+        tuple(node._inputs),
+        {inp.name: inp.index for inp in node._inputs},
+        tuple(node._outputs),
+        tuple(out.type for out in node._outputs),
+        node.OUTPUT_NODE,
+        optional,
+    )
+    _NODE_SPECS[class_type] = spec
+    return spec
+
+
+def _spec_node(spec: _NodeSpec, values: dict[int, Any]) -> _Node:
+    """creates a node of `spec` without running the constructor; `values` overrides the defaults"""
+
+    klass = spec.klass
+    node = klass.__new__(klass)
+    node.name = spec.class_type
+    node._inputs = [ComfyInput(node, inp.index, inp.name, inp.type, values.get(inp.index, inp.value)) for inp in spec.inputs]
+    node._outputs = [ComfyOutput(node, out.index, out.name, out.type) for out in spec.outputs]
+    return node
+
+
+def _is_widget(typ) -> bool:
+    # inputs shown as widgets in the UI, as opposed to sockets
+    return typ in (int, float, str, bool) or get_origin(typ) is Literal
+
+
+def _check_literal(typ, value) -> bool:
+    if typ is Any:
+        return True
+    if get_origin(typ) is Literal:
+        return value in get_args(typ)
+    if typ is bool:
+        return isinstance(value, bool)
+    if typ is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    if typ is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if typ is str:
+        return isinstance(value, str)
+    # extension types must be linked
+    return False
+
+
 #
 # Workflow
 #
@@ -170,22 +565,1096 @@ class Link:
     dst_index: int
 
 
+@dataclass
+class CallMetrics:
+    """metrics of one Workflow.call / acall"""
+
+    prompt_id: str | None = None
+
+    submit_latency: float | None = None
+    """seconds to POST /prompt"""
+
+    time_to_first_progress: float | None = None
+    """seconds from submission until the server started executing the prompt (queue wait)
+
+    computed from the server's `execution_start` timestamp, so it is affected by clock skew
+    between this host and the server.
+    """
+
+    execution_time: float | None = None
+    """seconds the server spent executing the prompt"""
+
+    time_to_completion: float | None = None
+    """seconds from submission until the completed history was received"""
+
+    polls: int = 0
+    """number of /history requests"""
+
+    bytes_sent: int = 0
+
+    bytes_received: int = 0
+
+    retries: int = 0
+    """number of retried requests"""
+
+    cache_hit: bool = False
+    """True if the result was returned from the result cache without submission"""
+
+    def _complete(self, history: dict, t_submit: float, submitted_at: float):
+        self.time_to_completion = time.perf_counter() - t_submit
+
+        # [["execution_start", {"timestamp": ms, ...}], ..., ["execution_success", {...}]]
+        started = finished = None
+        for message in history.get("status", {}).get("messages", []):
+            if not isinstance(message, (list, tuple)) or len(message) != 2 or not isinstance(message[1], dict):
+                continue
+            kind, body = message
+            timestamp = body.get("timestamp")
+            if not isinstance(timestamp, (int, float)):
+                continue
+            if kind == "execution_start":
+                started = timestamp / 1000
+            elif kind in ("execution_success", "execution_error", "execution_interrupted"):
+                finished = timestamp / 1000
+
+        if started is not None:
+            self.time_to_first_progress = max(0.0, started - submitted_at)
+            if finished is not None:
+                self.execution_time = max(0.0, finished - started)
+
+
+class CallHook:
+    """
+    hooks of Workflow.call / acall
+
+    override the methods you need and append an instance to `Workflow.hooks`.
+    all methods receive the (mutable) metrics of the current call.
+    """
+
+    def on_submit(self, metrics: CallMetrics):
+        """called after the prompt was queued"""
+
+    def on_poll(self, metrics: CallMetrics):
+        """called after each /history request"""
+
+    def on_complete(self, metrics: CallMetrics):
+        """called when the prompt completed"""
+
+    def on_error(self, metrics: CallMetrics, error: BaseException):
+        """called when the call failed, including timeout and cancellation"""
+
+
+def _remaining(url: str, deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError(f"request to {url} timed out")
+    return remaining
+
+
+def _http_request(url: str, data: bytes | None, metrics: CallMetrics, retries: int, deadline: float) -> bytes:
+    """
+    GET (or POST `data` to) `url`
+
+    each attempt is given the time left until `deadline` (time.monotonic()), so a
+    stalled server cannot block the caller past it.
+    """
+
+    # retry only on connection errors, not on HTTP errors
+    attempt = 0
+    while True:
+        try:
+            with request.urlopen(request.Request(url, data=data), timeout=_remaining(url, deadline)) as res:
+                body = res.read()
+            break
+        except error.HTTPError:
+            raise
+        except (error.URLError, ConnectionError, TimeoutError) as e:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"request to {url} timed out") from e
+            if attempt >= retries:
+                raise
+            attempt += 1
+            metrics.retries += 1
+            time.sleep(min(0.1 * 2**attempt, 2.0, _remaining(url, deadline)))
+
+    if data is not None:
+        metrics.bytes_sent += len(data)
+    metrics.bytes_received += len(body)
+    return body
+
+
+async def _ahttp_request(
+    session,
+    url: str,
+    data: bytes | None,
+    metrics: CallMetrics,
+    retries: int,
+    deadline: float | None = None,
+) -> bytes:
+    import asyncio
+    import aiohttp
+
+    attempt = 0
+    while True:
+        # without a deadline, the session's timeout applies
+        timeout = None if deadline is None else aiohttp.ClientTimeout(total=_remaining(url, deadline))
+        try:
+            if data is None:
+                async with session.get(url, timeout=timeout) as res:
+                    res.raise_for_status()
+                    body = await res.read()
+            else:
+                async with session.post(url, data=data, timeout=timeout) as res:
+                    res.raise_for_status()
+                    body = await res.read()
+            break
+        except aiohttp.ClientResponseError:
+            raise
+        except (aiohttp.ClientConnectionError, ConnectionError, asyncio.TimeoutError) as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"request to {url} timed out") from e
+            if attempt >= retries:
+                raise
+            attempt += 1
+            metrics.retries += 1
+            delay = min(0.1 * 2**attempt, 2.0)
+            await asyncio.sleep(delay if deadline is None else min(delay, _remaining(url, deadline)))
+
+    if data is not None:
+        metrics.bytes_sent += len(data)
+    metrics.bytes_received += len(body)
+    return body
+
+
+POLL_INTERVAL_MIN = 0.01
+POLL_INTERVAL_MAX = 0.5
+POLL_BACKOFF = 1.5
+"""the /history poll interval grows from MIN by this factor up to MAX"""
+
+
+def _poll_interval(interval: float, deadline: float) -> float:
+    # never sleep past the deadline
+    return max(0.0, min(interval, deadline - time.monotonic()))
+
+
+def _cancel_requests(prompt_id: str, running: bool) -> list[tuple[str, bytes]]:
+    # deleting a running prompt from the queue does not stop it; interrupt only our own prompt
+    requests = [("/queue", json.dumps({"delete": [prompt_id]}).encode("utf-8"))]
+    if running:
+        requests.append(("/interrupt", json.dumps({"prompt_id": prompt_id}).encode("utf-8")))
+    return requests
+
+
+def _is_running(queue: bytes, prompt_id: str) -> bool:
+    running = json.loads(queue).get("queue_running", [])
+    return any(isinstance(item, list) and len(item) > 1 and item[1] == prompt_id for item in running)
+
+
+def cancel_prompt(prompt_id: str, url: str = "http://127.0.0.1:8188", timeout: float = 5.0):
+    """removes a prompt from the queue, or interrupts it if it is already running"""
+
+    with request.urlopen(f"{url}/queue", timeout=timeout) as res:
+        running = _is_running(res.read(), prompt_id)
+    for path, data in _cancel_requests(prompt_id, running):
+        req = request.Request(f"{url}{path}", data=data, headers={"Content-Type": "application/json"})
+        with request.urlopen(req, timeout=timeout) as res:
+            res.read()
+
+
+async def acancel_prompt(session, prompt_id: str, url: str = "http://127.0.0.1:8188"):
+    """async version of `cancel_prompt`"""
+
+    async with session.get(f"{url}/queue") as res:
+        running = _is_running(await res.read(), prompt_id)
+    for path, data in _cancel_requests(prompt_id, running):
+        async with session.post(f"{url}{path}", data=data, headers={"Content-Type": "application/json"}) as res:
+            await res.read()
+
+
+async def _acancel_quietly(session, prompt_id: str, url: str, timeout: float = 5.0):
+    import asyncio
+
+    # shielded so that cancellation of the calling task does not abort the cancel requests
+    try:
+        await asyncio.wait_for(asyncio.shield(acancel_prompt(session, prompt_id, url)), timeout)
+    except BaseException:
+        pass
+
+
+def call_prompt(
+    prompt: dict,
+    url: str = "http://127.0.0.1:8188",
+    timeout: float = 60.0,
+    retries: int = 0,
+    cache: ResultCache | None = None,
+    hooks: list[CallHook] | tuple[CallHook, ...] = (),
+    metrics: CallMetrics | None = None,
+    cancel: bool = True,
+) -> dict:
+    """
+    submits an API-format prompt and waits for its history (see `Workflow.call`)
+
+    if `cancel` is True, a prompt that times out (or is interrupted, e.g. by Ctrl+C) is
+    removed from the server's queue, or interrupted if it is already running.
+    """
+
+    prompt_data = json.dumps({"prompt": prompt}, ensure_ascii=False).encode("utf-8")
+
+    if metrics is None:
+        metrics = CallMetrics()
+
+    cache_key = cache_hashes = None
+    if cache is not None:
+        cache_key, cache_hashes, cached = _cache_get(cache, prompt, url)
+        if cached is not None:
+            metrics.cache_hit = True
+            for hook in hooks:
+                hook.on_complete(metrics)
+            return cached
+
+    prompt_id = None
+    try:
+        t_submit = time.perf_counter()
+        submitted_at = time.time()
+        deadline = time.monotonic() + timeout
+        data = json.loads(_http_request(f"{url}/prompt", prompt_data, metrics, retries, deadline))
+
+        prompt_id = data["prompt_id"]
+        metrics.prompt_id = prompt_id
+        metrics.submit_latency = time.perf_counter() - t_submit
+        for hook in hooks:
+            hook.on_submit(metrics)
+
+        interval = POLL_INTERVAL_MIN
+        while time.monotonic() < deadline:
+            body = _http_request(f"{url}/history/{prompt_id}", None, metrics, retries, deadline)
+            metrics.polls += 1
+            data: dict = json.loads(body).get(prompt_id, {})
+            for hook in hooks:
+                hook.on_poll(metrics)
+            if not data.get("status", {}).get("completed", False):
+                time.sleep(_poll_interval(interval, deadline))
+                interval = min(interval * POLL_BACKOFF, POLL_INTERVAL_MAX)
+                continue
+            metrics._complete(data, t_submit, submitted_at)
+            if cache is not None and data["status"].get("status_str") != "error":
+                _cache_put(cache, cache_key, cache_hashes, data)
+            for hook in hooks:
+                hook.on_complete(metrics)
+            return data
+
+        raise TimeoutError(f"timeout {timeout} sec")
+    except BaseException as e:
+        if cancel and prompt_id is not None:
+            try:
+                cancel_prompt(prompt_id, url)
+            except Exception:
+                pass
+        for hook in hooks:
+            hook.on_error(metrics, e)
+        raise
+
+
+async def acall_prompt(
+    prompt: dict,
+    url: str = "http://127.0.0.1:8188",
+    timeout: float = 60.0,
+    retries: int = 0,
+    cache: ResultCache | None = None,
+    hooks: list[CallHook] | tuple[CallHook, ...] = (),
+    metrics: CallMetrics | None = None,
+    cancel: bool = True,
+) -> dict:
+    """
+    submits an API-format prompt and waits for its history (see `Workflow.acall`)
+
+    as in `call_prompt`, `cancel` also covers cancellation of the calling task.
+    """
+
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        return await _acall_prompt(session, prompt, url, timeout, retries, cache, hooks, metrics, cancel)
+
+
+async def _acall_prompt(
+    session,
+    prompt: dict,
+    url: str,
+    timeout: float,
+    retries: int,
+    cache: ResultCache | None,
+    hooks: list[CallHook] | tuple[CallHook, ...],
+    metrics: CallMetrics | None,
+    cancel: bool,
+) -> dict:
+    prompt_data = json.dumps({"prompt": prompt}, ensure_ascii=False).encode("utf-8")
+
+    import asyncio
+
+    if metrics is None:
+        metrics = CallMetrics()
+
+    cache_key = cache_hashes = None
+    if cache is not None:
+        cache_key, cache_hashes, cached = _cache_get(cache, prompt, url)
+        if cached is not None:
+            metrics.cache_hit = True
+            for hook in hooks:
+                hook.on_complete(metrics)
+            return cached
+
+    prompt_id = None
+    try:
+        try:
+            t_submit = time.perf_counter()
+            submitted_at = time.time()
+            deadline = time.monotonic() + timeout
+            body = await _ahttp_request(session, f"{url}/prompt", prompt_data, metrics, retries, deadline)
+            data = json.loads(body)
+
+            prompt_id = data["prompt_id"]
+            metrics.prompt_id = prompt_id
+            metrics.submit_latency = time.perf_counter() - t_submit
+            for hook in hooks:
+                hook.on_submit(metrics)
+
+            interval = POLL_INTERVAL_MIN
+            while time.monotonic() < deadline:
+                body = await _ahttp_request(session, f"{url}/history/{prompt_id}", None, metrics, retries, deadline)
+                metrics.polls += 1
+                data = json.loads(body).get(prompt_id, {})
+                for hook in hooks:
+                    hook.on_poll(metrics)
+                if not data.get("status", {}).get("completed", False):
+                    await asyncio.sleep(_poll_interval(interval, deadline))
+                    interval = min(interval * POLL_BACKOFF, POLL_INTERVAL_MAX)
+                    continue
+                metrics._complete(data, t_submit, submitted_at)
+                if cache is not None and data["status"].get("status_str") != "error":
+                    _cache_put(cache, cache_key, cache_hashes, data)
+                for hook in hooks:
+                    hook.on_complete(metrics)
+                return data
+
+            raise TimeoutError(f"timeout {timeout} sec")
+        except BaseException:
+            if cancel and prompt_id is not None:
+                await _acancel_quietly(session, prompt_id, url)
+            raise
+    except BaseException as e:
+        for hook in hooks:
+            hook.on_error(metrics, e)
+        raise
+
+
+#
+# Outputs
+#
+
+
+@dataclass(frozen=True)
+class OutputFile:
+    """a file in the outputs of a prompt, downloadable from /view"""
+
+    node_id: str
+    kind: str
+    """key in the node output, e.g. "images" or "gifs" """
+    filename: str
+    subfolder: str
+    type: str
+    """"output", "temp" or "input" """
+
+    def view_path(self) -> str:
+        query = parse.urlencode({"filename": self.filename, "subfolder": self.subfolder, "type": self.type})
+        return f"/view?{query}"
+
+
+def _node_output_files(node_id: str, output: dict) -> list[OutputFile]:
+    result = []
+    for kind, items in output.items():
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if isinstance(item, dict) and isinstance(item.get("filename"), str):
+                result.append(
+                    OutputFile(node_id, kind, item["filename"], item.get("subfolder", ""), item.get("type", "output"))
+                )
+    return result
+
+
+def output_files(history: dict) -> list[OutputFile]:
+    """returns the files in `history["outputs"]` of all output nodes"""
+
+    result = []
+    for node_id, output in history.get("outputs", {}).items():
+        if isinstance(output, dict):
+            result.extend(_node_output_files(node_id, output))
+    return result
+
+
+OutputDest: TypeAlias = "str | Callable[[OutputFile], BinaryIO]"
+"""a directory, or a function returning a writable binary buffer for each file"""
+
+
+def _open_dest(dest, file: OutputFile) -> tuple[BinaryIO, Any, bool]:
+    """
+    returns (writer, result, whether to close the writer)
+
+    `subfolder` and `filename` come from the server; files resolving outside of a
+    directory `dest` (absolute paths, `..`) are rejected with ValueError.
+    """
+
+    if isinstance(dest, str):
+        path = os.path.join(dest, file.subfolder, file.filename)
+        root = os.path.abspath(dest)
+        target = os.path.abspath(path)
+        if (
+            os.path.isabs(file.subfolder)
+            or os.path.isabs(file.filename)
+            or target == root
+            or os.path.commonpath([root, target]) != root
+        ):
+            raise ValueError(f"output file outside of {dest}: {file.subfolder!r}, {file.filename!r}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, "wb"), path, True
+    f = dest(file)
+    return f, f, False
+
+
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+
+def download_outputs(
+    files: list[OutputFile] | dict,
+    dest: OutputDest,
+    url: str = "http://127.0.0.1:8188",
+    max_workers: int = 4,
+    metrics: CallMetrics | None = None,
+) -> list[tuple[OutputFile, Any]]:
+    """
+    downloads output files from /view in parallel, streaming each to `dest`
+
+    `files` is a list of `OutputFile` or a history dict. each worker thread keeps one
+    keep-alive connection. returns (file, path or buffer) in the order of `files`.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+    from http import client
+
+    if isinstance(files, dict):
+        files = output_files(files)
+
+    u = parse.urlsplit(url)
+    conn_class = client.HTTPSConnection if u.scheme == "https" else client.HTTPConnection
+    local = threading.local()
+    lock = threading.Lock()
+
+    def fetch(file: OutputFile):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = conn_class(u.netloc)
+
+        try:
+            conn.request("GET", u.path.rstrip("/") + file.view_path())
+            res = conn.getresponse()
+        except (OSError, client.HTTPException):
+            # stale keep-alive connection; retry once on a fresh one
+            conn.close()
+            conn = local.conn = conn_class(u.netloc)
+            conn.request("GET", u.path.rstrip("/") + file.view_path())
+            res = conn.getresponse()
+
+        if res.status != 200:
+            res.read()
+            raise error.HTTPError(url + file.view_path(), res.status, res.reason, res.headers, None)
+
+        writer, result, close = _open_dest(dest, file)
+        size = 0
+        try:
+            while True:
+                chunk = res.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                size += len(chunk)
+        finally:
+            if close:
+                writer.close()
+
+        if metrics is not None:
+            with lock:
+                metrics.bytes_received += size
+        return file, result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(fetch, files))
+
+
+async def _adownload(session, url: str, file: OutputFile, dest: OutputDest, metrics: CallMetrics | None):
+    async with session.get(url + file.view_path()) as res:
+        res.raise_for_status()
+        writer, result, close = _open_dest(dest, file)
+        try:
+            async for chunk in res.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                writer.write(chunk)
+                if metrics is not None:
+                    metrics.bytes_received += len(chunk)
+        finally:
+            if close:
+                writer.close()
+    return file, result
+
+
+async def adownload_outputs(
+    files: list[OutputFile] | dict,
+    dest: OutputDest,
+    url: str = "http://127.0.0.1:8188",
+    max_concurrency: int = 4,
+    metrics: CallMetrics | None = None,
+) -> list[tuple[OutputFile, Any]]:
+    """async version of `download_outputs`, over one pooled aiohttp session"""
+
+    import asyncio
+    import aiohttp
+
+    if isinstance(files, dict):
+        files = output_files(files)
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return list(await asyncio.gather(*[_adownload(session, url, f, dest, metrics) for f in files]))
+
+
+async def acall_prompt_download(
+    prompt: dict,
+    dest: OutputDest,
+    url: str = "http://127.0.0.1:8188",
+    timeout: float = 60.0,
+    max_concurrency: int = 4,
+    hooks: list[CallHook] | tuple[CallHook, ...] = (),
+    metrics: CallMetrics | None = None,
+    cancel: bool = True,
+) -> tuple[dict, list[tuple[OutputFile, Any]]]:
+    """
+    submits a prompt and downloads its output files while it is still running
+
+    listens to the websocket for `executed` messages and starts downloading each node's
+    files as soon as they are reported. outputs of cached nodes, which are not reported,
+    are taken from the history after completion. returns (history, downloaded files).
+    """
+
+    import asyncio
+    import aiohttp
+
+    if metrics is None:
+        metrics = CallMetrics()
+
+    client_id = os.urandom(16).hex()
+    prompt_data = json.dumps({"prompt": prompt, "client_id": client_id}, ensure_ascii=False).encode("utf-8")
+
+    scheduled: dict[OutputFile, asyncio.Task] = {}
+
+    async def run(session) -> dict:
+        def schedule(files: list[OutputFile]):
+            for f in files:
+                if f not in scheduled:
+                    scheduled[f] = asyncio.ensure_future(_adownload(session, url, f, dest, metrics))
+
+        async with session.ws_connect(f"{url}/ws?clientId={client_id}") as ws:
+            t_submit = time.perf_counter()
+            submitted_at = time.time()
+            body = await _ahttp_request(session, f"{url}/prompt", prompt_data, metrics, 0)
+            prompt_id = json.loads(body)["prompt_id"]
+            metrics.prompt_id = prompt_id
+            metrics.submit_latency = time.perf_counter() - t_submit
+            for hook in hooks:
+                hook.on_submit(metrics)
+
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    # binary previews
+                    continue
+                message = json.loads(msg.data)
+                data = message.get("data") or {}
+                if data.get("prompt_id") != prompt_id:
+                    continue
+                kind = message.get("type")
+                if kind == "executed" and isinstance(data.get("output"), dict):
+                    schedule(_node_output_files(str(data.get("node")), data["output"]))
+                elif kind in ("execution_success", "execution_error", "execution_interrupted"):
+                    break
+                elif kind == "executing" and data.get("node") is None:
+                    break
+
+        # the history may be written after the last message (or the websocket may have
+        # been closed early), so poll until it has its status
+        interval = POLL_INTERVAL_MIN
+        while True:
+            body = await _ahttp_request(session, f"{url}/history/{prompt_id}", None, metrics, 0)
+            metrics.polls += 1
+            history = json.loads(body).get(prompt_id, {})
+            if "status" in history:
+                break
+            await asyncio.sleep(interval)
+            interval = min(interval * POLL_BACKOFF, POLL_INTERVAL_MAX)
+        metrics._complete(history, t_submit, submitted_at)
+        schedule(output_files(history))
+        await asyncio.gather(*scheduled.values())
+        return history
+
+    try:
+        connector = aiohttp.TCPConnector(limit=max_concurrency + 1)  # + websocket
+        async with aiohttp.ClientSession(connector=connector) as session:
+            try:
+                history = await asyncio.wait_for(run(session), timeout)
+            except BaseException as e:
+                if cancel and metrics.prompt_id is not None:
+                    await _acancel_quietly(session, metrics.prompt_id, url)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise TimeoutError(f"timeout {timeout} sec") from None
+                raise
+            finally:
+                for task in scheduled.values():
+                    task.cancel()
+        for hook in hooks:
+            hook.on_complete(metrics)
+        return history, [task.result() for task in scheduled.values()]
+    except BaseException as e:
+        for hook in hooks:
+            hook.on_error(metrics, e)
+        raise
+
+
+#
+# Dispatcher
+#
+
+
+_MODEL_EXTENSIONS = (".safetensors", ".ckpt", ".pt", ".pth", ".bin", ".gguf", ".sft")
+
+
+def model_keys(prompt: dict) -> set[str]:
+    """returns the model files a prompt loads, i.e. `*_name` inputs of loader nodes"""
+
+    result = set()
+    for node in prompt.values():
+        if "Loader" not in node.get("class_type", ""):
+            continue
+        for name, value in node.get("inputs", {}).items():
+            if name.endswith("_name") and isinstance(value, str) and value.lower().endswith(_MODEL_EXTENSIONS):
+                result.add(value)
+    return result
+
+
+class Backend:
+    """a ComfyUI server known to a Dispatcher"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+        self.inflight = 0
+        """prompts submitted through the dispatcher and not finished yet"""
+
+        self.queue_depth: int | None = None
+        """running + pending prompts reported by /queue at the last dispatch"""
+
+        self.models: set[str] = set()
+        """model files loaded by prompts that completed on this backend"""
+
+        self.failures = 0
+        """consecutive failures"""
+
+    def load(self) -> int:
+        # the server's queue includes our own in-flight prompts
+        if self.queue_depth is None:
+            return self.inflight
+        return max(self.queue_depth, self.inflight)
+
+    def __repr__(self):
+        return f"Backend({self.url!r}, load={self.load()}, failures={self.failures})"
+
+
+def _queue_depth(body: bytes) -> int:
+    data = json.loads(body)
+    return len(data.get("queue_running", [])) + len(data.get("queue_pending", []))
+
+
+class Dispatcher:
+    """
+    routes prompts to the least-loaded of several ComfyUI servers
+
+    the load of a backend is its /queue depth (or the number of prompts in flight through
+    this dispatcher when `use_queue` is False). among backends within `affinity` of the
+    least load, the one that already ran the most of the prompt's models is preferred.
+    a failed submission is retried on the next backend, up to `failover` times.
+
+        dispatcher = Dispatcher(["http://gpu0:8188", "http://gpu1:8188"])
+        data = dispatcher.call(wf)
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        use_queue: bool = True,
+        affinity: int = 1,
+        failover: int = 2,
+        queue_timeout: float = 2.0,
+    ):
+        if len(urls) == 0:
+            raise ValueError("no backends")
+        self.backends = [Backend(url) for url in urls]
+        self.use_queue = use_queue
+        self.affinity = affinity
+        self.failover = failover
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+
+    def _refresh(self, backends: list[Backend]):
+        for b in backends:
+            try:
+                with request.urlopen(f"{b.url}/queue", timeout=self.queue_timeout) as res:
+                    b.queue_depth = _queue_depth(res.read())
+                b.failures = 0
+            except (error.URLError, ConnectionError, OSError, ValueError):
+                b.queue_depth = None
+                b.failures += 1
+
+    async def _arefresh(self, session, backends: list[Backend]):
+        import asyncio
+        import aiohttp
+
+        async def refresh(b: Backend):
+            try:
+                async with session.get(f"{b.url}/queue", timeout=aiohttp.ClientTimeout(total=self.queue_timeout)) as res:
+                    res.raise_for_status()
+                    b.queue_depth = _queue_depth(await res.read())
+                b.failures = 0
+            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, ValueError):
+                b.queue_depth = None
+                b.failures += 1
+
+        await asyncio.gather(*[refresh(b) for b in backends])
+
+    def _choose(self, models: set[str], exclude: set[Backend]) -> Backend:
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude] or list(self.backends)
+            # backends that keep failing go last
+            healthy = [b for b in candidates if b.failures == 0] or candidates
+            least = min(b.load() for b in healthy)
+            near = [b for b in healthy if b.load() <= least + self.affinity]
+            best = max(near, key=lambda b: (len(models & b.models), -b.load()))
+            best.inflight += 1
+            return best
+
+    def _done(self, backend: Backend, models: set[str], ok: bool):
+        with self._lock:
+            backend.inflight -= 1
+            if ok:
+                backend.failures = 0
+                backend.models |= models
+            else:
+                backend.failures += 1
+
+    def _prompt(self, wf: "Workflow | dict", prune: bool) -> tuple[dict, "Workflow | None"]:
+        if isinstance(wf, dict):
+            return wf, None
+        wf.check()
+        return wf.to_dict(prune=prune), wf
+
+    def call(
+        self,
+        wf: "Workflow | dict",
+        timeout: float = 60.0,
+        retries: int = 0,
+        cache: ResultCache | None = None,
+        prune: bool = False,
+    ) -> dict:
+        """submits a Workflow (or an API-format prompt) to the chosen backend and waits for its history"""
+
+        prompt, workflow = self._prompt(wf, prune)
+        models = model_keys(prompt)
+        hooks = workflow.hooks if workflow is not None else ()
+        if self.use_queue:
+            self._refresh(self.backends)
+
+        tried: set[Backend] = set()
+        while True:
+            backend = self._choose(models, tried)
+            tried.add(backend)
+            metrics = CallMetrics()
+            if workflow is not None:
+                workflow.last_metrics = metrics
+            try:
+                data = call_prompt(prompt, backend.url, timeout, retries, cache, hooks, metrics)
+            except (error.URLError, ConnectionError) as e:
+                self._done(backend, models, False)
+                if isinstance(e, error.HTTPError) and e.code < 500:
+                    raise
+                if len(tried) > self.failover or len(tried) == len(self.backends):
+                    raise
+                continue
+            except BaseException:
+                self._done(backend, models, False)
+                raise
+            self._done(backend, models, True)
+            return data
+
+    async def acall(
+        self,
+        wf: "Workflow | dict",
+        timeout: float = 60.0,
+        retries: int = 0,
+        cache: ResultCache | None = None,
+        prune: bool = False,
+    ) -> dict:
+        """async version of `call`"""
+
+        import aiohttp
+
+        prompt, workflow = self._prompt(wf, prune)
+        models = model_keys(prompt)
+        hooks = workflow.hooks if workflow is not None else ()
+        if self.use_queue:
+            async with aiohttp.ClientSession() as session:
+                await self._arefresh(session, self.backends)
+
+        tried: set[Backend] = set()
+        while True:
+            backend = self._choose(models, tried)
+            tried.add(backend)
+            metrics = CallMetrics()
+            if workflow is not None:
+                workflow.last_metrics = metrics
+            try:
+                data = await acall_prompt(prompt, backend.url, timeout, retries, cache, hooks, metrics)
+            except (aiohttp.ClientError, ConnectionError) as e:
+                self._done(backend, models, False)
+                if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+                    raise
+                if len(tried) > self.failover or len(tried) == len(self.backends):
+                    raise
+                continue
+            except BaseException:
+                self._done(backend, models, False)
+                raise
+            self._done(backend, models, True)
+            return data
+
+
+#
+# Pipeline
+#
+
+
+@dataclass
+class PipelineResult:
+    """a finished workflow of `apipeline`"""
+
+    index: int
+    """position of the workflow in the input"""
+
+    workflow: "Workflow | dict"
+
+    history: dict | None
+    """the history of the prompt, None if it failed"""
+
+    error: BaseException | None
+
+    metrics: CallMetrics
+
+
+async def _aiter_workflows(workflows) -> AsyncIterator:
+    if hasattr(workflows, "__aiter__"):
+        async for wf in workflows:
+            yield wf
+    else:
+        for wf in workflows:
+            yield wf
+
+
+async def apipeline(
+    workflows: "AsyncIterable[Workflow | dict] | Iterable[Workflow | dict]",
+    url: str = "http://127.0.0.1:8188",
+    max_queue: int = 4,
+    max_pending: int = 16,
+    timeout: float = 60.0,
+    retries: int = 0,
+    cache: ResultCache | None = None,
+    prune: bool = False,
+    queue_interval: float = 0.5,
+    return_exceptions: bool = False,
+) -> AsyncIterator[PipelineResult]:
+    """
+    submits workflows as the server keeps up with them, and yields results in completion order
+
+    a workflow is taken from `workflows` only while the server's queue (running + pending
+    prompts, including other clients') is shorter than `max_queue`, so a fast producer is
+    slowed down to the server's pace instead of flooding its queue. the queue is checked
+    again every `queue_interval` seconds while it is full. at most `max_pending` workflows
+    are in flight or waiting to be yielded, which bounds memory when the consumer is slow.
+    workflows are taken by a separate task, so the producer may wait for results of earlier
+    workflows.
+
+    a failed workflow raises its error, after the others have been cancelled, unless
+    `return_exceptions` is True, in which case it is yielded with `error` set. leaving the
+    loop early (or cancelling the consuming task) cancels the prompts still in flight,
+    removing them from the server's queue or interrupting them.
+
+    after a plain `break` that happens only once the event loop closes the dropped
+    generator, so close it explicitly to be sure the prompts are gone when the loop is left:
+
+        async with contextlib.aclosing(apipeline(generate_workflows(), max_queue=2)) as results:
+            async for result in results:
+                print(result.index, result.metrics.execution_time)
+    """
+
+    import asyncio
+    import aiohttp
+
+    if max_queue < 1 or max_pending < 1:
+        raise ValueError("max_queue and max_pending must be positive")
+
+    backend = Backend(url)
+    # results, then None when the source is exhausted (or the error it raised)
+    results: asyncio.Queue[PipelineResult | BaseException | None] = asyncio.Queue()
+    tasks: set[asyncio.Task] = set()
+    source = _aiter_workflows(workflows)
+    # set when a workflow finishes or a result is taken, i.e. when there may be room again
+    changed = asyncio.Event()
+    pending = 0  # workflows in flight or waiting to be yielded
+
+    async def run(session, index: int, wf: "Workflow | dict"):
+        # backend.inflight is counted on admission, before the task starts
+        metrics = CallMetrics()
+        try:
+            if isinstance(wf, dict):
+                prompt, hooks = wf, ()
+            else:
+                wf.check()
+                wf.last_metrics = metrics
+                prompt, hooks = wf.to_dict(prune=prune), wf.hooks
+            history = await _acall_prompt(session, prompt, backend.url, timeout, retries, cache, hooks, metrics, True)
+            results.put_nowait(PipelineResult(index, wf, history, None, metrics))
+        except Exception as e:
+            results.put_nowait(PipelineResult(index, wf, None, e, metrics))
+        finally:
+            backend.inflight -= 1
+            changed.set()
+
+    async def queue_full(session) -> bool:
+        if backend.inflight >= max_queue:
+            # no need to ask the server
+            return True
+        try:
+            async with session.get(f"{backend.url}/queue") as res:
+                res.raise_for_status()
+                backend.queue_depth = _queue_depth(await res.read())
+        except (aiohttp.ClientError, ConnectionError, ValueError):
+            # fall back to our own prompts
+            backend.queue_depth = None
+        return backend.load() >= max_queue
+
+    async def wait_changed(timeout: float | None):
+        # not wait_for(), which can swallow a cancellation arriving as the event is set
+        waiter = asyncio.ensure_future(changed.wait())
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        finally:
+            waiter.cancel()
+
+    closing = False
+
+    async def feed(session):
+        # runs apart from the consumer, so that a producer waiting for results
+        # (or for anything else) does not keep finished results from being yielded
+        nonlocal pending
+        index = 0
+        try:
+            while True:
+                changed.clear()
+                if pending >= max_pending:
+                    await wait_changed(None)
+                    continue
+                if await queue_full(session):
+                    # look at the server's queue again after a while
+                    await wait_changed(queue_interval)
+                    continue
+                try:
+                    wf = await source.__anext__()
+                except StopAsyncIteration:
+                    break
+                if closing:
+                    return
+                pending += 1
+                backend.inflight += 1
+                task = asyncio.ensure_future(run(session, index, wf))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+        except Exception as e:
+            results.put_nowait(e)
+        else:
+            results.put_nowait(None)
+
+    async with aiohttp.ClientSession() as session:
+        feeder = asyncio.ensure_future(feed(session))
+        try:
+            exhausted = False
+            while not exhausted or pending != 0:
+                item = await results.get()
+                if item is None:
+                    exhausted = True
+                    continue
+                if isinstance(item, BaseException):
+                    raise item
+                pending -= 1
+                changed.set()
+
+                if item.error is not None and not return_exceptions:
+                    raise item.error
+                yield item
+        finally:
+            closing = True
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+            for task in tasks:
+                task.cancel()
+            # each prompt is cancelled on the server before its task finishes
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
 class Workflow:
     def __init__(self):
         self._nodes: list[Node] = []
         self._links: list[Link] = []
         self._id = 0
 
+        self._ids: dict[_Node, int] = {}
+        """node -> id (nodes are hashed by identity)"""
+
+        self.hooks: list[CallHook] = []
+        """hooks called by call / acall"""
+
+        self.last_metrics: CallMetrics | None = None
+        """metrics of the last call / acall"""
+
     def add(self, node: _Node) -> _Node:
         self._nodes.append(Node(node, self._id))
+        self._ids.setdefault(node, self._id)
         self._id += 1
         return node
 
-    def node_id(self, node: _Node) -> int:
+    def _reindex(self):
+        self._ids = {}
         for n in self._nodes:
-            if n.node is node:
-                return n.id
-        raise ValueError(f"Node {node} not found in workflow")
+            self._ids.setdefault(n.node, n.id)
+
+    def node_id(self, node: _Node) -> int:
+        id = self._ids.get(node)
+        if id is None:
+            raise ValueError(f"Node {node} not found in workflow")
+        return id
 
     def find_link_with_dst(self, dst_node: Node, dst_index: int) -> Link:
         for link in self._links:
@@ -228,6 +1697,10 @@ class Workflow:
 
         return link
 
+    def canonical_hash(self) -> str:
+        """returns `workflow_hash(self.to_dict())`"""
+        return workflow_hash(self.to_dict())
+
     def check(self):
         errors = []
         # check inputs
@@ -238,20 +1711,207 @@ class Workflow:
                 if val is _WILL_BE_LINKED:
                     errors.append(f"{n.node.name}:{i}:{inp.name} ({inp.type.__name__}) is not linked")
         # check links
+        nodes = {n.id: n.node for n in self._nodes}
         for l in self._links:
-            pass
+            src = nodes.get(l.src)
+            dst = nodes.get(l.dst)
+            if src is None:
+                errors.append(f"link {l.src}:{l.src_index} -> {l.dst}:{l.dst_index}: source node {l.src} does not exist")
+            elif not (0 <= l.src_index < src.output_length):
+                errors.append(f"link {l.src}:{l.src_index} -> {l.dst}:{l.dst_index}: {src.name} has no output {l.src_index}")
+            if dst is None:
+                errors.append(f"link {l.src}:{l.src_index} -> {l.dst}:{l.dst_index}: destination node {l.dst} does not exist")
+            elif not (0 <= l.dst_index < dst.input_length):
+                errors.append(f"link {l.src}:{l.src_index} -> {l.dst}:{l.dst_index}: {dst.name} has no input {l.dst_index}")
+        links_by_dst = self._links_by_dst()
+        for n in self._nodes:
+            for inp in n.node._inputs:
+                if inp.value is _LINKED and (n.id, inp.index) not in links_by_dst:
+                    errors.append(f"{n.node.name}:{inp.index}:{inp.name} ({inp.type.__name__}) has no link")
+        # check cycles
+        if len(errors) == 0:
+            try:
+                self._topological_order()
+            except ValueError as e:
+                errors.append(str(e))
 
         if len(errors) != 0:
             msg = "\n  ".join(errors)
             raise ValueError(f"Workflow check failed: \n  {msg}")
 
-    def to_dict(self) -> dict:
+    def _links_by_dst(self) -> dict[tuple[int, int], Link]:
+        # the first link wins, as in find_link_with_dst
+        result = {}
+        for link in self._links:
+            result.setdefault((link.dst, link.dst_index), link)
+        return result
+
+    def _topological_order(self) -> list[Node]:
+        """returns nodes sorted so that every node comes after its sources"""
+
+        indegree = {n.id: 0 for n in self._nodes}
+        succs: dict[int, list[int]] = {n.id: [] for n in self._nodes}
+        for link in self._links_by_dst().values():
+            if link.src in succs and link.dst in indegree:
+                succs[link.src].append(link.dst)
+                indegree[link.dst] += 1
+
+        nodes = {n.id: n for n in self._nodes}
+        # FIFO keeps the insertion order among independent nodes
+        ready = deque(n.id for n in self._nodes if indegree[n.id] == 0)
+        result = []
+        while len(ready) != 0:
+            id = ready.popleft()
+            result.append(nodes[id])
+            for dst in succs[id]:
+                indegree[dst] -= 1
+                if indegree[dst] == 0:
+                    ready.append(dst)
+
+        if len(result) != len(self._nodes):
+            cycle = self._find_cycle({id for id, d in indegree.items() if d != 0})
+            path = " -> ".join(f"{nodes[id].node.name} ({id})" for id in cycle)
+            raise ValueError(f"cycle detected: {path}")
+
+        return result
+
+    def _find_cycle(self, ids: set[int]) -> list[int]:
+        """returns a cycle [a, b, ..., a] among `ids`, every one of which has a source in `ids`"""
+
+        src_of: dict[int, int] = {}
+        for link in self._links_by_dst().values():
+            if link.dst in ids and link.src in ids:
+                src_of.setdefault(link.dst, link.src)
+
+        # walking sources from any node in `ids` must eventually repeat
+        id = next(iter(ids))
+        path: list[int] = []
+        index: dict[int, int] = {}
+        while id not in index:
+            index[id] = len(path)
+            path.append(id)
+            id = src_of[id]
+
+        cycle = path[index[id] :] + [id]
+        cycle.reverse()
+        return cycle
+
+    def reachable(self) -> set[int]:
+        """
+        returns ids of the nodes whose results reach an output node (OUTPUT_NODE)
+
+        raises ValueError if the workflow has nodes but no output node; pruning it
+        would silently leave nothing to execute.
+        """
+
+        srcs: dict[int, list[int]] = {}
+        for link in self._links_by_dst().values():
+            srcs.setdefault(link.dst, []).append(link.src)
+
+        result = {n.id for n in self._nodes if n.node.OUTPUT_NODE}
+        if len(result) == 0 and len(self._nodes) != 0:
+            raise ValueError("no output nodes")
+        stack = list(result)
+        while len(stack) != 0:
+            id = stack.pop()
+            for src in srcs.get(id, ()):
+                if src not in result:
+                    result.add(src)
+                    stack.append(src)
+
+        return result
+
+    def prune(self) -> list[int]:
+        """
+        removes nodes that do not reach any output node
+
+        returns ids of the removed nodes. raises ValueError, leaving the workflow
+        unchanged, if there is no output node.
+        """
+
+        keep = self.reachable()
+        removed = [n.id for n in self._nodes if n.id not in keep]
+        if len(removed) == 0:
+            return removed
+
+        self._nodes = [n for n in self._nodes if n.id in keep]
+        self._reindex()
+        self._links = [l for l in self._links if l.src in keep and l.dst in keep]
+        return removed
+
+    def optimize(self) -> dict[int, int]:
+        """
+        merges duplicated nodes (common subexpression elimination)
+
+        nodes with the same class, the same literal inputs and the same sources are
+        merged into the first one, and links from the merged nodes are redirected.
+        output nodes and nodes without outputs (sinks such as SaveImage) are never merged.
+
+        returns {merged node id: surviving node id}.
+        """
+
+        links_by_dst = self._links_by_dst()
+        replaced: dict[int, int] = {}
+        seen: dict[tuple, int] = {}
+
+        for n in self._topological_order():
+            node = n.node
+            if node.OUTPUT_NODE or node.output_length == 0:
+                continue
+
+            key: list = [node.name]
+            for inp in node._inputs:
+                val = inp.value
+                if val is _LINKED:
+                    link = links_by_dst[(n.id, inp.index)]
+                    key.append((0, replaced.get(link.src, link.src), link.src_index))
+                elif val is _NOT_GIVEN:
+                    key.append((1,))
+                elif val is _WILL_BE_LINKED:
+                    # unconnected; never the same as another node
+                    key.append((2, n.id))
+                else:
+                    key.append((3, json.dumps(val, sort_keys=True, default=repr)))
+
+            key_t = tuple(key)
+            if key_t in seen:
+                replaced[n.id] = seen[key_t]
+            else:
+                seen[key_t] = n.id
+
+        if len(replaced) == 0:
+            return replaced
+
+        self._nodes = [n for n in self._nodes if n.id not in replaced]
+        self._reindex()
+        self._links = [
+            Link(replaced.get(l.src, l.src), l.src_index, l.dst, l.dst_index)
+            for l in self._links
+            if l.dst not in replaced
+        ]
+
+        return replaced
+
+    def to_dict(self, prune: bool = False, topological: bool = False) -> dict:
+        """
+        returns the workflow in API format
+
+        if `prune` is True, nodes that do not reach any output node are omitted.
+        if `topological` is True, nodes are emitted in topological order with compact ids
+        that are stable for identical graphs (see `topological_prompt`).
+        """
+
         result = {}
+        keep = self.reachable() if prune else None
+        links_by_dst = self._links_by_dst()
 
         for n in self._nodes:
             node = n.node
             id = n.id
 
+            if keep is not None and id not in keep:
+                continue
+
             ndict = {
                 "class_type": node.name,
                 "_meta": {"title": node.name},
@@ -261,7 +1921,9 @@ class Workflow:
             for i in range(node.input_length):
                 inp = node.input(i)
                 if inp.value is _LINKED:
-                    link = self.find_link_with_dst(n, inp.index)
+                    link = links_by_dst.get((id, inp.index))
+                    if link is None:
+                        link = self.find_link_with_dst(n, inp.index)  # raises
                     src, src_index = link.src, link.src_index
                     ndict["inputs"][inp.name] = [
                         str(src),
@@ -275,69 +1937,177 @@ class Workflow:
 
             result[str(id)] = ndict
 
+        if topological:
+            result = topological_prompt(result)
+
         return result
 
+    def to_ui_dict(self, version: Literal["0.4", "1.0"] = "0.4") -> dict:
+        """
+        returns the workflow in UI format (`schemas/workflow_v0.4.json` / `workflow_v1.0.json`)
+
+        nodes are placed by a layered layout: each node goes one column right of its
+        furthest source, so the graph reads from left to right.
+        """
+
+        order = self._topological_order()
+        links_by_dst = self._links_by_dst()
+
+        # column = longest path from a source node, in topological order
+        column: dict[int, int] = {n.id: 0 for n in order}
+        succs: dict[int, list[Link]] = {n.id: [] for n in self._nodes}
+        for link in links_by_dst.values():
+            if link.src in succs:
+                succs[link.src].append(link)
+        for n in order:
+            for link in succs[n.id]:
+                if column[link.dst] <= column[n.id]:
+                    column[link.dst] = column[n.id] + 1
+
+        # link ids in the order of destinations
+        link_ids: dict[tuple[int, int], int] = {}
+        outgoing: dict[tuple[int, int], list[int]] = {}
+        ui_links = []
+        for link in links_by_dst.values():
+            link_id = len(ui_links) + 1
+            link_ids[(link.dst, link.dst_index)] = link_id
+            outgoing.setdefault((link.src, link.src_index), []).append(link_id)
+            ui_links.append((link_id, link.src, link.src_index, link.dst, link.dst_index))
+
+        nodes = {n.id: n.node for n in self._nodes}
+        y: dict[int, float] = {}
+        ui_nodes = []
+        for i, n in enumerate(order):
+            node = n.node
+            inputs = []
+            widgets_values = []
+            for inp in node._inputs:
+                link_id = link_ids.get((n.id, inp.index))
+                widget = _is_widget(inp.type)
+                if widget:
+                    # unset optional inputs are written as null, which load_ui_workflow reads
+                    # back as unset; linked inputs too, as the link takes precedence
+                    unset = inp.value is _LINKED or inp.value is _NOT_GIVEN or inp.value is _WILL_BE_LINKED
+                    widgets_values.append(None if unset else inp.value)
+                    if inp.type is int and inp.name in _SEED_INPUTS:
+                        widgets_values.append("fixed")
+                if not widget or link_id is not None:
+                    slot = {"name": inp.name, "type": _slot_type(inp.type), "link": link_id}
+                    if widget:
+                        slot["widget"] = {"name": inp.name}
+                    inputs.append(slot)
+
+            outputs = [
+                {
+                    "name": out.name if out.name is not None else _slot_type(out.type),
+                    "type": _slot_type(out.type),
+                    "links": outgoing.get((n.id, out.index), []),
+                    "slot_index": out.index,
+                }
+                for out in node._outputs
+            ]
+
+            height = _UI_NODE_HEADER + _UI_SLOT_HEIGHT * max(len(inputs), len(outputs)) + _UI_WIDGET_HEIGHT * len(widgets_values)
+            col = column[n.id]
+            top = y.get(col, 0.0)
+            y[col] = top + height + _UI_NODE_GAP
+
+            ui_nodes.append(
+                {
+                    "id": n.id,
+                    "type": node.name,
+                    "pos": [col * (_UI_NODE_WIDTH + _UI_NODE_GAP), top],
+                    "size": [_UI_NODE_WIDTH, height],
+                    "flags": {},
+                    "order": i,
+                    "mode": 0,
+                    "inputs": inputs,
+                    "outputs": outputs,
+                    "properties": {"Node name for S&R": node.name},
+                    "widgets_values": widgets_values,
+                }
+            )
+
+        def link_type(src: int, src_index: int) -> str:
+            return _slot_type(nodes[src]._outputs[src_index].type)
+
+        last_node_id = max((n.id for n in self._nodes), default=0)
+        last_link_id = len(ui_links)
+
+        if version == "0.4":
+            return {
+                "last_node_id": last_node_id,
+                "last_link_id": last_link_id,
+                "nodes": ui_nodes,
+                "links": [[id, s, si, d, di, link_type(s, si)] for id, s, si, d, di in ui_links],
+                "groups": [],
+                "config": {},
+                "extra": {},
+                "version": 0.4,
+            }
+        if version == "1.0":
+            return {
+                "version": 1,
+                "config": {},
+                "state": {
+                    "lastGroupid": 0,
+                    "lastNodeId": last_node_id,
+                    "lastLinkId": last_link_id,
+                    "lastRerouteId": 0,
+                },
+                "groups": [],
+                "nodes": ui_nodes,
+                "links": [
+                    {"id": id, "origin_id": s, "origin_slot": si, "target_id": d, "target_slot": di, "type": link_type(s, si)}
+                    for id, s, si, d, di in ui_links
+                ],
+                "extra": {},
+            }
+        raise ValueError(f"unsupported version: {version}")
+
     def call(
         self,
         url: str = "http://127.0.0.1:8188",
         timeout: float = 60.0,
+        retries: int = 0,
+        cache: ResultCache | None = None,
+        prune: bool = False,
+        cancel: bool = True,
     ):
         self.check()
-        prompt_data = json.dumps({"prompt": self.to_dict()}, ensure_ascii=False)
-        req = request.Request(f"{url}/prompt", data=prompt_data.encode("utf-8"))
-        res = request.urlopen(req)
-        data = json.loads(res.read())
-
-        prompt_id = data["prompt_id"]
-
-        t0 = time.time()
-        while time.time() - t0 < timeout:
-            with request.urlopen(f"{url}/history/{prompt_id}") as res:
-                data: dict = json.loads(res.read()).get(prompt_id, {})
-                if "status" not in data:
-                    time.sleep(0.01)
-                    continue
-                completed = data["status"].get("completed", False)
-                if not completed:
-                    time.sleep(0.01)
-                    continue
-                return data
-
-        raise TimeoutError(f"timeout {timeout} sec")
+        metrics = CallMetrics()
+        self.last_metrics = metrics
+        return call_prompt(self.to_dict(prune=prune), url, timeout, retries, cache, self.hooks, metrics, cancel)
 
     async def acall(
         self,
         url: str = "http://127.0.0.1:8188",
         timeout: float = 60.0,
+        retries: int = 0,
+        cache: ResultCache | None = None,
+        prune: bool = False,
+        cancel: bool = True,
     ):
         self.check()
-        data = json.dumps({"prompt": self.to_dict()}, ensure_ascii=False)
-
-        import asyncio
-        import aiohttp
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=data.encode("utf-8")) as res:
-                data = await res.json()
+        metrics = CallMetrics()
+        self.last_metrics = metrics
+        return await acall_prompt(self.to_dict(prune=prune), url, timeout, retries, cache, self.hooks, metrics, cancel)
 
-        prompt_id = data["prompt_id"]
-
-        t0 = time.time()
-        while time.time() - t0 < timeout:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{url}/history/{prompt_id}") as res:
-                    data = await res.json()
-                    data = data.get(prompt_id, {})
-                    if "status" not in data:
-                        await asyncio.sleep(0.01)
-                        continue
-                    completed = data["status"].get("completed", False)
-                    if not completed:
-                        await asyncio.sleep(0.01)
-                        continue
-                    return data
+    async def acall_download(
+        self,
+        dest: OutputDest,
+        url: str = "http://127.0.0.1:8188",
+        timeout: float = 60.0,
+        max_concurrency: int = 4,
+        prune: bool = False,
+    ) -> tuple[dict, list[tuple[OutputFile, Any]]]:
+        """submits the workflow and streams its output files to `dest` (see `acall_prompt_download`)"""
 
-        raise TimeoutError(f"timeout {timeout} sec")
+        self.check()
+        metrics = CallMetrics()
+        self.last_metrics = metrics
+        prompt = self.to_dict(prune=prune)
+        return await acall_prompt_download(prompt, dest, url, timeout, max_concurrency, self.hooks, metrics)
 
     def __enter__(self):
         # hook _Node.(_add_input|_add_output)
@@ -359,7 +2129,7 @@ class Workflow:
         dst = ComfyInput(inp.node, inp.index, inp.name, inp.type, _WILL_BE_LINKED)
         this._inputs.append(inp)
 
-        if not any(this is n.node for n in self._nodes):
+        if this not in self._ids:
             self.add(this)
 
         self.link(src, dst)
@@ -368,11 +2138,768 @@ class Workflow:
     def _add_output(self, this: _Node, out: ComfyOutput):
         # _Node._add_output から呼ばれる
         this._outputs.append(out)
-        if not any(this is n.node for n in self._nodes):
+        if this not in self._ids:
             self.add(this)
         return out
 
 
+#
+# Component
+#
+
+
+class _Recording(Workflow):
+    def __exit__(self, exc_type, exc_value, traceback):
+        # inputs left unlinked are the parameters of the component
+        _Node._context = None
+
+
+@dataclass(frozen=True)
+class ComponentInstance:
+    nodes: list[_Node]
+    """stamped nodes, in the order of the template"""
+
+    outputs: dict[str, ComfyOutput]
+
+    def output(self, name: str) -> ComfyOutput[Any]:
+        return self.outputs[name]
+
+    __truediv__ = output  # instance / "name" == instance.output("name")
+
+
+class Component:
+    """
+    a subgraph recorded once and stamped into workflows many times
+
+    stamping copies the recorded nodes and links with bulk id remapping, without
+    running the constructors of generated classes or `Workflow.link` for inner links.
+
+        with Component.recording() as block:
+            upscale = LatentUpscaleBy(upscale_method="nearest-exact", scale_by=1.5)
+            sampler = KSampler(upscale.output(0), seed=0, ...)
+
+        hires = Component(
+            block,
+            inputs={"samples": upscale.input("samples"), "model": sampler.input("model"), ...},
+            outputs={"latent": sampler.output(0)},
+        )
+
+        for latent in latents:
+            out = hires.stamp(wf, {"samples": latent, "model": model, ...}).output("latent")
+    """
+
+    def __init__(
+        self,
+        template: Workflow,
+        inputs: dict[str, ComfyInput | list[ComfyInput]] | None = None,
+        outputs: dict[str, ComfyOutput] | None = None,
+    ):
+        index = {n.id: i for i, n in enumerate(template._nodes)}
+        node_index = {n.node: i for i, n in reversed(list(enumerate(template._nodes)))}
+
+        self._nodes = [
+            (
+                type(n.node),
+                n.node.name,
+                [(inp.name, inp.type, inp.value) for inp in n.node._inputs],
+                [(out.name, out.type) for out in n.node._outputs],
+            )
+            for n in template._nodes
+        ]
+
+        self._links = [
+            (index[l.src], l.src_index, index[l.dst], l.dst_index)
+            for l in template._links_by_dst().values()
+            if l.src in index and l.dst in index
+        ]
+
+        self._inputs: dict[str, list[tuple[int, int]]] = {}
+        for name, inps in (inputs or {}).items():
+            if isinstance(inps, ComfyInput):
+                inps = [inps]
+            self._inputs[name] = [(node_index[inp.node], inp.index) for inp in inps]
+
+        self._outputs: dict[str, tuple[int, int]] = {
+            name: (node_index[out.node], out.index) for name, out in (outputs or {}).items()
+        }
+
+    @staticmethod
+    def recording() -> Workflow:
+        """returns a workflow context for recording a template, which allows unlinked inputs"""
+        return _Recording()
+
+    def stamp(self, wf: Workflow, inputs: dict[str, Any] | None = None) -> ComponentInstance:
+        """
+        adds a copy of the subgraph to `wf`
+
+        `inputs` maps the component inputs to `ComfyOutput`s in `wf` (linked) or literal values.
+        """
+
+        base = wf._id
+
+        # resolve component inputs first so that each input is created only once
+        overrides: dict[tuple[int, int], Any] = {}
+        links = [Link(base + s, si, base + d, di) for s, si, d, di in self._links]
+        for name, value in (inputs or {}).items():
+            targets = self._inputs.get(name)
+            if targets is None:
+                raise ValueError(f"unknown component input: {name}")
+            if isinstance(value, ComfyOutput):
+                src_id = wf.node_id(value.node)
+                for i, index in targets:
+                    typ = self._nodes[i][2][index][1]
+                    if value.type != typ:
+                        raise ValueError(f"type mismatch: {value.type} != {typ}")
+                    overrides[(i, index)] = _LINKED
+                    links.append(Link(src_id, value.index, base + i, index))
+            else:
+                for target in targets:
+                    overrides[target] = value
+
+        nodes: list[_Node] = []
+        for i, (klass, name, ins, outs) in enumerate(self._nodes):
+            node = klass.__new__(klass)
+            node.name = name
+            if len(overrides) == 0:
+                node._inputs = [ComfyInput(node, k, n, t, v) for k, (n, t, v) in enumerate(ins)]
+            else:
+                node._inputs = [ComfyInput(node, k, n, t, overrides.get((i, k), v)) for k, (n, t, v) in enumerate(ins)]
+            node._outputs = [ComfyOutput(node, k, n, t) for k, (n, t) in enumerate(outs)]
+            nodes.append(node)
+
+        wf._nodes.extend([Node(node, base + i) for i, node in enumerate(nodes)])
+        for i, node in enumerate(nodes):
+            wf._ids[node] = base + i
+        wf._id += len(nodes)
+        wf._links.extend(links)
+
+        outputs = {name: nodes[i]._outputs[index] for name, (i, index) in self._outputs.items()}
+        return ComponentInstance(nodes, outputs)
+
+    def stamp_many(self, wf: Workflow, inputs: list[dict[str, Any]]) -> list[ComponentInstance]:
+        """stamps one copy per element of `inputs`"""
+        return [self.stamp(wf, x) for x in inputs]
+
+
+#
+# Bulk Construction
+#
+
+
+def bulk_prompt(
+    class_types: Sequence[str],
+    inputs: Sequence[dict[str, Any]] | None = None,
+    src: Sequence[int] = (),
+    src_index: Sequence[int] = (),
+    dst: Sequence[int] = (),
+    dst_index: Sequence[int | str] = (),
+) -> dict:
+    """
+    builds an API-format prompt from columnar arrays, without node objects
+
+    - class_types[i]: node name of node i
+    - inputs[i]: literal inputs of node i (omitted inputs take their defaults)
+    - src[k], src_index[k], dst[k], dst_index[k]: link k from output src_index[k] of node src[k]
+      to input dst_index[k] (index or name) of node dst[k]
+
+    everything is validated against the stub's type information in one pass, with the
+    same checks as `Workflow.check`. node i gets id `str(i)`, and the result is the same
+    as `Workflow.to_dict` of the equivalent workflow.
+    """
+
+    n = len(class_types)
+    if inputs is None:
+        inputs = [{}] * n
+    if len(inputs) != n:
+        raise ValueError(f"length mismatch: {n} class_types, {len(inputs)} inputs")
+    if not (len(src) == len(src_index) == len(dst) == len(dst_index)):
+        raise ValueError("length mismatch: src, src_index, dst and dst_index")
+
+    errors = []
+
+    specs: list[_NodeSpec] = []
+    for class_type in class_types:
+        try:
+            specs.append(_node_spec(class_type))
+        except ValueError as e:
+            raise ValueError(f"Workflow check failed: \n  {e}") from None
+
+    # links
+
+    linked: dict[tuple[int, int], tuple[int, int]] = {}
+    succs: list[list[int]] = [[] for _ in range(n)]
+    indegree = [0] * n
+    for s, si, d, di in zip(src, src_index, dst, dst_index):
+        s, si, d = int(s), int(si), int(d)
+        desc = f"link {s}:{si} -> {d}:{di}"
+        if not (0 <= s < n):
+            errors.append(f"{desc}: source node {s} does not exist")
+            continue
+        if not (0 <= d < n):
+            errors.append(f"{desc}: destination node {d} does not exist")
+            continue
+
+        src_spec, dst_spec = specs[s], specs[d]
+        if not (0 <= si < len(src_spec.output_types)):
+            errors.append(f"{desc}: {src_spec.class_type} has no output {si}")
+            continue
+        if isinstance(di, str):
+            index = dst_spec.input_index.get(di)
+            if index is None:
+                errors.append(f"{desc}: {dst_spec.class_type} has no input {di}")
+                continue
+            di = index
+        else:
+            di = int(di)
+            if not (0 <= di < len(dst_spec.inputs)):
+                errors.append(f"{desc}: {dst_spec.class_type} has no input {di}")
+                continue
+
+        src_type, dst_type = src_spec.output_types[si], dst_spec.inputs[di].type
+        if src_type != dst_type and src_type is not Any and dst_type is not Any:
+            errors.append(f"{desc}: type mismatch: {src_type} != {dst_type}")
+            continue
+        if (d, di) in linked:
+            errors.append(f"{desc}: {dst_spec.class_type}:{di}:{dst_spec.inputs[di].name} is linked more than once")
+            continue
+
+        linked[(d, di)] = (s, si)
+        succs[s].append(d)
+        indegree[d] += 1
+
+    # nodes
+
+    result = {}
+    for i, spec in enumerate(specs):
+        literals = inputs[i]
+        for name in literals:
+            if name not in spec.input_index:
+                errors.append(f"{spec.class_type} ({i}): unknown input {name}")
+
+        node_inputs = {}
+        for inp in spec.inputs:
+            link = linked.get((i, inp.index))
+            if link is not None:
+                if inp.name in literals:
+                    errors.append(f"{spec.class_type} ({i}):{inp.index}:{inp.name} is both linked and given a value")
+                node_inputs[inp.name] = [str(link[0]), link[1]]
+            elif inp.name in literals:
+                value = literals[inp.name]
+                if not _check_literal(inp.type, value):
+                    errors.append(f"{spec.class_type} ({i}):{inp.index}:{inp.name} ({inp.type.__name__}): invalid value {value!r}")
+                node_inputs[inp.name] = value
+            elif inp.value is _WILL_BE_LINKED:
+                errors.append(f"{spec.class_type} ({i}):{inp.index}:{inp.name} ({inp.type.__name__}) is not linked")
+            elif inp.value is _NOT_GIVEN:
+                continue
+            else:
+                node_inputs[inp.name] = inp.value
+
+        result[str(i)] = {
+            "class_type": spec.class_type,
+            "_meta": {"title": spec.class_type},
+            "inputs": node_inputs,
+        }
+
+    # cycles
+
+    if len(errors) == 0:
+        ready = [i for i in range(n) if indegree[i] == 0]
+        visited = 0
+        while len(ready) != 0:
+            i = ready.pop()
+            visited += 1
+            for d in succs[i]:
+                indegree[d] -= 1
+                if indegree[d] == 0:
+                    ready.append(d)
+        if visited != n:
+            rest = [f"{specs[i].class_type} ({i})" for i in range(n) if indegree[i] != 0]
+            errors.append(f"cycle detected among: {', '.join(rest)}")
+
+    if len(errors) != 0:
+        msg = "\n  ".join(errors)
+        raise ValueError(f"Workflow check failed: \n  {msg}")
+
+    return result
+
+
+#
+# UI Format
+#
+
+_UI_NODE_WIDTH = 320
+_UI_NODE_GAP = 40
+_UI_NODE_HEADER = 46
+_UI_SLOT_HEIGHT = 20
+_UI_WIDGET_HEIGHT = 24
+
+_SEED_INPUTS = ("seed", "noise_seed")
+"""INT inputs followed by a `control_after_generate` widget in the UI"""
+
+
+def _slot_type(typ) -> str:
+    """returns the ComfyUI type name of a stub type"""
+
+    if typ is Any:
+        return "*"
+    if get_origin(typ) is Literal:
+        return "COMBO"
+    names = {int: "INT", float: "FLOAT", str: "STRING", bool: "BOOLEAN"}
+    return names.get(typ, getattr(typ, "__name__", str(typ)))
+
+
+#
+# Loading
+#
+
+
+def _types_compatible(src_type, dst_type) -> bool:
+    return src_type == dst_type or src_type is Any or dst_type is Any
+
+
+def _assemble(nodes: list[tuple[int, _Node]], links: list[Link]) -> Workflow:
+    # builds the workflow indexes directly, as Component.stamp does
+    wf = Workflow()
+    for id, node in nodes:
+        wf._nodes.append(Node(node, id))
+        wf._ids[node] = id
+    wf._links = links
+    wf._id = max((id for id, _ in nodes), default=-1) + 1
+    return wf
+
+
+def load_api_prompt(prompt: dict, check: bool = True) -> Workflow:
+    """
+    loads an API-format prompt (`schemas/workflow_api_unofficial.json`) into a Workflow
+
+    numeric node ids are kept; other ids (e.g. "12:5" of group nodes) are renumbered after them.
+    the structure is always validated. if `check` is True, literal values are checked against
+    the input types and `Workflow.check` is run on the result.
+    """
+
+    errors = []
+
+    if not isinstance(prompt, dict):
+        raise ValueError("Workflow load failed: \n  prompt must be an object")
+
+    # node ids and specs
+
+    ids: dict[str, int] = {}
+    rest = []
+    for nid in prompt:
+        if isinstance(nid, str) and nid.isdigit() and str(int(nid)) == nid:
+            ids[nid] = int(nid)
+        else:
+            rest.append(nid)
+    next_id = max(ids.values(), default=-1) + 1
+    for nid in rest:
+        ids[nid] = next_id
+        next_id += 1
+
+    specs: dict[str, _NodeSpec] = {}
+    for nid, node in prompt.items():
+        if not isinstance(node, dict):
+            errors.append(f"node {nid}: node must be an object")
+            continue
+        class_type = node.get("class_type")
+        if not isinstance(class_type, str):
+            errors.append(f"node {nid}: class_type must be a string")
+            continue
+        if not isinstance(node.get("inputs"), dict):
+            errors.append(f"node {nid}: inputs must be an object")
+            continue
+        meta = node.get("_meta")
+        if meta is not None and not isinstance(meta, dict):
+            errors.append(f"node {nid}: _meta must be an object")
+            continue
+        try:
+            specs[nid] = _node_spec(class_type)
+        except ValueError as e:
+            errors.append(f"node {nid}: {e}")
+
+    # nodes and links
+
+    nodes: list[tuple[int, _Node]] = []
+    links: list[Link] = []
+    for nid, spec in specs.items():
+        id = ids[nid]
+        values: dict[int, Any] = {}
+        for name, value in prompt[nid]["inputs"].items():
+            index = spec.input_index.get(name)
+            if index is None:
+                errors.append(f"{spec.class_type} ({nid}): unknown input {name}")
+                continue
+            inp = spec.inputs[index]
+
+            if isinstance(value, list):
+                if not _is_link(value):
+                    errors.append(f"{spec.class_type} ({nid}):{index}:{name}: invalid link {value!r}")
+                    continue
+                src_id, src_index = value
+                src_spec = specs.get(src_id)
+                if src_spec is None:
+                    if src_id not in prompt:
+                        errors.append(f"{spec.class_type} ({nid}):{index}:{name}: linked node {src_id} does not exist")
+                    continue
+                if not (0 <= src_index < len(src_spec.output_types)):
+                    errors.append(f"{spec.class_type} ({nid}):{index}:{name}: {src_spec.class_type} ({src_id}) has no output {src_index}")
+                    continue
+                src_type = src_spec.output_types[src_index]
+                if not _types_compatible(src_type, inp.type):
+                    errors.append(f"{spec.class_type} ({nid}):{index}:{name}: type mismatch: {src_type} != {inp.type}")
+                    continue
+                values[index] = _LINKED
+                links.append(Link(ids[src_id], src_index, id, index))
+            elif isinstance(value, (str, int, float, bool)):
+                if check and not _check_literal(inp.type, value):
+                    errors.append(f"{spec.class_type} ({nid}):{index}:{name} ({inp.type.__name__}): invalid value {value!r}")
+                values[index] = value
+            else:
+                errors.append(f"{spec.class_type} ({nid}):{index}:{name}: invalid value {value!r}")
+
+        nodes.append((id, _spec_node(spec, values)))
+
+    if len(errors) != 0:
+        msg = "\n  ".join(errors)
+        raise ValueError(f"Workflow load failed: \n  {msg}")
+
+    wf = _assemble(nodes, links)
+    if check:
+        wf.check()
+    return wf
+
+
+_UI_ONLY_NODES = ("Note", "MarkdownNote")
+"""frontend-only nodes without any connection"""
+
+_UI_MODE_NEVER = 2
+_UI_MODE_BYPASS = 4
+
+_CONTROL_VALUES = ("fixed", "increment", "decrement", "randomize")
+"""values of the `control_after_generate` widget following seed-like inputs"""
+
+
+def _widget_values(spec: _NodeSpec, widgets_values) -> dict[int, Any]:
+    """
+    maps `widgets_values` of a UI node onto the widget inputs of `spec`
+
+    optional inputs whose value is missing or None are mapped to _NOT_GIVEN (omitted).
+    """
+
+    widgets = [inp for inp in spec.inputs if _is_widget(inp.type)]
+
+    if isinstance(widgets_values, dict):
+        result = {inp.index: widgets_values[inp.name] for inp in widgets if inp.name in widgets_values}
+    else:
+        result = _widget_list_values(widgets, widgets_values)
+
+    for inp in widgets:
+        if inp.index in spec.optional and result.get(inp.index) is None:
+            result[inp.index] = _NOT_GIVEN
+    return result
+
+
+def _widget_list_values(widgets: list[ComfyInput], widgets_values) -> dict[int, Any]:
+    result = {}
+    values = list(widgets_values or [])
+    k = 0
+    for w, inp in enumerate(widgets):
+        if k >= len(values):
+            break
+        result[inp.index] = values[k]
+        k += 1
+        # skip the extra control widget, only when there are more values than widgets left
+        if (
+            inp.type is int
+            and k < len(values)
+            and values[k] in _CONTROL_VALUES
+            and len(values) - k > len(widgets) - w - 1
+        ):
+            k += 1
+    return result
+
+
+def load_ui_workflow(workflow: dict, check: bool = True) -> Workflow:
+    """
+    loads a UI-format workflow (`schemas/workflow_v1.0.json` / `workflow_v0.4.json`) into a Workflow
+
+    node ids are kept. widget values are mapped onto the inputs in order, links are resolved
+    through `Reroute`, bypassed and `PrimitiveNode` nodes, and muted nodes are dropped. as with
+    `load_api_prompt`, `check` enables literal checks and `Workflow.check`.
+    """
+
+    errors = []
+
+    if not isinstance(workflow, dict) or not isinstance(workflow.get("nodes"), list):
+        raise ValueError("Workflow load failed: \n  workflow must be an object with nodes")
+
+    # links: v1.0 uses objects, v0.4 uses [id, origin_id, origin_slot, target_id, target_slot, type]
+
+    ui_links: dict[Any, tuple[Any, int, Any, int]] = {}
+    for l in workflow.get("links") or []:
+        if isinstance(l, dict):
+            try:
+                ui_links[l["id"]] = (l["origin_id"], int(l["origin_slot"]), l["target_id"], int(l["target_slot"]))
+            except (KeyError, TypeError, ValueError):
+                errors.append(f"invalid link {l!r}")
+        elif isinstance(l, list) and len(l) == 6:
+            ui_links[l[0]] = (l[1], int(l[2]), l[3], int(l[4]))
+        else:
+            errors.append(f"invalid link {l!r}")
+
+    ui_nodes: dict[Any, dict] = {}
+    for ui_node in workflow["nodes"]:
+        if not isinstance(ui_node, dict) or "id" not in ui_node or not isinstance(ui_node.get("type"), str):
+            errors.append(f"invalid node {ui_node!r}")
+            continue
+        ui_nodes[ui_node["id"]] = ui_node
+
+    def source(link_id):
+        """returns (node id, output index) or ("value", literal) the link eventually comes from, or None"""
+
+        seen = set()
+        while link_id in ui_links and link_id not in seen:
+            seen.add(link_id)
+            origin_id, origin_slot, _, _ = ui_links[link_id]
+            origin = ui_nodes.get(origin_id)
+            if origin is None:
+                return None
+            if origin["type"] == "PrimitiveNode":
+                return ("value", (origin.get("widgets_values") or [None])[0])
+            if origin["type"] == "Reroute":
+                link_id = (origin.get("inputs") or [{}])[0].get("link")
+                continue
+            if origin.get("mode") == _UI_MODE_BYPASS:
+                # passes through the first input of the same type
+                outs = origin.get("outputs") or []
+                typ = outs[origin_slot].get("type") if origin_slot < len(outs) else None
+                link_id = next((i.get("link") for i in origin.get("inputs") or [] if i.get("type") == typ and i.get("link") is not None), None)
+                continue
+            if origin.get("mode") == _UI_MODE_NEVER:
+                return None
+            return (origin_id, origin_slot)
+        return None
+
+    # nodes and links
+
+    specs: dict[Any, _NodeSpec] = {}
+    for id, ui_node in ui_nodes.items():
+        if ui_node["type"] in _UI_ONLY_NODES + ("Reroute", "PrimitiveNode"):
+            continue
+        if ui_node.get("mode") in (_UI_MODE_NEVER, _UI_MODE_BYPASS):
+            continue
+        if not isinstance(id, int):
+            errors.append(f"node {id}: node id must be an integer")
+            continue
+        try:
+            specs[id] = _node_spec(ui_node["type"])
+        except ValueError as e:
+            errors.append(f"node {id}: {e}")
+
+    nodes: list[tuple[int, _Node]] = []
+    links: list[Link] = []
+    for id, spec in specs.items():
+        ui_node = ui_nodes[id]
+        values = _widget_values(spec, ui_node.get("widgets_values"))
+
+        for slot in ui_node.get("inputs") or []:
+            link_id = slot.get("link")
+            if link_id is None:
+                continue
+            name = slot.get("name")
+            index = spec.input_index.get(name)
+            if index is None:
+                errors.append(f"{spec.class_type} ({id}): unknown input {name}")
+                continue
+            inp = spec.inputs[index]
+
+            src = source(link_id)
+            if src is None:
+                # dangling, or fed by a muted node; reported by check if required
+                continue
+            if src[0] == "value":
+                values[index] = _NOT_GIVEN if src[1] is None and index in spec.optional else src[1]
+                continue
+
+            src_id, src_index = src
+            src_spec = specs.get(src_id)
+            if src_spec is None:
+                continue
+            if not (0 <= src_index < len(src_spec.output_types)):
+                errors.append(f"{spec.class_type} ({id}):{index}:{name}: {src_spec.class_type} ({src_id}) has no output {src_index}")
+                continue
+            src_type = src_spec.output_types[src_index]
+            if not _types_compatible(src_type, inp.type):
+                errors.append(f"{spec.class_type} ({id}):{index}:{name}: type mismatch: {src_type} != {inp.type}")
+                continue
+            values[index] = _LINKED
+            links.append(Link(src_id, src_index, id, index))
+
+        if check:
+            for index, value in values.items():
+                inp = spec.inputs[index]
+                if value is not _LINKED and value is not _NOT_GIVEN and not _check_literal(inp.type, value):
+                    errors.append(f"{spec.class_type} ({id}):{index}:{inp.name} ({inp.type.__name__}): invalid value {value!r}")
+
+        nodes.append((id, _spec_node(spec, values)))
+
+    if len(errors) != 0:
+        msg = "\n  ".join(errors)
+        raise ValueError(f"Workflow load failed: \n  {msg}")
+
+    wf = _assemble(nodes, links)
+    if check:
+        wf.check()
+    return wf
+
+
+#
+# Shared Memory Channel
+#
+
+
+class SharedMemoryChannel:
+    """
+    receives encoded images from a shared memory sink node (e.g. SaveImagesMemory)
+
+    the segment is laid out as
+        uint32 count, uint32 length * count, image data back to back
+    and `results` returns each image as a zero-copy `memoryview` of the segment.
+
+        with SharedMemoryChannel.for_workflow(wf) as ch:
+            ch.bind(save.input(0))
+            wf.call()
+            images = [Image.open(BytesIO(v)) for v in ch.results()]
+
+    the channel can be reused across calls; it is reset before each `bind` and grown
+    with `reserve` when needed. views returned by `results` are released on `reset` / `close`.
+    """
+
+    HEADER_ITEM = struct.calcsize("=I")
+
+    def __init__(self, size: int, name: str | None = None):
+        self._name = name if name is not None else f"comfyui_stub_{os.urandom(8).hex()}"
+        self._shm: shared_memory.SharedMemory | None = None
+        self._views: list[memoryview] = []
+        self.reserve(size)
+
+    @staticmethod
+    def required_size(batch_size: int, width: int, height: int, channels: int = 4) -> int:
+        """header + uncompressed size of the images, which bounds their encoded size in practice"""
+        header = SharedMemoryChannel.HEADER_ITEM * (1 + batch_size)
+        # plus some room for the container (PNG chunks etc.) of incompressible images
+        return header + batch_size * (width * height * channels + 1024)
+
+    @classmethod
+    def for_workflow(cls, wf: Workflow, name: str | None = None, channels: int = 4) -> "SharedMemoryChannel":
+        """creates a channel sized from the largest width / height / batch_size literal inputs in `wf`"""
+        return cls(cls._workflow_size(wf, channels), name)
+
+    @staticmethod
+    def _workflow_size(wf: Workflow, channels: int) -> int:
+        dims = {"width": 0, "height": 0, "batch_size": 1}
+        for n in wf._nodes:
+            for inp in n.node._inputs:
+                if inp.name in dims and isinstance(inp.value, int) and not isinstance(inp.value, bool):
+                    dims[inp.name] = max(dims[inp.name], inp.value)
+        if dims["width"] == 0 or dims["height"] == 0:
+            raise ValueError("width / height not found in workflow")
+        return SharedMemoryChannel.required_size(dims["batch_size"], dims["width"], dims["height"], channels)
+
+    @property
+    def name(self) -> str:
+        """tag of the segment, given to the sink node"""
+        return self._name
+
+    @property
+    def size(self) -> int:
+        return 0 if self._shm is None else self._shm.size
+
+    def reserve(self, size: int):
+        """makes the segment at least `size` bytes, reallocating it under the same name if needed"""
+
+        if self._shm is not None and self._shm.size >= size:
+            return
+        if self._shm is not None:
+            self._release()
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        self._shm = shared_memory.SharedMemory(name=self._name, create=True, size=size)
+        self.reset()
+
+    def reserve_for(self, wf: Workflow, channels: int = 4):
+        self.reserve(self._workflow_size(wf, channels))
+
+    def bind(self, inp: ComfyInput[str]):
+        """sets the tag input of the sink node to this channel, and resets the channel"""
+
+        node = inp.node
+        node._inputs[inp.index] = ComfyInput(node, inp.index, inp.name, inp.type, self._name)
+        self.reset()
+
+    def reset(self):
+        """releases the views of previous results and marks the segment empty"""
+
+        if self._shm is None:
+            raise RuntimeError("channel is closed")
+        self._release()
+        self._shm.buf[: self.HEADER_ITEM] = bytes(self.HEADER_ITEM)
+
+    def results(self) -> list[memoryview]:
+        """returns the images written by the sink node; empty if nothing was written"""
+
+        if self._shm is None:
+            raise RuntimeError("channel is closed")
+
+        buf = self._shm.buf
+        (count,) = struct.unpack_from("=I", buf, 0)
+        header = self.HEADER_ITEM * (1 + count)
+        if header > len(buf):
+            raise ValueError(f"corrupted header: {count} images")
+
+        lengths = struct.unpack_from(f"={count}I", buf, self.HEADER_ITEM)
+        if header + sum(lengths) > len(buf):
+            raise ValueError("corrupted header: images exceed the segment")
+
+        result = []
+        offset = header
+        for nbytes in lengths:
+            view = buf[offset : offset + nbytes]
+            self._views.append(view)
+            result.append(view)
+            offset += nbytes
+        return result
+
+    def _release(self):
+        for view in self._views:
+            view.release()
+        self._views.clear()
+
+    def close(self):
+        """releases all views and unlinks the segment"""
+
+        if self._shm is None:
+            return
+        self._release()
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
 _WILL_BE_LINKED = object()
 _NOT_GIVEN = object()
 _LINKED = object()
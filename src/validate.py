@@ -0,0 +1,150 @@
+"""
+API-format prompt validation against node definitions
+"""
+
+from .defn import NodeDefn, COMFYUI_TYPENAME_TO_JSON_TYPENAME
+
+
+def _is_link(value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+        and not isinstance(value[1], bool)
+    )
+
+
+def _types_match(output_type, input_type) -> bool:
+    if isinstance(input_type, (list, tuple)):
+        # selection can be fed by another selection (e.g. primitive nodes)
+        return isinstance(output_type, (list, tuple)) or output_type == "*"
+
+    if isinstance(output_type, (list, tuple)):
+        return False
+
+    if output_type == "*" or input_type == "*":
+        return True
+
+    # "IMAGE,MASK" style union types
+    outs = set(output_type.split(","))
+    ins = set(input_type.split(","))
+    return len(outs & ins) != 0
+
+
+def _check_literal(name: str, typ, desc: dict, value) -> str | None:
+    if isinstance(typ, (list, tuple)):
+        # selection
+        if len(typ) != 0 and value not in typ:
+            return f"{name}: {value!r} is not one of the allowed values"
+        return None
+
+    json_type = COMFYUI_TYPENAME_TO_JSON_TYPENAME.get(typ)
+    if json_type is None:
+        # extension type must be linked with another node
+        return f"{name}: {typ} must be linked"
+
+    if json_type == "boolean":
+        if not isinstance(value, bool):
+            return f"{name}: expected {typ}, got {type(value).__name__}"
+        return None
+
+    if json_type == "string":
+        if not isinstance(value, str):
+            return f"{name}: expected {typ}, got {type(value).__name__}"
+        return None
+
+    # integer / number
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return f"{name}: expected {typ}, got {type(value).__name__}"
+    if json_type == "integer" and not isinstance(value, int):
+        return f"{name}: expected {typ}, got {type(value).__name__}"
+    if "min" in desc and value < desc["min"]:
+        return f"{name}: {value} is less than minimum {desc['min']}"
+    if "max" in desc and value > desc["max"]:
+        return f"{name}: {value} is greater than maximum {desc['max']}"
+    return None
+
+
+def prompt_class_types(prompt) -> frozenset[str]:
+    """returns the class_types used in an API-format prompt, i.e. the definitions `validate_prompt` needs"""
+
+    if not isinstance(prompt, dict):
+        return frozenset()
+    return frozenset(
+        node["class_type"] for node in prompt.values() if isinstance(node, dict) and isinstance(node.get("class_type"), str)
+    )
+
+
+def validate_prompt(prompt: dict, defns: dict[str, NodeDefn]) -> dict[str, list[str]]:
+    """
+    validate an API-format prompt against node definitions
+
+    returns errors per node id. empty dict means the prompt is valid.
+    """
+
+    errors: dict[str, list[str]] = {}
+
+    if not isinstance(prompt, dict):
+        return {"": ["prompt must be an object"]}
+
+    for node_id, node in prompt.items():
+        errs = []
+
+        if not isinstance(node, dict):
+            errors[node_id] = ["node must be an object"]
+            continue
+
+        class_type = node.get("class_type")
+        defn = defns.get(class_type) if isinstance(class_type, str) else None
+        if defn is None:
+            errors[node_id] = [f"unknown class_type: {class_type!r}"]
+            continue
+
+        inputs = node.get("inputs", {})
+        if not isinstance(inputs, dict):
+            errors[node_id] = ["inputs must be an object"]
+            continue
+
+        for p in defn.input_types:
+            name, typ, req, desc = p.name, p.type, p.required, p.desc
+
+            if name not in inputs:
+                if req:
+                    errs.append(f"{name}: required input is missing")
+                continue
+
+            value = inputs[name]
+
+            if not _is_link(value):
+                err = _check_literal(name, typ, desc, value)
+                if err is not None:
+                    errs.append(err)
+                continue
+
+            src_id, src_index = value
+            src = prompt.get(src_id)
+            if not isinstance(src, dict):
+                errs.append(f"{name}: linked node {src_id} does not exist")
+                continue
+
+            src_class_type = src.get("class_type")
+            src_defn = defns.get(src_class_type) if isinstance(src_class_type, str) else None
+            if src_defn is None:
+                # reported on the source node itself
+                continue
+
+            if not (0 <= src_index < len(src_defn.output_types)):
+                errs.append(f"{name}: linked node {src_id} ({src_defn.name}) has no output {src_index}")
+                continue
+
+            src_type = src_defn.output_types[src_index].type
+            if not _types_match(src_type, typ):
+                src_type_s = "SELECTION" if isinstance(src_type, (list, tuple)) else src_type
+                typ_s = "SELECTION" if isinstance(typ, (list, tuple)) else typ
+                errs.append(f"{name}: type mismatch: {src_defn.name}:{src_index} ({src_type_s}) -> {typ_s}")
+
+        if len(errs) != 0:
+            errors[node_id] = errs
+
+    return errors
@@ -0,0 +1,82 @@
+"""
+background precomputation of the stub / schema responses at server startup
+
+enabled by setting the environment variable COMFYUI_STUB_WARMUP=1.
+"""
+
+import os
+import time
+import asyncio
+import traceback
+from typing import Callable
+
+from .profiling import Timings
+
+
+WARMUP_ENV = "COMFYUI_STUB_WARMUP"
+
+
+def warmup_enabled() -> bool:
+    return os.environ.get(WARMUP_ENV, "") not in ("", "0", "false", "False")
+
+
+class WarmUp:
+    """
+    runs `precompute` once in a worker thread and tracks its state
+
+    state is one of:
+    - "disabled": warm-up is not enabled (always ready)
+    - "pending": enabled, waiting for the server to start
+    - "running"
+    - "done"
+    - "failed": not ready; requests are served as without warm-up, and the traceback
+      is written to the server log only
+    """
+
+    def __init__(self, precompute: Callable[[Timings], None], enabled: bool):
+        self._precompute = precompute
+        self.state = "pending" if enabled else "disabled"
+        self.timings = Timings()
+        self._started: float | None = None
+        self._finished: float | None = None
+        self._future: asyncio.Future | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ("disabled", "done")
+
+    def start(self):
+        """schedules the precomputation on the running loop's default executor"""
+
+        if self.state != "pending":
+            return
+        self.state = "running"
+        self._started = time.perf_counter()
+        self._future = asyncio.get_running_loop().run_in_executor(None, self._run)
+
+    def _run(self):
+        try:
+            self._precompute(self.timings)
+        except Exception:
+            self.state = "failed"
+            print(f"[comfyui-stub] warm-up failed:\n{traceback.format_exc()}")
+        else:
+            self.state = "done"
+        finally:
+            self._finished = time.perf_counter()
+
+    async def wait(self):
+        """waits for a running precomputation, so that requests are served from its results"""
+
+        if self._future is not None and not self._future.done():
+            await asyncio.shield(self._future)
+
+    def to_dict(self) -> dict:
+        result: dict = {"ready": self.ready, "state": self.state}
+        if self._started is not None:
+            end = self._finished if self._finished is not None else time.perf_counter()
+            result["elapsed_ms"] = (end - self._started) * 1000
+        if self.state in ("running", "done"):
+            phases = dict(self.timings.phases)  # may be updated by the worker thread
+            result["phases_ms"] = {name: seconds * 1000 for name, seconds in phases.items()}
+        return result
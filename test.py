@@ -158,9 +158,7 @@ def main5():
 
 
 def main6():
-    import struct
     import random
-    from multiprocessing import shared_memory as sm
     from io import BytesIO
     from PIL import Image
 
@@ -170,7 +168,6 @@ def main6():
     WIDTH = 512
     HEIGHT = 512
     BATCH_SIZE = 1
-    MEMORY_TAG = "test123"
 
     ckpt = nodes.loaders.CheckpointLoaderSimple(CKPT)
     prompt = nodes.conditioning.CLIPTextEncode(PROMPT)
@@ -178,7 +175,7 @@ def main6():
     latent = nodes.latent.EmptyLatentImage(WIDTH, HEIGHT, BATCH_SIZE)
     sampler = nodes.sampling.KSampler(sampler_name="euler", scheduler="normal")
     decode = nodes.latent.VAEDecode()
-    save = nodes.hnmr.image.SaveImagesMemory(MEMORY_TAG, dummy_input=random.randint(0, 9999))  # enforce rerun
+    save = nodes.hnmr.image.SaveImagesMemory("", dummy_input=random.randint(0, 9999))  # enforce rerun; tag is bound below
 
     with nodes.Workflow() as wf:
         ckpt.output("CLIP") - prompt.input("clip")
@@ -191,35 +188,16 @@ def main6():
         ckpt.output("VAE") - decode.input("vae")
         decode.output(0) - save.input("images")
 
-    header_fmt = f"=I{BATCH_SIZE}I"
-    header_size = struct.calcsize(header_fmt)
-    mem_size = WIDTH * HEIGHT * 4 * BATCH_SIZE + header_size
-
-    shim = None
-    result_images = None
-    try:
-        # breakpoint()
-        shim = sm.SharedMemory(name=MEMORY_TAG, create=True, size=mem_size)
-        shim.buf[:4] = b"\x00\x00\x00\x00"
-
-        data = wf.call()
-
-        if shim.buf[:4] != b"\x00\x00\x00\x00":
-            # ok
-            n, *lens = struct.unpack(header_fmt, shim.buf[:header_size])
-            result_images = []
-            offset = header_size
-            for nbytes in lens:
-                with BytesIO(shim.buf[offset : offset + nbytes]) as io:
-                    img = Image.open(io).convert("RGB")
-                    result_images.append(img)
-                offset += nbytes
-    finally:
-        if shim is not None:
-            shim.close()
-            shim.unlink()
-
-    if result_images is None or len(result_images) != BATCH_SIZE:
+    with nodes.SharedMemoryChannel.for_workflow(wf) as channel:
+        channel.bind(save.input(0))
+        wf.call()
+
+        result_images = []
+        for view in channel.results():
+            with BytesIO(view) as io:
+                result_images.append(Image.open(io).convert("RGB"))
+
+    if len(result_images) != BATCH_SIZE:
         raise RuntimeError("No data received")
 
     for i, img in enumerate(result_images):
@@ -0,0 +1,211 @@
+"""minimal ComfyUI HTTP API servers on a local port"""
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeComfyServer:
+    """
+    completes every prompt immediately
+
+    `outputs` of each history have an entry for every node whose class_type is in
+    `output_nodes`, keyed by the submitted node id.
+    """
+
+    def __init__(self, output_nodes=("SaveImage",)):
+        self.output_nodes = set(output_nodes)
+        self.prompts: list[dict] = []
+        self._histories: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path == "/prompt":
+                    self._send({"prompt_id": fake._submit(data["prompt"])})
+                else:
+                    self._send({})
+
+            def do_GET(self):
+                if self.path.startswith("/history/"):
+                    prompt_id = self.path[len("/history/") :]
+                    with fake._lock:
+                        history = fake._histories.get(prompt_id)
+                    self._send({} if history is None else {prompt_id: history})
+                else:
+                    self.send_error(404)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _submit(self, prompt: dict) -> str:
+        with self._lock:
+            self.prompts.append(prompt)
+            prompt_id = f"prompt-{len(self.prompts)}"
+            outputs = [nid for nid, node in prompt.items() if node["class_type"] in self.output_nodes]
+            self._histories[prompt_id] = {
+                "prompt": [len(self.prompts), prompt_id, prompt, {}, outputs],
+                "outputs": {nid: {"images": [{"filename": f"{nid}.png", "subfolder": "", "type": "output"}]} for nid in outputs},
+                "meta": {nid: {"node_id": nid, "display_node": nid} for nid in outputs},
+                "status": {
+                    "status_str": "success",
+                    "completed": True,
+                    "messages": [["execution_cached", {"nodes": list(prompt), "prompt_id": prompt_id}]],
+                },
+            }
+        return prompt_id
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class AsyncFakeComfyServer:
+    """
+    aiohttp version for the async clients, run on the test's event loop
+
+    a prompt completes `delay` seconds after it is submitted; its progress is pushed
+    to the websocket of its `client_id`, if any.
+
+        async with AsyncFakeComfyServer() as server:
+            ...
+    """
+
+    def __init__(self, delay: float = 0.05, output_nodes=("SaveImage",)):
+        from aiohttp import web
+
+        self.delay = delay
+        self.output_nodes = set(output_nodes)
+        self.prompts: dict[str, tuple[float, dict]] = {}
+        self.queue: list[str] = []
+        self.deleted: list[str] = []
+        self.max_queue = 0
+        self._sockets: dict = {}
+
+        app = web.Application()
+        app.router.add_post("/prompt", self._prompt)
+        app.router.add_get("/history/{id}", self._history)
+        app.router.add_get("/queue", self._get_queue)
+        app.router.add_post("/queue", self._post_queue)
+        app.router.add_post("/interrupt", self._interrupt)
+        app.router.add_get("/view", self._view)
+        app.router.add_get("/ws", self._ws)
+        self._runner = web.AppRunner(app)
+        self.url = ""
+
+    async def __aenter__(self):
+        from aiohttp import web
+
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+    def _outputs(self, prompt_id: str, prompt: dict) -> dict:
+        return {
+            nid: {"images": [{"filename": f"{prompt_id}_{nid}.png", "subfolder": "", "type": "output"}]}
+            for nid, node in prompt.items()
+            if node["class_type"] in self.output_nodes
+        }
+
+    def _completed(self, prompt_id: str) -> bool:
+        t, _ = self.prompts[prompt_id]
+        return prompt_id not in self.deleted and time.monotonic() - t >= self.delay
+
+    async def _prompt(self, req):
+        import asyncio
+        from aiohttp import web
+
+        data = await req.json()
+        prompt_id = f"prompt-{len(self.prompts) + 1}"
+        self.prompts[prompt_id] = (time.monotonic(), data["prompt"])
+        self.queue.append(prompt_id)
+        self.max_queue = max(self.max_queue, len(self.queue))
+        ws = self._sockets.get(data.get("client_id"))
+        if ws is not None:
+            asyncio.ensure_future(self._push(ws, prompt_id, data["prompt"]))
+        return web.json_response({"prompt_id": prompt_id, "number": len(self.prompts)})
+
+    async def _history(self, req):
+        from aiohttp import web
+
+        prompt_id = req.match_info["id"]
+        if prompt_id not in self.prompts or not self._completed(prompt_id):
+            return web.json_response({})
+        if prompt_id in self.queue:
+            self.queue.remove(prompt_id)
+        _, prompt = self.prompts[prompt_id]
+        history = {
+            "prompt": [0, prompt_id, prompt, {}, []],
+            "outputs": self._outputs(prompt_id, prompt),
+            "status": {"status_str": "success", "completed": True, "messages": []},
+        }
+        return web.json_response({prompt_id: history})
+
+    async def _get_queue(self, req):
+        from aiohttp import web
+
+        return web.json_response(
+            {"queue_running": [[0, p] for p in self.queue[:1]], "queue_pending": [[0, p] for p in self.queue[1:]]}
+        )
+
+    async def _post_queue(self, req):
+        from aiohttp import web
+
+        for prompt_id in (await req.json()).get("delete", []):
+            self.deleted.append(prompt_id)
+            if prompt_id in self.queue:
+                self.queue.remove(prompt_id)
+        return web.Response()
+
+    async def _interrupt(self, req):
+        from aiohttp import web
+
+        return web.Response()
+
+    async def _view(self, req):
+        from aiohttp import web
+
+        return web.Response(body=req.query["filename"].encode("utf-8"))
+
+    async def _ws(self, req):
+        from aiohttp import web
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(req)
+        self._sockets[req.query.get("clientId")] = ws
+        async for _ in ws:
+            pass
+        return ws
+
+    async def _push(self, ws, prompt_id: str, prompt: dict):
+        await ws.send_str(json.dumps({"type": "execution_start", "data": {"prompt_id": prompt_id}}))
+        for nid, output in self._outputs(prompt_id, prompt).items():
+            await ws.send_str(json.dumps({"type": "executed", "data": {"node": nid, "prompt_id": prompt_id, "output": output}}))
+        # sent before the history is written, as the server may do
+        await ws.send_str(json.dumps({"type": "execution_success", "data": {"prompt_id": prompt_id}}))
@@ -0,0 +1,53 @@
+"""
+shared setup of the unit tests
+
+run from the repository root:
+
+    python -m unittest discover -s test -t .
+
+`bench.fixtures.install()` registers a fake ComfyUI `nodes` module, so the tests
+run without ComfyUI.
+"""
+
+import os
+import sys
+import tempfile
+import importlib.util
+
+from bench import fixtures
+
+NODE_CLASS_MAPPINGS = fixtures.install()
+
+from src.defn import collect_defns  # noqa: E402
+from src.gen_stub import generate_stub  # noqa: E402
+
+
+def install_nodes(nodes: dict[str, type]):
+    """replaces the registered node classes"""
+
+    NODE_CLASS_MAPPINGS.clear()
+    NODE_CLASS_MAPPINGS.update(nodes)
+
+
+_stub_counter = 0
+
+
+def load_stub(nodes: dict[str, type] | None = None):
+    """generates the stub for `nodes` (default: `fixtures.core_nodes(4, 4)`) and imports it"""
+
+    global _stub_counter
+    install_nodes(nodes if nodes is not None else fixtures.core_nodes(4, 4))
+    source = generate_stub(list(collect_defns().values()))
+
+    _stub_counter += 1
+    name = f"_test_stub_{_stub_counter}"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{name}.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(source)
+        spec = importlib.util.spec_from_file_location(name, path)
+        assert spec is not None and spec.loader is not None
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module  # dataclasses look up the module of the class
+        spec.loader.exec_module(module)
+    return module
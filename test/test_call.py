@@ -0,0 +1,46 @@
+import time
+import socket
+import unittest
+
+from test._support import load_stub
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+PROMPT = {"1": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}}}
+
+
+class StalledServerTest(unittest.IsolatedAsyncioTestCase):
+    """a server that accepts connections but never answers"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.nodes = load_stub()
+
+    def setUp(self):
+        # connections wait in the backlog, never accepted
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(8)
+        self.addCleanup(sock.close)
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    def test_call_prompt(self):
+        t0 = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.nodes.call_prompt(PROMPT, self.url, timeout=0.3, retries=2)
+        self.assertLess(time.monotonic() - t0, 2.0)
+
+    @unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+    async def test_acall_prompt(self):
+        t0 = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            await self.nodes.acall_prompt(PROMPT, self.url, timeout=0.3, retries=2)
+        self.assertLess(time.monotonic() - t0, 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+from test._support import install_nodes, fixtures
+
+from src.defn import DefnStore, NodeFilter, collect_defns, defn_shape_hash, defn_hash
+
+
+class DefnStoreTest(unittest.TestCase):
+    def test_options_shared(self):
+        store = DefnStore()
+        a = store.options(["x.safetensors", "y.safetensors"])
+        b = store.options(("x.safetensors", "y.safetensors"))
+        self.assertEqual(a, ("x.safetensors", "y.safetensors"))
+        self.assertIs(a, b)
+
+    def test_desc_shared(self):
+        store = DefnStore()
+        a = store.desc({"default": 1, "min": 0})
+        b = store.desc({"default": 1, "min": 0})
+        self.assertIs(a, b)
+
+    def test_desc_keeps_bool(self):
+        store = DefnStore()
+        self.assertEqual(store.desc({"default": 1}), {"default": 1})
+        desc = store.desc({"default": True})
+        self.assertIs(desc["default"], True)
+        desc = store.desc({"default": 1.0})
+        self.assertIs(type(desc["default"]), float)
+
+    def test_options_keep_types(self):
+        store = DefnStore()
+        self.assertEqual(store.options([1, 2]), (1, 2))
+        options = store.options([True, False])
+        self.assertIs(options[0], True)
+        self.assertIs(options[1], False)
+
+    def test_unhashable(self):
+        store = DefnStore()
+        desc = {"default": [1, 2]}
+        self.assertIs(store.desc(desc), desc)
+        self.assertEqual(store.options([[1], [2]]), ([1], [2]))
+
+    def test_begin_drops_unused(self):
+        store = DefnStore()
+        kept = store.options(["a"])
+        dropped = store.options(["b"])
+        store.begin()
+        self.assertIs(store.options(["a"]), kept)
+        store.begin()
+        self.assertIs(store.options(["a"]), kept)
+        self.assertIsNot(store.options(["b"]), dropped)
+
+    def test_max_entries(self):
+        store = DefnStore(max_entries=10)
+        for i in range(100):
+            store.options([f"file_{i}"])
+            store.desc({"default": i})
+        self.assertLessEqual(len(store), 10)
+
+    def test_filtered_collections_bounded(self):
+        install_nodes(fixtures.synthetic_nodes(50))
+        store = DefnStore(max_entries=20)
+        names = list(fixtures.synthetic_nodes(50))
+        for name in names:
+            collect_defns(node_filter=NodeFilter(names=frozenset([name])), store=store)
+        self.assertLessEqual(len(store), 20)
+
+
+class CollectDefnsTest(unittest.TestCase):
+    def setUp(self):
+        install_nodes(fixtures.core_nodes(4, 4))
+
+    def test_bool_default(self):
+        klass = fixtures._node_class(
+            "Flags",
+            {"required": {"a": ("INT", {"default": 1}), "b": ("BOOLEAN", {"default": True})}},
+            ("INT",),
+            "test",
+        )
+        install_nodes({"Flags": klass})
+        defn = collect_defns(store=DefnStore())["Flags"]
+        params = {p.name: p for p in defn.input_types}
+        self.assertIs(params["b"].desc["default"], True)
+        self.assertEqual(params["a"].desc["default"], 1)
+
+    def test_filter(self):
+        defns = collect_defns(node_filter=NodeFilter(names=frozenset(["KSampler", "VAEDecode"])))
+        self.assertEqual(set(defns), {"KSampler", "VAEDecode"})
+
+    def test_shape_hash_ignores_options(self):
+        install_nodes(fixtures.core_nodes(20, 4))
+        before = collect_defns()["CheckpointLoaderSimple"]
+        install_nodes(fixtures.core_nodes(30, 4))
+        after = collect_defns()["CheckpointLoaderSimple"]
+        self.assertNotEqual(defn_hash(before), defn_hash(after))
+        self.assertEqual(defn_shape_hash(before), defn_shape_hash(after))
+
+
+if __name__ == "__main__":
+    unittest.main()
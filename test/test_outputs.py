@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from test._support import load_stub
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if aiohttp is not None:
+    from test._fake_server import AsyncFakeComfyServer
+
+
+def _prompt() -> dict:
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "x", "clip": ["1", 1]}},
+        "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0], "filename_prefix": "x"}},
+    }
+
+
+class OpenDestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.nodes = load_stub()
+
+    def _file(self, subfolder: str, filename: str):
+        return self.nodes.OutputFile("1", "images", filename, subfolder, "output")
+
+    def test_inside(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            f, path, close = self.nodes._open_dest(tmp, self._file("a/b", "x.png"))
+            f.close()
+            self.assertTrue(close)
+            self.assertEqual(os.path.abspath(path), os.path.join(os.path.abspath(tmp), "a", "b", "x.png"))
+
+    def test_escapes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp, "out")
+            for subfolder, filename in [
+                ("..", "x.png"),
+                ("a/../..", "x.png"),
+                ("", "../x.png"),
+                (tmp, "x.png"),
+                ("", os.path.join(tmp, "x.png")),
+                ("", ""),
+            ]:
+                with self.assertRaises(ValueError, msg=(subfolder, filename)):
+                    self.nodes._open_dest(dest, self._file(subfolder, filename))
+            self.assertEqual(os.listdir(tmp), [])
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class CallPromptDownloadTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.nodes = load_stub()
+
+    async def test_history_after_last_message(self):
+        # the fake server reports success before the history is written
+        with tempfile.TemporaryDirectory() as tmp:
+            async with AsyncFakeComfyServer(delay=0.2) as server:
+                history, files = await self.nodes.acall_prompt_download(_prompt(), tmp, server.url, timeout=10)
+            self.assertTrue(history["status"]["completed"])
+            self.assertEqual([f.node_id for f, _ in files], ["3"])
+            with open(files[0][1], "rb") as f:
+                self.assertEqual(f.read(), files[0][0].filename.encode("utf-8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import contextlib
+import unittest
+
+from test._support import load_stub
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if aiohttp is not None:
+    from test._fake_server import AsyncFakeComfyServer
+
+
+def _prompt(seed: int) -> dict:
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": f"seed {seed}", "clip": ["1", 1]}},
+        "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0], "filename_prefix": "x"}},
+    }
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class PipelineTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.nodes = load_stub()
+
+    async def test_results(self):
+        async with AsyncFakeComfyServer() as server:
+            pipeline = self.nodes.apipeline((_prompt(i) for i in range(8)), server.url, max_queue=2, queue_interval=0.01)
+            indices = [result.index async for result in pipeline]
+        self.assertEqual(sorted(indices), list(range(8)))
+        self.assertLessEqual(server.max_queue, 2)
+
+    async def test_producer_waits_for_results(self):
+        # the next workflow depends on the previous result
+        received = asyncio.Queue()
+
+        async def produce():
+            yield _prompt(0)
+            for i in range(1, 4):
+                await received.get()
+                yield _prompt(i)
+
+        async with AsyncFakeComfyServer() as server:
+
+            async def consume():
+                indices = []
+                async for result in self.nodes.apipeline(produce(), server.url, queue_interval=0.01):
+                    indices.append(result.index)
+                    received.put_nowait(result)
+                return indices
+
+            indices = await asyncio.wait_for(consume(), 10)
+        self.assertEqual(indices, [0, 1, 2, 3])
+
+    async def test_source_error(self):
+        async def produce():
+            yield _prompt(0)
+            raise KeyError("source")
+
+        async with AsyncFakeComfyServer() as server:
+            with self.assertRaises(KeyError):
+                async for _ in self.nodes.apipeline(produce(), server.url, queue_interval=0.01):
+                    pass
+
+    async def test_break_cancels(self):
+        async with AsyncFakeComfyServer(delay=0.2) as server:
+            pipeline = self.nodes.apipeline((_prompt(i) for i in range(8)), server.url, max_queue=3, queue_interval=0.01)
+            async with contextlib.aclosing(pipeline):
+                async for _ in pipeline:
+                    break
+            self.assertEqual(server.queue, [])
+
+    async def test_plain_break(self):
+        # the dropped generator is closed by the event loop, shortly after the loop is left
+        async with AsyncFakeComfyServer(delay=0.2) as server:
+            async for _ in self.nodes.apipeline((_prompt(i) for i in range(8)), server.url, max_queue=3, queue_interval=0.01):
+                break
+            for _ in range(100):
+                if server.queue == []:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(server.queue, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import gzip
+import types
+import tempfile
+import unittest
+from unittest import mock
+
+from test._support import install_nodes, fixtures
+
+from src import defn, response_cache
+from src.defn import NodeFilter
+from src.response_cache import CachedResponse, CollectedDefns, ResponseCache, defns_fingerprint, etag_matches
+
+
+def _entry() -> CachedResponse:
+    return CachedResponse("key", b"x" * 1000, "text/plain", "utf-8")
+
+
+class NegotiateTest(unittest.TestCase):
+    def test_identity(self):
+        entry = _entry()
+        self.assertIsNone(entry.negotiate(None))
+        self.assertIsNone(entry.negotiate(""))
+        self.assertIsNone(entry.negotiate("deflate"))
+        self.assertIsNone(entry.negotiate("gzip;q=0"))
+        self.assertIsNone(entry.negotiate("gzip;q=0.5, identity"))
+
+    def test_gzip(self):
+        entry = _entry()
+        self.assertEqual(entry.negotiate("gzip"), "gzip")
+        self.assertEqual(entry.negotiate("GZIP;q=0.5"), "gzip")
+        self.assertEqual(entry.negotiate("br;q=0.1, gzip;q=0.9"), "gzip")
+        self.assertEqual(entry.negotiate("br;q=0, *"), "gzip")
+
+    @unittest.skipIf(response_cache.brotli is None, "brotli is not installed")
+    def test_br(self):
+        entry = _entry()
+        self.assertEqual(entry.negotiate("gzip, br"), "br")
+        self.assertEqual(entry.negotiate("gzip;q=0.5, br;q=0.8"), "br")
+        self.assertEqual(entry.negotiate("*"), "br")
+
+    def test_select(self):
+        entry = _entry()
+        body, coding = entry.select("gzip")
+        self.assertEqual(coding, "gzip")
+        self.assertEqual(gzip.decompress(body), entry.body)
+        self.assertTrue(entry.is_encoded("gzip"))
+        self.assertEqual(entry.select("identity"), (entry.body, None))
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_rebuilt_on_key_change(self):
+        cache = ResponseCache()
+        a = cache.get("stub", "1", lambda: b"a", "text/plain")
+        self.assertIs(cache.get("stub", "1", lambda: b"b", "text/plain"), a)
+        b = cache.get("stub", "2", lambda: b"b", "text/plain")
+        self.assertEqual(b.body, b"b")
+
+
+class ETagTest(unittest.TestCase):
+    def test_per_endpoint(self):
+        cache = ResponseCache()
+        stub = cache.get("stub", "1", lambda: b"a", "text/plain")
+        schema = cache.get("schema", "1", lambda: b"b", "application/json")
+        limited = cache.get("stub;max_options=8", "1", lambda: b"c", "text/plain")
+        self.assertEqual(len({stub.etag, schema.etag, limited.etag}), 3)
+        self.assertNotEqual(cache.get("stub", "2", lambda: b"a", "text/plain").etag, stub.etag)
+
+    def test_per_coding(self):
+        entry = _entry()
+        etags = {entry.etag_for(None), entry.etag_for("gzip"), entry.etag_for("br")}
+        self.assertEqual(len(etags), 3)
+        for etag in etags:
+            self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+
+    def test_matches(self):
+        etag = _entry().etag_for("gzip")
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches(None, etag))
+        self.assertFalse(etag_matches(_entry().etag_for(None), etag))
+
+
+class CollectedDefnsTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+        nodes = fixtures.core_nodes(4, 4)
+        klass = nodes["KSampler"]
+        input_types = klass.INPUT_TYPES()
+
+        def INPUT_TYPES(cls):
+            self.calls += 1
+            self.on_input_types()
+            return input_types
+
+        klass.INPUT_TYPES = classmethod(INPUT_TYPES)
+        self.nodes = nodes
+        install_nodes(nodes)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.models = tmp.name
+        self.on_input_types = lambda: None
+        folder_paths = types.SimpleNamespace(
+            folder_names_and_paths={"checkpoints": ([self.models], {".safetensors"})},
+            filename_list_cache={},
+        )
+        self.folder_paths = folder_paths
+        patcher = mock.patch.object(defn, "folder_paths", folder_paths)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reused(self):
+        collected = CollectedDefns()
+        defns = collected.get()
+        self.assertIs(collected.get(), defns)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(collected.fingerprint(defns), defns_fingerprint(defns))
+
+    def test_subsets(self):
+        collected = CollectedDefns()
+        collected.get()
+        node_filter = NodeFilter(names=frozenset(["KSampler", "VAEDecode"]))
+        subset = collected.get(node_filter=node_filter)
+        self.assertEqual({d.name for d in subset}, {"KSampler", "VAEDecode"})
+        self.assertIs(collected.get(node_filter=node_filter), subset)
+        self.assertEqual(collected.fingerprint(subset, node_filter), defns_fingerprint(subset))
+        self.assertEqual(self.calls, 1)
+
+    def test_directory_changed(self):
+        collected = CollectedDefns()
+        defns = collected.get()
+        os.utime(self.models, ns=(0, 0))
+        self.assertIsNot(collected.get(), defns)
+        self.assertEqual(self.calls, 2)
+
+    def test_filename_cache_filled_by_collecting(self):
+        # as ComfyUI's get_filename_list, called from INPUT_TYPES, caches subdirectories
+        sub = os.path.join(self.models, "SDXL")
+        os.mkdir(sub)
+        os.utime(self.models, ns=(0, 0))
+        cache = self.folder_paths.filename_list_cache
+        self.on_input_types = lambda: cache.setdefault("checkpoints", ([], {self.models: 0, sub: 0}, 0.0))
+
+        collected = CollectedDefns()
+        defns = collected.get()
+        self.assertIs(collected.get(), defns)
+        self.assertEqual(self.calls, 1)
+
+        os.utime(sub, ns=(0, 0))
+        self.assertIsNot(collected.get(), defns)
+        self.assertEqual(self.calls, 2)
+
+    def test_class_registered(self):
+        collected = CollectedDefns()
+        collected.get()
+        install_nodes({**self.nodes, "Extra": fixtures._node_class("Extra", {}, ("INT",), "test")})
+        self.assertIn("Extra", {d.name for d in collected.get()})
+
+    def test_stale_subset(self):
+        collected = CollectedDefns()
+        collected.get()
+        os.utime(self.models, ns=(0, 0))
+        node_filter = NodeFilter(names=frozenset(["VAEDecode"]))
+        self.assertEqual([d.name for d in collected.get(node_filter=node_filter)], ["VAEDecode"])
+        # only the selected nodes are collected
+        self.assertEqual(self.calls, 1)
+
+    def test_without_comfyui(self):
+        with mock.patch.object(defn, "folder_paths", None):
+            collected = CollectedDefns()
+            collected.get()
+            collected.get()
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+from test._support import load_stub
+from test._fake_server import FakeComfyServer
+
+CKPT = "SDXL/model_00000.safetensors"
+
+
+class ResultCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.nodes = load_stub()
+
+    def build(self, seeds=(0, 1)):
+        """txt2img workflow with one SaveImage per seed, whose ids follow the order of `seeds`"""
+
+        n = self.nodes
+        with n.Workflow() as wf:
+            model, clip, vae = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+            cond = n.conditioning.CLIPTextEncode("a cat", clip).output(0)
+            latent = n.latent.EmptyLatentImage(512, 512, 1).output(0)
+            for seed in seeds:
+                samples = n.sampling.KSampler(model, seed, 20, 8.0, "euler", "normal", cond, cond, latent).output(0)
+                n.image.SaveImage(n.latent.VAEDecode(samples, vae).output(0), f"seed{seed}")
+        return wf
+
+    @staticmethod
+    def save_ids(prompt: dict) -> dict[str, str]:
+        """filename_prefix -> id of the SaveImage node"""
+
+        return {node["inputs"]["filename_prefix"]: nid for nid, node in prompt.items() if node["class_type"] == "SaveImage"}
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            self.nodes.ResultCache()
+
+    def test_hit(self):
+        cache = self.nodes.MemoryResultCache()
+        with FakeComfyServer() as server:
+            first = self.build().call(server.url, cache=cache)
+            wf = self.build()
+            second = wf.call(server.url, cache=cache)
+        self.assertEqual(len(server.prompts), 1)
+        self.assertTrue(wf.last_metrics.cache_hit)
+        self.assertEqual(first, second)
+
+    def test_copies(self):
+        cache = self.nodes.MemoryResultCache()
+        value = {"history": {"outputs": {"1": {"images": []}}}, "node_hashes": {"1": "x"}}
+        cache.put("k", value)
+        value["history"]["outputs"].clear()
+        got = cache.get("k")
+        self.assertEqual(got["history"]["outputs"], {"1": {"images": []}})
+        got["history"]["outputs"]["1"]["images"].append("y")
+        self.assertEqual(cache.get("k")["history"]["outputs"], {"1": {"images": []}})
+
+    def test_hit_with_other_ids(self):
+        cache = self.nodes.MemoryResultCache()
+        with FakeComfyServer() as server:
+            first = self.build(seeds=(0, 1)).call(server.url, cache=cache)
+            wf = self.build(seeds=(1, 0))
+            history = wf.call(server.url, cache=cache)
+        self.assertEqual(len(server.prompts), 1)
+
+        prompt = wf.to_dict()
+        old_ids, new_ids = self.save_ids(first["prompt"][2]), self.save_ids(prompt)
+        self.assertNotEqual(old_ids, new_ids)
+        for prefix, nid in new_ids.items():
+            # the outputs of each SaveImage are moved to the caller's id of that node
+            self.assertEqual(history["outputs"][nid], first["outputs"][old_ids[prefix]])
+            self.assertEqual(history["meta"][nid], {"node_id": nid, "display_node": nid})
+        self.assertEqual(history["prompt"][2], prompt)
+        self.assertEqual(sorted(history["prompt"][4]), sorted(new_ids.values()))
+        self.assertEqual(sorted(history["status"]["messages"][0][1]["nodes"]), sorted(prompt))
+
+    def test_other_graph(self):
+        cache = self.nodes.MemoryResultCache()
+        with FakeComfyServer() as server:
+            self.build(seeds=(0, 1)).call(server.url, cache=cache)
+            self.build(seeds=(0, 2)).call(server.url, cache=cache)
+        self.assertEqual(len(server.prompts), 2)
+
+    def test_scoped_by_url(self):
+        cache = self.nodes.MemoryResultCache()
+        with FakeComfyServer() as a, FakeComfyServer() as b:
+            self.build().call(a.url, cache=cache)
+            self.build().call(b.url, cache=cache)
+        self.assertEqual(len(a.prompts), 1)
+        self.assertEqual(len(b.prompts), 1)
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as tmp, FakeComfyServer() as server:
+            cache = self.nodes.DiskResultCache(os.path.join(tmp, "cache"))
+            self.build(seeds=(0, 1)).call(server.url, cache=cache)
+            cache = self.nodes.DiskResultCache(os.path.join(tmp, "cache"))
+            wf = self.build(seeds=(1, 0))
+            history = wf.call(server.url, cache=cache)
+        self.assertEqual(len(server.prompts), 1)
+        self.assertEqual(sorted(history["outputs"]), sorted(self.save_ids(wf.to_dict()).values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+
+from test._support import install_nodes
+
+from src.defn import collect_defns
+from src.validate import validate_prompt, prompt_class_types
+
+
+def _node_class(name: str, inputs: dict, return_types: tuple, **attrs) -> type:
+    def INPUT_TYPES(cls):
+        return inputs
+
+    ns = {"INPUT_TYPES": classmethod(INPUT_TYPES), "RETURN_TYPES": return_types, "FUNCTION": "run", "CATEGORY": "test"}
+    return type(name, (object,), {**ns, **attrs})
+
+
+NODES = {
+    "CheckpointLoaderSimple": _node_class(
+        "CheckpointLoaderSimple",
+        {"required": {"ckpt_name": (["a.safetensors", "b.safetensors"],)}},
+        ("MODEL", "CLIP", "VAE"),
+    ),
+    "CLIPTextEncode": _node_class(
+        "CLIPTextEncode",
+        {"required": {"text": ("STRING", {"multiline": True}), "clip": ("CLIP",)}},
+        ("CONDITIONING",),
+    ),
+    "EmptyLatentImage": _node_class(
+        "EmptyLatentImage",
+        {
+            "required": {
+                "width": ("INT", {"default": 512, "min": 16, "max": 16384}),
+                "height": ("INT", {"default": 512, "min": 16, "max": 16384}),
+                "batch_size": ("INT", {"default": 1, "min": 1, "max": 4096}),
+            }
+        },
+        ("LATENT",),
+    ),
+    "KSampler": _node_class(
+        "KSampler",
+        {
+            "required": {
+                "model": ("MODEL",),
+                "seed": ("INT", {"default": 0, "min": 0}),
+                "cfg": ("FLOAT", {"default": 8.0, "min": 0.0, "max": 100.0}),
+                "sampler_name": (["euler", "dpmpp_2m"],),
+                "positive": ("CONDITIONING",),
+                "negative": ("CONDITIONING",),
+                "latent_image": ("LATENT",),
+            }
+        },
+        ("LATENT",),
+    ),
+    "VAEDecode": _node_class("VAEDecode", {"required": {"samples": ("LATENT",), "vae": ("VAE",)}}, ("IMAGE",)),
+    "SaveImage": _node_class(
+        "SaveImage",
+        {"required": {"images": ("IMAGE",), "filename_prefix": ("STRING", {"default": "ComfyUI"})}},
+        (),
+        OUTPUT_NODE=True,
+    ),
+}
+
+
+def _prompt() -> dict:
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat", "clip": ["1", 1]}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["1", 1]}},
+        "4": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "5": {
+            "class_type": "KSampler",
+            "inputs": {
+                "model": ["1", 0],
+                "seed": 0,
+                "cfg": 7.0,
+                "sampler_name": "euler",
+                "positive": ["2", 0],
+                "negative": ["3", 0],
+                "latent_image": ["4", 0],
+            },
+        },
+        "6": {"class_type": "VAEDecode", "inputs": {"samples": ["5", 0], "vae": ["1", 2]}},
+        "7": {"class_type": "SaveImage", "inputs": {"images": ["6", 0], "filename_prefix": "test"}},
+    }
+
+
+class ValidatePromptTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        install_nodes(NODES)
+        cls.defns = collect_defns()
+
+    def test_valid(self):
+        self.assertEqual(validate_prompt(_prompt(), self.defns), {})
+
+    def test_not_an_object(self):
+        self.assertEqual(validate_prompt([], self.defns), {"": ["prompt must be an object"]})
+
+    def test_unknown_class_type(self):
+        prompt = _prompt()
+        prompt["4"]["class_type"] = "NoSuchNode"
+        errors = validate_prompt(prompt, self.defns)
+        self.assertEqual(list(errors), ["4"])
+
+    def test_unhashable_class_type(self):
+        for class_type in (["KSampler"], {"a": 1}):
+            prompt = _prompt()
+            prompt["1"]["class_type"] = class_type
+            errors = validate_prompt(prompt, self.defns)
+            # reported on the node itself, not on the nodes linked to it
+            self.assertEqual(list(errors), ["1"])
+            self.assertIn("unknown class_type", errors["1"][0])
+
+    def test_missing_input(self):
+        prompt = _prompt()
+        del prompt["5"]["inputs"]["seed"]
+        self.assertEqual(validate_prompt(prompt, self.defns), {"5": ["seed: required input is missing"]})
+
+    def test_selection(self):
+        prompt = _prompt()
+        prompt["5"]["inputs"]["sampler_name"] = "nope"
+        errors = validate_prompt(prompt, self.defns)
+        self.assertEqual(list(errors), ["5"])
+        self.assertIn("sampler_name", errors["5"][0])
+
+    def test_range_and_type(self):
+        prompt = _prompt()
+        prompt["4"]["inputs"]["width"] = 0
+        prompt["4"]["inputs"]["height"] = "512"
+        prompt["4"]["inputs"]["batch_size"] = True
+        errors = validate_prompt(prompt, self.defns)
+        self.assertEqual(len(errors["4"]), 3)
+
+    def test_links(self):
+        prompt = _prompt()
+        prompt["6"]["inputs"]["vae"] = ["1", 0]  # MODEL -> VAE
+        prompt["7"]["inputs"]["images"] = ["99", 0]
+        prompt["2"]["inputs"]["clip"] = ["1", 5]
+        errors = validate_prompt(prompt, self.defns)
+        self.assertIn("type mismatch", errors["6"][0])
+        self.assertIn("does not exist", errors["7"][0])
+        self.assertIn("has no output", errors["2"][0])
+
+    def test_prompt_class_types(self):
+        prompt = _prompt()
+        prompt["8"] = {"class_type": ["x"], "inputs": {}}
+        prompt["9"] = "not a node"
+        self.assertEqual(prompt_class_types(prompt), {p["class_type"] for p in _prompt().values()})
+        self.assertEqual(prompt_class_types([]), frozenset())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,372 @@
+import copy
+import unittest
+
+from test._support import load_stub
+
+from bench import fixtures
+
+CKPT = "SDXL/model_00000.safetensors"
+
+
+class WorkflowTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.nodes = load_stub()
+
+    def build(self, seeds=(0,), reverse_encoders: bool = False, dead: bool = False):
+        """txt2img workflow with one sampler / SaveImage per seed"""
+
+        n = self.nodes
+        with n.Workflow() as wf:
+            model, clip, vae = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+            if reverse_encoders:
+                negative = n.conditioning.CLIPTextEncode("bad", clip).output(0)
+                positive = n.conditioning.CLIPTextEncode("a cat", clip).output(0)
+            else:
+                positive = n.conditioning.CLIPTextEncode("a cat", clip).output(0)
+                negative = n.conditioning.CLIPTextEncode("bad", clip).output(0)
+            latent = n.latent.EmptyLatentImage(512, 512, 1).output(0)
+            for seed in seeds:
+                samples = n.sampling.KSampler(model, seed, 20, 8.0, "euler", "normal", positive, negative, latent).output(0)
+                n.image.SaveImage(n.latent.VAEDecode(samples, vae).output(0), "out")
+            if dead:
+                n.conditioning.CLIPTextEncode("unused", clip)
+        return wf
+
+
+class HashTest(WorkflowTestCase):
+    def test_independent_of_build_order(self):
+        a = self.build()
+        b = self.build(reverse_encoders=True)
+        self.assertNotEqual(a.to_dict(), b.to_dict())
+        self.assertEqual(a.canonical_hash(), b.canonical_hash())
+        self.assertEqual(self.nodes.workflow_hash(a.to_dict()), a.canonical_hash())
+
+    def test_ignores_titles(self):
+        prompt = self.build().to_dict()
+        titled = {nid: {**node, "_meta": {"title": f"node {nid}"}} for nid, node in prompt.items()}
+        self.assertEqual(self.nodes.workflow_hash(prompt), self.nodes.workflow_hash(titled))
+
+    def test_depends_on_values(self):
+        self.assertNotEqual(self.build(seeds=(0,)).canonical_hash(), self.build(seeds=(1,)).canonical_hash())
+
+
+class OptimizeTest(WorkflowTestCase):
+    def test_merges_duplicates(self):
+        n = self.nodes
+        with n.Workflow() as wf:
+            for text in ("a", "b"):
+                model, clip, vae = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+                cond = n.conditioning.CLIPTextEncode(text, clip).output(0)
+                latent = n.latent.EmptyLatentImage(512, 512, 1).output(0)
+                samples = n.sampling.KSampler(model, 0, 20, 8.0, "euler", "normal", cond, cond, latent).output(0)
+                n.image.SaveImage(n.latent.VAEDecode(samples, vae).output(0), "out")
+
+        replaced = wf.optimize()
+        # the second loader and latent are merged into the first ones
+        self.assertEqual(len(replaced), 2)
+        prompt = wf.to_dict()
+        class_types = [node["class_type"] for node in prompt.values()]
+        self.assertEqual(class_types.count("CheckpointLoaderSimple"), 1)
+        self.assertEqual(class_types.count("EmptyLatentImage"), 1)
+        self.assertEqual(class_types.count("SaveImage"), 2)
+        for node in prompt.values():
+            for value in node["inputs"].values():
+                if isinstance(value, list):
+                    self.assertIn(value[0], prompt)
+        wf.check()
+
+    def test_keeps_sinks(self):
+        wf = self.build(seeds=(0, 0))
+        replaced = wf.optimize()
+        class_types = [node["class_type"] for node in wf.to_dict().values()]
+        self.assertEqual(class_types.count("SaveImage"), 2)
+        self.assertEqual(class_types.count("KSampler"), 1)
+        self.assertEqual(len(replaced), 2)  # KSampler and VAEDecode
+
+
+class PruneTest(WorkflowTestCase):
+    def test_prune(self):
+        wf = self.build(dead=True)
+        full = wf.to_dict()
+        pruned = wf.to_dict(prune=True)
+        self.assertEqual(len(full) - len(pruned), 1)
+        self.assertNotIn("unused", [node["inputs"].get("text") for node in pruned.values()])
+        # to_dict(prune=True) does not modify the workflow
+        self.assertEqual(wf.to_dict(), full)
+
+        removed = wf.prune()
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(wf.to_dict(), pruned)
+        self.assertEqual(wf.prune(), [])
+
+    def test_reachable(self):
+        wf = self.build(dead=True)
+        self.assertEqual(len(wf.reachable()), len(wf.to_dict()) - 1)
+
+    def test_no_output_nodes(self):
+        n = self.nodes
+        with n.Workflow() as wf:
+            _, clip, _ = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+            n.conditioning.CLIPTextEncode("a cat", clip)
+        full = wf.to_dict()
+        for f in (wf.reachable, wf.prune, lambda: wf.to_dict(prune=True)):
+            with self.assertRaisesRegex(ValueError, "no output nodes"):
+                f()
+        self.assertEqual(wf.to_dict(), full)
+        self.assertEqual(n.Workflow().reachable(), set())
+
+
+class TopologicalTest(WorkflowTestCase):
+    def test_order(self):
+        prompt = self.build(seeds=(0, 1)).to_dict(topological=True)
+        self.assertEqual(list(prompt), [str(i) for i in range(len(prompt))])
+        position = {nid: i for i, nid in enumerate(prompt)}
+        for nid, node in prompt.items():
+            for value in node["inputs"].values():
+                if isinstance(value, list):
+                    self.assertLess(position[value[0]], position[nid])
+
+    def test_stable(self):
+        a = self.build(seeds=(0, 1)).to_dict(topological=True)
+        b = self.build(seeds=(0, 1), reverse_encoders=True).to_dict(topological=True)
+        self.assertEqual(a, b)
+
+    def test_cycle(self):
+        prompt = {
+            "1": {"class_type": "VAEDecode", "inputs": {"samples": ["2", 0]}},
+            "2": {"class_type": "VAEDecode", "inputs": {"samples": ["1", 0]}},
+        }
+        with self.assertRaises(ValueError):
+            self.nodes.topological_prompt(prompt)
+
+
+class ComponentTest(WorkflowTestCase):
+    def test_stamp(self):
+        n = self.nodes
+        with n.Component.recording() as block:
+            sampler = n.sampling.KSampler(seed=0, steps=20, cfg=8.0, sampler_name="euler", scheduler="normal", denoise=0.5)
+            images = n.latent.VAEDecode(sampler.output(0)).output(0)
+
+        hires = n.Component(
+            block,
+            inputs={
+                "model": sampler.input("model"),
+                "positive": sampler.input("positive"),
+                "negative": sampler.input("negative"),
+                "latent": sampler.input("latent_image"),
+                "vae": images.node.input("vae"),
+                "seed": sampler.input("seed"),
+            },
+            outputs={"images": images},
+        )
+
+        with n.Workflow() as wf:
+            model, clip, vae = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+            cond = n.conditioning.CLIPTextEncode("a cat", clip).output(0)
+            latent = n.latent.EmptyLatentImage(512, 512, 1).output(0)
+            for seed in range(3):
+                out = hires.stamp(
+                    wf,
+                    {"model": model, "positive": cond, "negative": cond, "latent": latent, "vae": vae, "seed": seed},
+                )
+                n.image.SaveImage(out.output("images"), "out")
+
+        prompt = wf.to_dict()
+        samplers = [node for node in prompt.values() if node["class_type"] == "KSampler"]
+        self.assertEqual([node["inputs"]["seed"] for node in samplers], [0, 1, 2])
+        self.assertTrue(all(node["inputs"]["denoise"] == 0.5 for node in samplers))
+
+        # same as building the nodes one by one
+        with n.Workflow() as expected:
+            model, clip, vae = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+            cond = n.conditioning.CLIPTextEncode("a cat", clip).output(0)
+            latent = n.latent.EmptyLatentImage(512, 512, 1).output(0)
+            for seed in range(3):
+                samples = n.sampling.KSampler(model, seed, 20, 8.0, "euler", "normal", cond, cond, latent, 0.5).output(0)
+                n.image.SaveImage(n.latent.VAEDecode(samples, vae).output(0), "out")
+        self.assertEqual(prompt, expected.to_dict())
+
+    def test_type_mismatch(self):
+        n = self.nodes
+        with n.Component.recording() as block:
+            decode = n.latent.VAEDecode()
+        component = n.Component(block, inputs={"vae": decode.input("vae")})
+        with n.Workflow() as wf:
+            model, _, _ = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+            with self.assertRaises(ValueError):
+                component.stamp(wf, {"vae": model})
+
+
+class BulkPromptTest(WorkflowTestCase):
+    def test_same_as_to_dict(self):
+        prompt = self.build().to_dict()
+        ids = list(prompt)
+        class_types = [prompt[nid]["class_type"] for nid in ids]
+        inputs = [{k: v for k, v in prompt[nid]["inputs"].items() if not isinstance(v, list)} for nid in ids]
+        src, src_index, dst, dst_index = [], [], [], []
+        for i, nid in enumerate(ids):
+            for name, value in prompt[nid]["inputs"].items():
+                if isinstance(value, list):
+                    src.append(ids.index(value[0]))
+                    src_index.append(value[1])
+                    dst.append(i)
+                    dst_index.append(name)
+
+        bulk = self.nodes.bulk_prompt(class_types, inputs, src, src_index, dst, dst_index)
+        self.assertEqual(bulk, prompt)
+
+    def test_errors(self):
+        bulk_prompt = self.nodes.bulk_prompt
+        with self.assertRaises(ValueError):
+            # CheckpointLoaderSimple:0 (MODEL) -> CLIPTextEncode.clip (CLIP)
+            bulk_prompt(["CheckpointLoaderSimple", "CLIPTextEncode"], [{"ckpt_name": CKPT}, {"text": "x"}], [0], [0], [1], ["clip"])
+        with self.assertRaises(ValueError):
+            bulk_prompt(["CheckpointLoaderSimple"], [{"ckpt_name": "missing.safetensors"}])
+        with self.assertRaises(ValueError):
+            bulk_prompt(["NoSuchNode"])
+        with self.assertRaises(ValueError):
+            bulk_prompt(["VAEDecode", "VAEDecode"], None, [0, 1], [0, 0], [1, 0], ["samples", "samples"])
+
+
+class LoadTest(WorkflowTestCase):
+    def test_api_round_trip(self):
+        prompt = self.build(seeds=(0, 1)).to_dict()
+        self.assertEqual(self.nodes.load_api_prompt(prompt).to_dict(), prompt)
+
+    def test_api_non_numeric_ids(self):
+        prompt = self.build().to_dict()
+        renamed = {f"g:{nid}": node for nid, node in copy.deepcopy(prompt).items()}
+        for node in renamed.values():
+            for name, value in node["inputs"].items():
+                if isinstance(value, list):
+                    node["inputs"][name] = [f"g:{value[0]}", value[1]]
+        wf = self.nodes.load_api_prompt(renamed)
+        self.assertEqual(wf.canonical_hash(), self.nodes.workflow_hash(prompt))
+
+    def test_api_errors(self):
+        prompt = self.build().to_dict()
+        sampler = next(node for node in prompt.values() if node["class_type"] == "KSampler")
+        sampler["inputs"]["sampler_name"] = "nope"
+        with self.assertRaises(ValueError):
+            self.nodes.load_api_prompt(prompt)
+        self.nodes.load_api_prompt(prompt, check=False)
+
+    def test_ui(self):
+        def link(id, src, src_slot, dst, dst_slot, typ):
+            return [id, src, src_slot, dst, dst_slot, typ]
+
+        def slot(name, typ, link_id):
+            return {"name": name, "type": typ, "link": link_id}
+
+        ui = {
+            "version": 0.4,
+            "nodes": [
+                {"id": 1, "type": "CheckpointLoaderSimple", "mode": 0, "widgets_values": [CKPT]},
+                {"id": 2, "type": "CLIPTextEncode", "mode": 0, "inputs": [slot("clip", "CLIP", 1)], "widgets_values": ["a cat"]},
+                {"id": 3, "type": "Reroute", "mode": 0, "inputs": [slot("", "*", 2)]},
+                {"id": 4, "type": "EmptyLatentImage", "mode": 0, "widgets_values": [512, 512, 1]},
+                {
+                    "id": 5,
+                    "type": "KSampler",
+                    "mode": 0,
+                    "inputs": [
+                        slot("model", "MODEL", 3),
+                        slot("positive", "CONDITIONING", 4),
+                        slot("negative", "CONDITIONING", 5),
+                        slot("latent_image", "LATENT", 6),
+                        {**slot("seed", "INT", 7), "widget": {"name": "seed"}},
+                    ],
+                    "widgets_values": [0, "randomize", 20, 8.0, "euler", "normal", 1.0],
+                },
+                {"id": 6, "type": "PrimitiveNode", "mode": 0, "widgets_values": [42, "fixed"]},
+                {"id": 7, "type": "VAEDecode", "mode": 0, "inputs": [slot("samples", "LATENT", 8), slot("vae", "VAE", 9)]},
+                {"id": 8, "type": "SaveImage", "mode": 0, "inputs": [slot("images", "IMAGE", 10)], "widgets_values": ["out"]},
+                # muted
+                {"id": 9, "type": "CLIPTextEncode", "mode": 2, "inputs": [slot("clip", "CLIP", 11)], "widgets_values": ["unused"]},
+            ],
+            "links": [
+                link(1, 1, 1, 2, 0, "CLIP"),
+                link(2, 2, 0, 3, 0, "CONDITIONING"),
+                link(3, 1, 0, 5, 0, "MODEL"),
+                link(4, 3, 0, 5, 1, "CONDITIONING"),
+                link(5, 3, 0, 5, 2, "CONDITIONING"),
+                link(6, 4, 0, 5, 3, "LATENT"),
+                link(7, 6, 0, 5, 4, "INT"),
+                link(8, 5, 0, 7, 0, "LATENT"),
+                link(9, 1, 2, 7, 1, "VAE"),
+                link(10, 7, 0, 8, 0, "IMAGE"),
+                link(11, 1, 1, 9, 0, "CLIP"),
+            ],
+        }
+
+        n = self.nodes
+        with n.Workflow() as expected:
+            model, clip, vae = n.loaders.CheckpointLoaderSimple(CKPT).outputs()
+            cond = n.conditioning.CLIPTextEncode("a cat", clip).output(0)
+            latent = n.latent.EmptyLatentImage(512, 512, 1).output(0)
+            samples = n.sampling.KSampler(model, 42, 20, 8.0, "euler", "normal", cond, cond, latent).output(0)
+            n.image.SaveImage(n.latent.VAEDecode(samples, vae).output(0), "out")
+
+        wf = n.load_ui_workflow(ui)
+        self.assertEqual(sorted(wf.to_dict(), key=int), ["1", "2", "4", "5", "7", "8"])
+        self.assertEqual(wf.canonical_hash(), expected.canonical_hash())
+
+    def test_ui_round_trip(self):
+        wf = self.build(seeds=(0, 1))
+        for version in ("0.4", "1.0"):
+            ui = wf.to_ui_dict(version)
+            self.assertEqual(self.nodes.load_ui_workflow(ui).to_dict(), wf.to_dict(), version)
+
+    def test_ui_layout(self):
+        ui = self.build().to_ui_dict()
+        x = {node["id"]: node["pos"][0] for node in ui["nodes"]}
+        for link in ui["links"]:
+            _, src, _, dst, _, _ = link
+            self.assertLess(x[src], x[dst])
+
+
+class OptionalWidgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        nodes = fixtures.core_nodes(4, 4)
+        nodes["PreviewOptions"] = fixtures._node_class(
+            "PreviewOptions",
+            {"optional": {"count": ("INT",), "mode": (["a", "b"],)}},
+            (),
+            "image",
+            OUTPUT_NODE=True,
+        )
+        cls.nodes = load_stub(nodes)
+
+    def load(self, widgets_values, check: bool = True) -> dict:
+        ui = {"nodes": [{"id": 1, "type": "PreviewOptions", "mode": 0, "widgets_values": widgets_values}], "links": []}
+        return self.nodes.load_ui_workflow(ui, check=check).to_dict()["1"]["inputs"]
+
+    def test_unset(self):
+        for widgets_values in ([None, None], [None], [], None, {"count": None}):
+            for check in (True, False):
+                self.assertEqual(self.load(widgets_values, check), {}, (widgets_values, check))
+
+    def test_set(self):
+        self.assertEqual(self.load([3, "b"]), {"count": 3, "mode": "b"})
+        self.assertEqual(self.load([None, "b"]), {"mode": "b"})
+        with self.assertRaises(ValueError):
+            self.load([None, "c"])
+
+    def test_ui_round_trip(self):
+        n = self.nodes
+        with n.Workflow() as wf:
+            wf.add(n.image.PreviewOptions())
+            wf.add(n.image.PreviewOptions(count=2))
+            wf.add(n.image.PreviewOptions(mode="a"))
+        prompt = wf.to_dict()
+        self.assertEqual([node["inputs"] for node in prompt.values()], [{}, {"count": 2}, {"mode": "a"}])
+        for version in ("0.4", "1.0"):
+            ui = wf.to_ui_dict(version)
+            for check in (True, False):
+                self.assertEqual(n.load_ui_workflow(ui, check=check).to_dict(), prompt, (version, check))
+
+
+if __name__ == "__main__":
+    unittest.main()